@@ -0,0 +1,401 @@
+#!/usr/bin/env python3
+"""
+Triangle-Inequality Accelerated K-Means
+
+Exact Lloyd iterations that skip point-centroid distances the triangle
+inequality proves cannot change an assignment:
+
+- hamerly: one upper bound (distance to the assigned centroid) and one
+           lower bound (distance to the second-closest centroid) per point;
+           O(n) bound memory, best for low k
+- elkan:   one lower bound per (point, centroid) pair plus half the
+           centroid-centroid distances; O(n k) bound memory, skips more
+           work at higher k
+- lloyd:   reference, every distance every iteration
+
+'auto' picks Hamerly below ELKAN_MIN_K clusters and Elkan from there on.
+All algorithms give the same assignments as plain Lloyd iterations from
+the same start (up to floating point ties), stop early once no label
+changes, and optionally stop when the relative centroid shift falls
+below tol. KMeansRunStats counts the distances actually computed.
+
+Usage:
+    from accelerated_kmeans import accelerated_kmeans
+    centroids, labels, stats = accelerated_kmeans(vectors, vectors[:k], max_iter=10)
+    print(stats.skipped_ratio)
+"""
+
+import numpy as np
+from dataclasses import dataclass
+from typing import Dict, List, Tuple
+
+from centroid_assignment import DEFAULT_BLOCK_BYTES, assign_nearest, compute_block_rows, iter_squared_distance_blocks
+
+
+ACCELERATED_ALGORITHMS = ['auto', 'hamerly', 'elkan', 'lloyd']
+
+# 'auto' switches from Hamerly to Elkan at this many clusters
+ELKAN_MIN_K = 32
+
+
+@dataclass
+class KMeansRunStats:
+    """Distance work of one k-means run."""
+    algorithm: str
+    k: int
+    num_vectors: int
+    max_iter: int
+    iterations: int = 0
+    converged: bool = False
+    distance_evaluations: int = 0
+
+    @property
+    def lloyd_evaluations(self) -> int:
+        """Distances plain Lloyd computes over the same number of iterations."""
+        return self.num_vectors * self.k * self.iterations
+
+    @property
+    def skipped_ratio(self) -> float:
+        """Fraction of the same-iteration Lloyd distances skipped by the bounds."""
+        if self.lloyd_evaluations == 0:
+            return 0.0
+        return 1.0 - self.distance_evaluations / self.lloyd_evaluations
+
+    @property
+    def skipped_ratio_vs_fixed(self) -> float:
+        """Fraction skipped against max_iter full Lloyd passes (bounds and early exit)."""
+        fixed = self.num_vectors * self.k * self.max_iter
+        if fixed == 0:
+            return 0.0
+        return 1.0 - self.distance_evaluations / fixed
+
+    def to_dict(self) -> Dict:
+        return {
+            'algorithm': self.algorithm,
+            'k': self.k,
+            'num_vectors': self.num_vectors,
+            'max_iter': self.max_iter,
+            'iterations': self.iterations,
+            'converged': self.converged,
+            'distance_evaluations': self.distance_evaluations,
+            'lloyd_evaluations': self.lloyd_evaluations,
+            'skipped_ratio': self.skipped_ratio,
+            'skipped_ratio_vs_fixed': self.skipped_ratio_vs_fixed
+        }
+
+
+def resolve_algorithm(algorithm: str, k: int) -> str:
+    """Concrete algorithm for a requested one ('auto' resolves on k)."""
+    if algorithm not in ACCELERATED_ALGORITHMS:
+        raise ValueError(f"Unknown k-means algorithm: {algorithm} (expected one of {ACCELERATED_ALGORITHMS})")
+    if k < 2:
+        # Bounds need a second centroid; one cluster is a single mean anyway
+        return 'lloyd'
+    if algorithm == 'auto':
+        return 'elkan' if k >= ELKAN_MIN_K else 'hamerly'
+    return algorithm
+
+
+def update_centroids(
+    vectors: np.ndarray,
+    labels: np.ndarray,
+    centroids: np.ndarray,
+    clusters: np.ndarray = None
+) -> np.ndarray:
+    """
+    Cluster means accumulated in float64; empty clusters keep their centroid.
+
+    Args:
+        vectors: (n, d) array of vectors
+        labels: (n,) cluster index per vector
+        centroids: (k, d) current centroids
+        clusters: optional cluster indices to recompute; the others have
+            unchanged members and therefore unchanged means
+
+    Returns:
+        (k, d) new centroids in the dtype of centroids
+    """
+    k = len(centroids)
+    new_centroids = centroids.copy()
+    if clusters is None:
+        rows = np.arange(len(labels))
+    else:
+        rows = np.flatnonzero(np.isin(labels, clusters))
+    if len(rows) == 0:
+        return new_centroids
+
+    row_labels = labels[rows]
+    counts = np.bincount(row_labels, minlength=k)
+    order = rows[np.argsort(row_labels, kind='stable')]
+    present = np.flatnonzero(counts)
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])[present]
+
+    # Gathering sorted row indices keeps the read mostly forward
+    sums = np.add.reduceat(np.asarray(vectors[order], dtype=np.float64), starts, axis=0)
+    new_centroids[present] = sums / counts[present, None]
+    return new_centroids
+
+
+def pair_distances(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """Row-wise Euclidean distances ||vectors[i] - centroids[i]|| in float64."""
+    diff = np.asarray(vectors, dtype=np.float64) - centroids
+    return np.sqrt(np.einsum('ij,ij->i', diff, diff))
+
+
+def centroid_separation(centroids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Centroid-centroid distances and half the distance to each nearest other centroid.
+
+    Returns:
+        cc: (k, k) float64 centroid distance matrix
+        s: (k,) 0.5 * min_{j' != j} cc[j, j']
+    """
+    c = np.asarray(centroids, dtype=np.float64)
+    sq_norms = np.einsum('ij,ij->i', c, c)
+    cc = np.sqrt(np.maximum(sq_norms[:, None] - 2.0 * (c @ c.T) + sq_norms[None, :], 0.0))
+    np.fill_diagonal(cc, np.inf)
+    s = 0.5 * cc.min(axis=1)
+    np.fill_diagonal(cc, 0.0)
+    return cc, s
+
+
+def full_distances(
+    vectors: np.ndarray,
+    centroids: np.ndarray,
+    block_bytes: int = DEFAULT_BLOCK_BYTES
+) -> np.ndarray:
+    """Blocked (n, k) Euclidean distance matrix in float64."""
+    distances = np.empty((len(vectors), len(centroids)), dtype=np.float64)
+    for start, stop, sq_dists in iter_squared_distance_blocks(vectors, centroids, block_bytes):
+        distances[start:stop] = np.sqrt(sq_dists)
+    return distances
+
+
+def top_two(
+    vectors: np.ndarray,
+    centroids: np.ndarray,
+    block_bytes: int = DEFAULT_BLOCK_BYTES
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Nearest centroid, its distance and the second-nearest distance per vector.
+
+    Returns:
+        labels: (n,) int64 nearest-centroid indices
+        d1, d2: (n,) float64 nearest and second-nearest distances
+    """
+    n = len(vectors)
+    labels = np.empty(n, dtype=np.int64)
+    d1 = np.empty(n, dtype=np.float64)
+    d2 = np.empty(n, dtype=np.float64)
+    for start, stop, sq_dists in iter_squared_distance_blocks(vectors, centroids, block_bytes):
+        rows = np.arange(stop - start)
+        block_labels = np.argmin(sq_dists, axis=1)
+        labels[start:stop] = block_labels
+        d1[start:stop] = sq_dists[rows, block_labels]
+        sq_dists[rows, block_labels] = np.inf
+        d2[start:stop] = sq_dists.min(axis=1)
+    return labels, np.sqrt(d1), np.sqrt(d2)
+
+
+def hamerly_step(
+    vectors: np.ndarray,
+    centroids: np.ndarray,
+    shifts: np.ndarray,
+    labels: np.ndarray,
+    upper: np.ndarray,
+    lower: np.ndarray,
+    block_bytes: int = DEFAULT_BLOCK_BYTES
+) -> int:
+    """
+    One Hamerly assignment pass after centroids moved by shifts.
+
+    labels, upper and lower are updated in place.
+
+    Returns:
+        number of point-centroid distances computed
+    """
+    k = len(centroids)
+    upper += shifts[labels]
+    # The second-closest bound drops by the largest shift among the other centroids
+    largest = np.argsort(shifts)[::-1][:2]
+    lower -= np.where(labels == largest[0], shifts[largest[1]], shifts[largest[0]])
+
+    _, s = centroid_separation(centroids)
+    bound = np.maximum(s[labels], lower)
+    candidates = np.flatnonzero(upper > bound)
+    if len(candidates) == 0:
+        return 0
+
+    # Tighten the upper bound before paying for a full scan
+    upper[candidates] = pair_distances(vectors[candidates], centroids[labels[candidates]])
+    evaluations = len(candidates)
+    candidates = candidates[upper[candidates] > bound[candidates]]
+    if len(candidates):
+        labels[candidates], upper[candidates], lower[candidates] = top_two(
+            np.asarray(vectors[candidates]), centroids, block_bytes
+        )
+        evaluations += len(candidates) * k
+    return evaluations
+
+
+def elkan_step(
+    vectors: np.ndarray,
+    centroids: np.ndarray,
+    shifts: np.ndarray,
+    labels: np.ndarray,
+    upper: np.ndarray,
+    lower: np.ndarray,
+    block_bytes: int = DEFAULT_BLOCK_BYTES
+) -> int:
+    """
+    One Elkan assignment pass after centroids moved by shifts.
+
+    Candidate rows are processed in blocks; within a block every
+    (point, centroid) pair that survives both bounds is computed at once.
+    labels, upper and lower ((n, k) bounds) are updated in place.
+
+    Returns:
+        number of point-centroid distances computed
+    """
+    k, d = centroids.shape
+    np.maximum(lower - shifts[None, :], 0.0, out=lower)
+    upper += shifts[labels]
+
+    cc, s = centroid_separation(centroids)
+    candidates = np.flatnonzero(upper > s[labels])
+    evaluations = 0
+    # Gathered pair differences are (pairs, d); size blocks for the worst case of k pairs per row
+    block_rows = compute_block_rows(k * d, 8, block_bytes)
+
+    for start in range(0, len(candidates), block_rows):
+        rows = candidates[start:start + block_rows]
+        local = np.arange(len(rows))
+        row_labels = labels[rows]
+        row_upper = upper[rows]
+        row_lower = lower[rows]
+        half_cc = 0.5 * cc[row_labels]
+
+        mask = (row_upper[:, None] > row_lower) & (row_upper[:, None] > half_cc)
+        mask[local, row_labels] = False
+        active = np.flatnonzero(mask.any(axis=1))
+        if len(active) == 0:
+            continue
+
+        # Tighten the upper bound of rows that still have candidate centroids
+        row_upper[active] = pair_distances(vectors[rows[active]], centroids[row_labels[active]])
+        row_lower[active, row_labels[active]] = row_upper[active]
+        evaluations += len(active)
+
+        mask &= (row_upper[:, None] > row_lower) & (row_upper[:, None] > half_cc)
+        pair_rows, pair_cols = np.nonzero(mask)
+        evaluations += len(pair_rows)
+
+        candidate_dists = np.full((len(rows), k), np.inf)
+        candidate_dists[local, row_labels] = row_upper
+        if len(pair_rows):
+            dists = pair_distances(vectors[rows[pair_rows]], centroids[pair_cols])
+            row_lower[pair_rows, pair_cols] = dists
+            candidate_dists[pair_rows, pair_cols] = dists
+
+        # Pruned centroids are provably no closer than the current one
+        new_labels = np.argmin(candidate_dists, axis=1)
+        labels[rows] = new_labels
+        upper[rows] = candidate_dists[local, new_labels]
+        lower[rows] = row_lower
+
+    return evaluations
+
+
+def accelerated_kmeans(
+    vectors: np.ndarray,
+    init_centroids: np.ndarray,
+    max_iter: int = 10,
+    tol: float = 0.0,
+    algorithm: str = 'auto',
+    block_bytes: int = DEFAULT_BLOCK_BYTES
+) -> Tuple[np.ndarray, np.ndarray, KMeansRunStats]:
+    """
+    Lloyd k-means from explicit initial centroids with bound-based pruning.
+
+    Each iteration assigns every vector, then moves the centroids to their
+    cluster means. The run stops after max_iter iterations, as soon as an
+    assignment changes no label, or when the centroid shift relative to
+    the centroid norm falls below tol (tol=0 disables the shift test).
+
+    Args:
+        vectors: (n, d) array of vectors
+        init_centroids: (k, d) initial centroids
+        max_iter: maximum assignment passes
+        tol: relative centroid shift tolerance
+        algorithm: 'auto', 'hamerly', 'elkan' or 'lloyd'
+        block_bytes: byte budget for one distance block
+
+    Returns:
+        centroids: (k, d) centroids in the dtype of init_centroids
+        labels: (n,) cluster index per vector from the last assignment
+        stats: distance work and convergence of the run
+    """
+    centroids = np.array(init_centroids, copy=True)
+    n, k = len(vectors), len(centroids)
+    algorithm = resolve_algorithm(algorithm, k)
+    stats = KMeansRunStats(algorithm=algorithm, k=k, num_vectors=n, max_iter=max_iter)
+
+    labels = upper = lower = shifts = None
+    for iteration in range(max_iter):
+        if labels is None:
+            # First pass: every distance, which also seeds the bounds
+            stats.distance_evaluations += n * k
+            if algorithm == 'elkan':
+                lower = full_distances(vectors, centroids, block_bytes)
+                labels = np.argmin(lower, axis=1)
+                upper = lower[np.arange(n), labels]
+            elif algorithm == 'hamerly':
+                labels, upper, lower = top_two(vectors, centroids, block_bytes)
+            else:
+                labels, _ = assign_nearest(vectors, centroids, block_bytes)
+            changed = n
+            moved_clusters = None
+        else:
+            previous = labels.copy()
+            if algorithm == 'elkan':
+                stats.distance_evaluations += elkan_step(vectors, centroids, shifts, labels, upper, lower, block_bytes)
+            elif algorithm == 'hamerly':
+                stats.distance_evaluations += hamerly_step(vectors, centroids, shifts, labels, upper, lower, block_bytes)
+            else:
+                stats.distance_evaluations += n * k
+                labels, _ = assign_nearest(vectors, centroids, block_bytes)
+            moved = labels != previous
+            changed = int(np.count_nonzero(moved))
+            moved_clusters = np.union1d(previous[moved], labels[moved])
+        stats.iterations += 1
+
+        if iteration > 0 and changed == 0:
+            # Same labels give the same means: a fixed point of Lloyd
+            stats.converged = True
+            break
+
+        new_centroids = update_centroids(vectors, labels, centroids, moved_clusters)
+        shifts = pair_distances(new_centroids, centroids.astype(np.float64))
+        centroids = new_centroids
+
+        if tol > 0 and np.sqrt(np.sum(shifts ** 2)) <= tol * (np.linalg.norm(centroids) + 1e-12):
+            stats.converged = True
+            break
+
+    return centroids, labels, stats
+
+
+def summarize_kmeans_stats(runs: List[KMeansRunStats]) -> Dict:
+    """Totals and per-run details of a list of k-means runs."""
+    computed = sum(run.distance_evaluations for run in runs)
+    lloyd = sum(run.lloyd_evaluations for run in runs)
+    fixed = sum(run.num_vectors * run.k * run.max_iter for run in runs)
+    return {
+        'num_fits': len(runs),
+        'distance_evaluations': int(computed),
+        'lloyd_evaluations': int(lloyd),
+        'fixed_lloyd_evaluations': int(fixed),
+        'skipped_ratio': float(1.0 - computed / lloyd) if lloyd else 0.0,
+        'skipped_ratio_vs_fixed': float(1.0 - computed / fixed) if fixed else 0.0,
+        'fits': [run.to_dict() for run in runs]
+    }
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+Batched Exact Search
+
+Top-k cosine-similarity search over a passage matrix, batched over queries:
+
+- passages are normalized once, when the searcher is built
+- each block of queries is scored against one block of passages at a time
+  with a single GEMM, so the (queries, passages) score matrix never exceeds
+  the block byte budget
+- top-k is selected with argpartition per passage block and merged into a
+  running (queries, k) top-k, then sorted once at the end
+
+Results are ordered by descending similarity, ties by ascending passage
+index.
+
+Usage:
+    from batched_search import ExactSearcher
+    searcher = ExactSearcher(passage_embeddings)
+    indices, scores = searcher.search_batch(query_embeddings, k=100)   # (q, k) each
+"""
+
+import numpy as np
+from typing import Callable, Tuple
+
+from centroid_assignment import DEFAULT_BLOCK_BYTES, compute_block_rows
+
+
+# Queries scored together in one GEMM
+DEFAULT_QUERY_BLOCK = 256
+
+# Added to norms before dividing, as in the per-query search it replaces
+NORM_EPSILON = 1e-10
+
+
+def normalize_rows(vectors: np.ndarray, block_rows: int = 65536) -> np.ndarray:
+    """
+    Unit-normalized copy of vectors, computed in row blocks.
+
+    Returns:
+        (n, d) array in the dtype of vectors (float32 for integer input)
+    """
+    dtype = np.result_type(vectors.dtype, np.float32)
+    normalized = np.empty(vectors.shape, dtype=dtype)
+    for start in range(0, len(vectors), block_rows):
+        block = np.asarray(vectors[start:start + block_rows], dtype=dtype)
+        normalized[start:start + len(block)] = block / (np.linalg.norm(block, axis=1, keepdims=True) + NORM_EPSILON)
+    return normalized
+
+
+def sort_top_k(scores: np.ndarray, indices: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Order each row of candidates by descending score, ties by ascending index."""
+    order = np.lexsort((indices, -scores), axis=-1)
+    return np.take_along_axis(indices, order, axis=1), np.take_along_axis(scores, order, axis=1)
+
+
+def select_top_k(scores: np.ndarray, indices: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Keep the k highest-scoring candidates of each row (unordered).
+
+    Candidates tied with the k-th score are kept by ascending index, so the
+    selection agrees with sort_top_k even when a tie straddles the cutoff.
+    """
+    if scores.shape[1] <= k:
+        return scores, indices
+    keep = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    kth = np.take_along_axis(scores, keep[:, k - 1:], axis=1)
+    tied = np.flatnonzero((scores == kth).sum(axis=1) > 1)
+    if len(tied) > 0:
+        # Strictly better candidates rank first, then ties by index, the rest last
+        rows, row_kth = scores[tied], kth[tied]
+        priority = np.where(rows > row_kth, -1, np.where(rows == row_kth, indices[tied], np.iinfo(np.int64).max))
+        keep[tied] = np.argpartition(priority, k - 1, axis=1)[:, :k]
+    return np.take_along_axis(scores, keep, axis=1), np.take_along_axis(indices, keep, axis=1)
+
+
+def blocked_top_k(
+    score_block: Callable[[np.ndarray, int, int], np.ndarray],
+    queries: np.ndarray,
+    num_rows: int,
+    k: int,
+    block_rows: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Top-k rows per query, scoring row blocks and merging a running top-k.
+
+    Args:
+        score_block: (queries, start, stop) -> (len(queries), stop - start) scores
+        queries: (q, d) query block
+        num_rows: number of rows to search
+        k: results per query (clamped to num_rows)
+        block_rows: rows scored per call
+
+    Returns:
+        indices, scores: (q, k) arrays, highest score first
+    """
+    k = min(k, num_rows)
+    best_scores = None
+    best_indices = None
+    for start in range(0, num_rows, block_rows):
+        stop = min(start + block_rows, num_rows)
+        scores = score_block(queries, start, stop)
+        indices = np.broadcast_to(np.arange(start, stop), scores.shape)
+        scores, indices = select_top_k(scores, indices, k)
+        if best_scores is not None:
+            scores = np.concatenate([best_scores, scores], axis=1)
+            indices = np.concatenate([best_indices, indices], axis=1)
+            scores, indices = select_top_k(scores, indices, k)
+        best_scores, best_indices = scores, indices
+    if best_scores is None:
+        empty = np.zeros((len(queries), 0))
+        return empty.astype(np.int64), empty
+    return sort_top_k(best_scores, best_indices)
+
+
+def search_in_blocks(
+    score_block: Callable[[np.ndarray, int, int], np.ndarray],
+    queries: np.ndarray,
+    num_rows: int,
+    k: int,
+    dtype: np.dtype,
+    block_bytes: int = DEFAULT_BLOCK_BYTES,
+    query_block: int = DEFAULT_QUERY_BLOCK
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Normalize queries and run blocked_top_k over query blocks.
+
+    Row blocks are sized so one (query_block, rows) score matrix of dtype
+    fits in block_bytes.
+
+    Returns:
+        indices, scores: (q, min(k, num_rows)) arrays, highest score first
+    """
+    queries = normalize_rows(np.atleast_2d(queries)).astype(dtype, copy=False)
+    k = min(k, num_rows)
+    indices = np.empty((len(queries), k), dtype=np.int64)
+    scores = np.empty((len(queries), k), dtype=dtype)
+    block_rows = compute_block_rows(min(query_block, max(1, len(queries))), np.dtype(dtype).itemsize, block_bytes)
+    for start in range(0, len(queries), query_block):
+        block = queries[start:start + query_block]
+        indices[start:start + len(block)], scores[start:start + len(block)] = blocked_top_k(
+            score_block, block, num_rows, k, block_rows
+        )
+    return indices, scores
+
+
+class ExactSearcher:
+    """Exact cosine-similarity search over a passage matrix normalized once."""
+
+    def __init__(self, passages: np.ndarray, block_bytes: int = DEFAULT_BLOCK_BYTES):
+        self.passages = normalize_rows(passages)
+        self.block_bytes = block_bytes
+
+    def __len__(self) -> int:
+        return len(self.passages)
+
+    def score_block(self, queries: np.ndarray, start: int, stop: int) -> np.ndarray:
+        """Cosine similarities of normalized queries with passages [start, stop)."""
+        return queries @ self.passages[start:stop].T
+
+    def search_batch(
+        self,
+        queries: np.ndarray,
+        k: int,
+        query_block: int = DEFAULT_QUERY_BLOCK
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Top-k passages for every query.
+
+        Args:
+            queries: (q, d) query embeddings (normalized here)
+            k: results per query
+            query_block: queries scored per GEMM
+
+        Returns:
+            indices: (q, k) passage indices, highest similarity first
+            scores: (q, k) cosine similarities
+        """
+        return search_in_blocks(self.score_block, queries, len(self), k, self.passages.dtype, self.block_bytes, query_block)
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+K-Means Tree Benchmark
+
+Compares hierarchical (tree) k-means against flat k-means with the same
+total k: fit time, then assignment throughput (vectors/sec), MSE per
+dimension and distance evaluations per vector for
+
+- flat:  exact search over the flat k-means centroids
+- tree:  descent through the k-means tree (approximate)
+- exact: exact search over the tree's leaves
+
+Usage:
+    python analysis/benchmark_kmeans_tree.py --num-vectors 200000 --dim 384 --k 1024 4096
+    python analysis/benchmark_kmeans_tree.py --input data/passages_embeddings.npy --k 4096 --branching 16 64
+"""
+
+import argparse
+import json
+import sys
+import time
+import numpy as np
+from pathlib import Path
+from typing import Dict, List
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from hierarchical_kmeans import DEFAULT_BRANCHING, compare_tree_to_flat, fit_kmeans_tree
+from streaming_kmeans import KMEANS_MODES, KMeansConfig
+
+FLAT_MODES = [mode for mode in KMEANS_MODES if mode != 'hierarchical']
+
+
+def benchmark_k(
+    vectors: np.ndarray,
+    k: int,
+    branchings: List[int],
+    flat_config: KMeansConfig,
+    seed: int,
+    repeats: int
+) -> Dict:
+    """Fit flat k-means once, then a tree per branching, and compare assignments."""
+    start = time.perf_counter()
+    flat_centroids = flat_config.fit_centroids(vectors, k, seed)
+    flat_fit_seconds = time.perf_counter() - start
+
+    result = {'k': k, 'flat_mode': flat_config.mode, 'flat_fit_seconds': flat_fit_seconds, 'trees': {}}
+    for branching in branchings:
+        start = time.perf_counter()
+        tree, _ = fit_kmeans_tree(vectors, k, branching, seed)
+        fit_seconds = time.perf_counter() - start
+
+        comparison = compare_tree_to_flat(vectors, tree, flat_centroids, repeats)
+        comparison['fit_seconds'] = fit_seconds
+        comparison['fit_speed_vs_flat'] = flat_fit_seconds / fit_seconds if fit_seconds > 0 else float('inf')
+        result['trees'][str(branching)] = comparison
+    return result
+
+
+def print_k(result: Dict):
+    """Print one k's comparison table."""
+    print(f"\nk={result['k']}  (flat {result['flat_mode']} fit: {result['flat_fit_seconds']:.2f}s)")
+    print(f"{'Assignment':<16} | {'fit s':>7} | {'vectors/sec':>12} | {'speed':>6} | "
+          f"{'dists/vec':>9} | {'MSE/dim':>12} | {'MSE ratio':>9}")
+    print("-" * 90)
+    flat_printed = False
+    for branching, comparison in result['trees'].items():
+        if not flat_printed:
+            flat = comparison['flat']
+            print(f"{'flat':<16} | {result['flat_fit_seconds']:>7.2f} | {flat['vectors_per_sec']:>12,.0f} | "
+                  f"{1.0:>5.2f}x | {flat['distance_evaluations_per_vector']:>9.1f} | "
+                  f"{flat['mse']:>12.4e} | {1.0:>9.4f}")
+            flat_printed = True
+        for name in ('tree', 'exact'):
+            stats = comparison[name]
+            label = f"b={branching} {name}"
+            print(f"{label:<16} | {comparison['fit_seconds']:>7.2f} | {stats['vectors_per_sec']:>12,.0f} | "
+                  f"{stats['speed_vs_flat']:>5.2f}x | {stats['distance_evaluations_per_vector']:>9.1f} | "
+                  f"{stats['mse']:>12.4e} | {stats['mse_vs_flat']:>9.4f}")
+        print(f"{'':<16}   depth {comparison['tree_depth']}, {comparison['tree_leaves']} leaves, "
+              f"tree = exact leaf for {comparison['tree_exact_agreement']:.1%} of vectors")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark hierarchical (tree) k-means against flat k-means with the same k'
+    )
+    parser.add_argument('--input', type=str, default=None,
+                        help='Optional .npy matrix of vectors (default: synthetic Gaussian vectors)')
+    parser.add_argument('--num-vectors', type=int, default=50000,
+                        help='Synthetic vectors, or rows taken from --input (default: 50000)')
+    parser.add_argument('--dim', type=int, default=384,
+                        help='Synthetic vector dimension (default: 384)')
+    parser.add_argument('--k', type=int, nargs='+', default=[256, 1024],
+                        help='Total cluster counts (default: 256 1024)')
+    parser.add_argument('--branching', type=int, nargs='+', default=[DEFAULT_BRANCHING],
+                        help=f'Tree branching factors (default: {DEFAULT_BRANCHING})')
+    parser.add_argument('--flat-mode', choices=FLAT_MODES, default='full',
+                        help='K-means mode of the flat reference (default: full)')
+    parser.add_argument('--repeats', type=int, default=3,
+                        help='Timed runs per assignment; the fastest is reported (default: 3)')
+    parser.add_argument('--seed', type=int, default=42,
+                        help='Random seed (default: 42)')
+    parser.add_argument('--output', type=str, default=None,
+                        help='Optional JSON file for the results')
+
+    args = parser.parse_args()
+    if min(args.branching) < 2:
+        parser.error('--branching values must be at least 2')
+
+    if args.input:
+        vectors = np.load(args.input, mmap_mode='r')[:args.num_vectors]
+        vectors = np.asarray(vectors, dtype=np.float32)
+    else:
+        rng = np.random.default_rng(args.seed)
+        vectors = rng.standard_normal((args.num_vectors, args.dim), dtype=np.float32) / np.sqrt(args.dim)
+    print(f"✓ Benchmarking {len(vectors):,} vectors of dim {vectors.shape[1]}")
+
+    flat_config = KMeansConfig(mode=args.flat_mode)
+    results = []
+    for k in args.k:
+        result = benchmark_k(vectors, k, args.branching, flat_config, args.seed, args.repeats)
+        print_k(result)
+        results.append(result)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'num_vectors': len(vectors),
+                'dim': int(vectors.shape[1]),
+                'input': args.input,
+                'results': results
+            }, f, indent=2)
+        print(f"\n✓ Saved results to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
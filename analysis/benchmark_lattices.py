@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Lattice Quantizer Benchmark
+
+Compares every lattice in LATTICE_QUANTIZERS against the reference cubic
+snap np.round(vectors / step) * step: vectors/sec and MSE per dimension.
+
+All lattices are scaled to the point density of step * Z^d, so at a given
+step they spend the same bits per dimension (reported as the per-dimension
+entropy of the reference grid coordinates) and only distortion differs.
+The normalized second moment MSE / step^2 is 1/12 ~= 0.0833 for the grid
+at fine steps; lower is better.
+
+Usage:
+    python analysis/benchmark_lattices.py --num-vectors 200000 --dim 384
+    python analysis/benchmark_lattices.py --input data/passages_embeddings.npy --steps 0.01 0.02 0.05
+"""
+
+import argparse
+import json
+import sys
+import time
+import numpy as np
+from pathlib import Path
+from typing import Callable, Dict, List
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from dtype_policy import mean_squared_error
+from lattice_quantizers import LATTICES, snap_to_lattice
+
+
+def round_snap(vectors: np.ndarray, step: float) -> np.ndarray:
+    """Reference cubic snap used by snap_to_grid."""
+    return np.round(vectors / step) * step
+
+
+def grid_bits_per_dim(vectors: np.ndarray, step: float) -> float:
+    """Mean per-dimension entropy (bits) of the cubic grid coordinates."""
+    coordinates = np.round(vectors / step).astype(np.int64)
+    entropies = []
+    for column in coordinates.T:
+        _, counts = np.unique(column, return_counts=True)
+        p = counts / len(column)
+        entropies.append(float(-np.sum(p * np.log2(p))))
+    return float(np.mean(entropies))
+
+
+def time_snap(snap: Callable[[np.ndarray, float], np.ndarray], vectors: np.ndarray, step: float, repeats: int):
+    """Best wall time over repeats and the snapped vectors of the last run."""
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        snapped = snap(vectors, step)
+        best = min(best, time.perf_counter() - start)
+    return best, snapped
+
+
+def benchmark_step(vectors: np.ndarray, step: float, lattices: List[str], repeats: int) -> Dict:
+    """Speed and distortion of the reference snap and every lattice at one step."""
+    n = len(vectors)
+    result = {'step': step, 'bits_per_dim': grid_bits_per_dim(vectors, step), 'lattices': {}}
+
+    reference_seconds, reference = time_snap(round_snap, vectors, step, repeats)
+    reference_mse = mean_squared_error(vectors, reference)
+    result['reference'] = {
+        'seconds': reference_seconds,
+        'vectors_per_sec': n / reference_seconds,
+        'mse': reference_mse,
+        'normalized_second_moment': reference_mse / step ** 2
+    }
+
+    for lattice in lattices:
+        seconds, snapped = time_snap(lambda v, s: snap_to_lattice(v, s, lattice), vectors, step, repeats)
+        mse = mean_squared_error(vectors, snapped)
+        result['lattices'][lattice] = {
+            'seconds': seconds,
+            'vectors_per_sec': n / seconds,
+            'speed_vs_reference': reference_seconds / seconds,
+            'mse': mse,
+            'mse_vs_reference': mse / reference_mse if reference_mse > 0 else 0.0,
+            'normalized_second_moment': mse / step ** 2
+        }
+    return result
+
+
+def print_step(result: Dict):
+    """Print one step's comparison table."""
+    print(f"\nstep={result['step']:g}  (~{result['bits_per_dim']:.2f} bits/dim for every lattice)")
+    print(f"{'Lattice':<12} | {'vectors/sec':>12} | {'speed':>6} | {'MSE/dim':>12} | {'MSE ratio':>9} | {'G':>7}")
+    print("-" * 74)
+    reference = result['reference']
+    print(f"{'np.round':<12} | {reference['vectors_per_sec']:>12,.0f} | {1.0:>5.2f}x | "
+          f"{reference['mse']:>12.4e} | {1.0:>9.4f} | {reference['normalized_second_moment']:>7.4f}")
+    for lattice, stats in result['lattices'].items():
+        print(f"{lattice:<12} | {stats['vectors_per_sec']:>12,.0f} | {stats['speed_vs_reference']:>5.2f}x | "
+              f"{stats['mse']:>12.4e} | {stats['mse_vs_reference']:>9.4f} | {stats['normalized_second_moment']:>7.4f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark lattice quantizers against np.round(vectors / step) * step'
+    )
+    parser.add_argument('--input', type=str, default=None,
+                        help='Optional .npy matrix of vectors (default: synthetic Gaussian vectors)')
+    parser.add_argument('--num-vectors', type=int, default=100000,
+                        help='Synthetic vectors, or rows taken from --input (default: 100000)')
+    parser.add_argument('--dim', type=int, default=384,
+                        help='Synthetic vector dimension (default: 384)')
+    parser.add_argument('--steps', type=float, nargs='+', default=[0.05, 0.1, 0.2],
+                        help='Lattice steps (default: 0.05 0.1 0.2)')
+    parser.add_argument('--lattices', type=str, nargs='+', default=LATTICES, choices=LATTICES,
+                        help='Lattices to benchmark (default: all)')
+    parser.add_argument('--repeats', type=int, default=3,
+                        help='Timed runs per lattice; the fastest is reported (default: 3)')
+    parser.add_argument('--seed', type=int, default=42,
+                        help='Random seed for synthetic vectors (default: 42)')
+    parser.add_argument('--output', type=str, default=None,
+                        help='Optional JSON file for the results')
+
+    args = parser.parse_args()
+
+    if args.input:
+        vectors = np.load(args.input, mmap_mode='r')[:args.num_vectors]
+        vectors = np.asarray(vectors, dtype=np.float32)
+    else:
+        rng = np.random.default_rng(args.seed)
+        vectors = rng.standard_normal((args.num_vectors, args.dim), dtype=np.float32) / np.sqrt(args.dim)
+    print(f"✓ Benchmarking {len(vectors):,} vectors of dim {vectors.shape[1]}")
+
+    results = [benchmark_step(vectors, step, args.lattices, args.repeats) for step in args.steps]
+    for result in results:
+        print_step(result)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'num_vectors': len(vectors),
+                'dim': int(vectors.shape[1]),
+                'input': args.input,
+                'steps': results
+            }, f, indent=2)
+        print(f"\n✓ Saved results to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
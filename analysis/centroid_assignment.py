@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+"""
+Blocked Nearest-Centroid Assignment Engine
+
+Shared nearest-centroid search used by every compression path.
+
+Distances are computed with the expansion
+    ||x - c||^2 = ||x||^2 - 2 x·c + ||c||^2
+so each block of vectors costs one matrix multiply against the centroid
+table, and the n × k × d broadcast temporary is never materialized.
+Vectors are processed in row blocks sized so that the (block × k)
+distance matrix stays under a fixed byte budget. Distances are computed
+in at least float32, so float16 inputs never accumulate in float16.
+
+boundary_assign fuses top-2 selection, boundary classification and
+encoding into the same blocked pass.
+
+Usage:
+    from centroid_assignment import assign_nearest
+    ids, distances = assign_nearest(vectors, centroids)
+"""
+
+import numpy as np
+from typing import Iterator, Optional, Tuple
+
+
+# Byte budget for a single (block_rows × num_centroids) distance block
+DEFAULT_BLOCK_BYTES = 64 * 1024 * 1024
+
+
+def distance_dtype(vectors: np.ndarray, centroids: np.ndarray) -> np.dtype:
+    """Dtype distances are computed in: the inputs' common type, at least float32."""
+    return np.result_type(vectors.dtype, centroids.dtype, np.float32)
+
+
+def compute_block_rows(num_centroids: int, itemsize: int, block_bytes: int = DEFAULT_BLOCK_BYTES) -> int:
+    """
+    Number of vector rows per block so a distance block fits the byte budget.
+
+    Args:
+        num_centroids: number of centroids (columns of the distance block)
+        itemsize: bytes per distance value
+        block_bytes: byte budget for one distance block
+
+    Returns:
+        rows per block (at least 1)
+    """
+    per_row = max(1, num_centroids) * itemsize
+    return max(1, int(block_bytes // per_row))
+
+
+def squared_distances(
+    block: np.ndarray,
+    centroids: np.ndarray,
+    centroid_sq_norms: Optional[np.ndarray] = None
+) -> np.ndarray:
+    """
+    Squared Euclidean distances from a block of vectors to all centroids.
+
+    Args:
+        block: (b, d) array of vectors
+        centroids: (k, d) array of centroids
+        centroid_sq_norms: optional precomputed (k,) squared centroid norms
+
+    Returns:
+        (b, k) array of squared distances, clamped at zero
+    """
+    if centroid_sq_norms is None:
+        centroid_sq_norms = np.einsum('ij,ij->i', centroids, centroids)
+
+    block_sq_norms = np.einsum('ij,ij->i', block, block)
+
+    # ||x||^2 - 2 x·c + ||c||^2, built in place on the GEMM output
+    sq_dists = block @ centroids.T
+    sq_dists *= -2.0
+    sq_dists += block_sq_norms[:, None]
+    sq_dists += centroid_sq_norms[None, :]
+
+    # Cancellation can leave tiny negatives for near-coincident points
+    np.maximum(sq_dists, 0.0, out=sq_dists)
+
+    return sq_dists
+
+
+def iter_squared_distance_blocks(
+    vectors: np.ndarray,
+    centroids: np.ndarray,
+    block_bytes: int = DEFAULT_BLOCK_BYTES
+) -> Iterator[Tuple[int, int, np.ndarray]]:
+    """
+    Iterate over bounded-memory blocks of squared distances.
+
+    Args:
+        vectors: (n, d) array of vectors
+        centroids: (k, d) array of centroids
+        block_bytes: byte budget for one distance block
+
+    Yields:
+        (start, stop, sq_dists) where sq_dists is the (stop - start, k)
+        squared distance block for vectors[start:stop]
+    """
+    n = len(vectors)
+    dtype = distance_dtype(vectors, centroids)
+    rows = compute_block_rows(len(centroids), np.dtype(dtype).itemsize, block_bytes)
+    centroids = np.asarray(centroids).astype(dtype, copy=False)
+    centroid_sq_norms = np.einsum('ij,ij->i', centroids, centroids)
+
+    for start in range(0, n, rows):
+        stop = min(start + rows, n)
+        block = np.asarray(vectors[start:stop]).astype(dtype, copy=False)
+        yield start, stop, squared_distances(block, centroids, centroid_sq_norms)
+
+
+def assign_nearest(
+    vectors: np.ndarray,
+    centroids: np.ndarray,
+    block_bytes: int = DEFAULT_BLOCK_BYTES
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Assign each vector to its nearest centroid.
+
+    Args:
+        vectors: (n, d) array of vectors
+        centroids: (k, d) array of centroids
+        block_bytes: byte budget for one distance block
+
+    Returns:
+        ids: (n,) int64 array of nearest-centroid indices
+        distances: (n,) array of Euclidean distances to the nearest centroid
+    """
+    n = len(vectors)
+    dtype = distance_dtype(vectors, centroids)
+    ids = np.empty(n, dtype=np.int64)
+    distances = np.empty(n, dtype=dtype)
+
+    for start, stop, sq_dists in iter_squared_distance_blocks(vectors, centroids, block_bytes):
+        block_ids = np.argmin(sq_dists, axis=1)
+        ids[start:stop] = block_ids
+        distances[start:stop] = sq_dists[np.arange(stop - start), block_ids]
+
+    np.sqrt(distances, out=distances)
+
+    return ids, distances
+
+
+def nearest_two(
+    vectors: np.ndarray,
+    centroids: np.ndarray,
+    block_bytes: int = DEFAULT_BLOCK_BYTES
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Nearest-centroid ids and the two smallest centroid distances per vector.
+
+    Selects the top-2 per block with two linear scans rather than a sort.
+
+    Args:
+        vectors: (n, d) array of vectors
+        centroids: (k, d) array of centroids, k >= 2
+        block_bytes: byte budget for one distance block
+
+    Returns:
+        ids: (n,) int64 array of nearest-centroid indices
+        top2: (n, 2) array of Euclidean distances [d1, d2] with d1 <= d2
+    """
+    if len(centroids) < 2:
+        raise ValueError("nearest_two requires at least 2 centroids")
+
+    n = len(vectors)
+    dtype = distance_dtype(vectors, centroids)
+    ids = np.empty(n, dtype=np.int64)
+    top2 = np.empty((n, 2), dtype=dtype)
+
+    for start, stop, sq_dists in iter_squared_distance_blocks(vectors, centroids, block_bytes):
+        ids[start:stop], top2[start:stop] = _select_two(sq_dists)
+
+    np.sqrt(top2, out=top2)
+
+    return ids, top2
+
+
+def _select_two(sq_dists: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Ids of the nearest centroid and the two smallest squared distances per row.
+
+    Two linear scans (argmin, then min with the winner masked out) select
+    the top-2 in O(k) per row; measured faster than np.partition or
+    np.argpartition with kth=1. Modifies sq_dists in place.
+    """
+    rows = np.arange(len(sq_dists))
+    ids = np.argmin(sq_dists, axis=1)
+    top2 = np.empty((len(sq_dists), 2), dtype=sq_dists.dtype)
+    top2[:, 0] = sq_dists[rows, ids]
+    sq_dists[rows, ids] = np.inf
+    top2[:, 1] = np.min(sq_dists, axis=1)
+    return ids, top2
+
+
+def boundary_assign(
+    vectors: np.ndarray,
+    centroids: np.ndarray,
+    threshold: float,
+    bulk_codes: np.ndarray,
+    boundary_codes: np.ndarray,
+    codebook: Optional[np.ndarray] = None,
+    block_bytes: int = DEFAULT_BLOCK_BYTES
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Fused boundary classification and encoding in one blocked pass.
+
+    For each block: distances to the centroids, top-2 by partial selection,
+    ambiguity score d2 - d1, boundary flag (ambiguity <= threshold) and the
+    final code, without revisiting the vectors.
+
+    Args:
+        vectors: (n, d) array of vectors
+        centroids: (k, d) array of centroids, k >= 2
+        threshold: ambiguity threshold; vectors at or below it are boundary
+        bulk_codes: (k,) code of each centroid for bulk vectors
+        boundary_codes: (k,) code of each centroid for boundary vectors
+        codebook: optional (num_codes, d) codebook; when given, each vector is
+                  coded by its nearest bulk or boundary codebook entry instead
+                  of through its centroid label
+        block_bytes: byte budget for one distance block
+
+    Returns:
+        labels: (n,) int64 nearest-centroid indices
+        top2: (n, 2) Euclidean distances [d1, d2] with d1 <= d2
+        boundary_mask: (n,) boolean array of boundary vectors
+        codes: (n,) int64 codes
+    """
+    if len(centroids) < 2:
+        raise ValueError("boundary_assign requires at least 2 centroids")
+
+    n = len(vectors)
+    dtype = distance_dtype(vectors, centroids)
+    labels = np.empty(n, dtype=np.int64)
+    top2 = np.empty((n, 2), dtype=dtype)
+    boundary_mask = np.empty(n, dtype=bool)
+    codes = np.empty(n, dtype=np.int64)
+
+    if codebook is not None:
+        candidates = []
+        for table_codes in (bulk_codes, boundary_codes):
+            table_codes = np.unique(table_codes)
+            table = np.asarray(codebook[table_codes]).astype(dtype, copy=False)
+            candidates.append((table_codes, table, np.einsum('ij,ij->i', table, table)))
+
+    for start, stop, sq_dists in iter_squared_distance_blocks(vectors, centroids, block_bytes):
+        block_labels, block_top2 = _select_two(sq_dists)
+        np.sqrt(block_top2, out=block_top2)
+        block_boundary = (block_top2[:, 1] - block_top2[:, 0]) <= threshold
+
+        if codebook is None:
+            block_codes = np.where(block_boundary, boundary_codes[block_labels], bulk_codes[block_labels])
+        else:
+            block = np.asarray(vectors[start:stop]).astype(dtype, copy=False)
+            block_codes = np.empty(stop - start, dtype=np.int64)
+            for rows, (table_codes, table, table_sq_norms) in zip((~block_boundary, block_boundary), candidates):
+                if np.any(rows):
+                    nearest = np.argmin(squared_distances(block[rows], table, table_sq_norms), axis=1)
+                    block_codes[rows] = table_codes[nearest]
+
+        labels[start:stop] = block_labels
+        top2[start:stop] = block_top2
+        boundary_mask[start:stop] = block_boundary
+        codes[start:stop] = block_codes
+
+    return labels, top2, boundary_mask, codes
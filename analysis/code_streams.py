@@ -0,0 +1,367 @@
+#!/usr/bin/env python3
+"""
+Code Streams
+
+Compact encodings for the per-passage codebook indices of a compressed
+store. A plain code array spends a whole uint8/uint16/uint32 per passage;
+with K codebook entries the streams here spend
+
+- bitpacked: exactly ceil(log2 K) bits per passage. Code i occupies bits
+             [i * b, (i + 1) * b) of the stream, least significant first,
+             so any code is read directly from its bit offset.
+- huffman:   a canonical Huffman code over the code frequencies, so the
+             large clusters that dominate a skewed assignment take only a
+             few bits. Codes are grouped into blocks of block_size codes,
+             each starting on a byte boundary, and a table of block byte
+             offsets gives block-level random access: reading a code
+             decodes only its block.
+
+Huffman decoding is table driven: code lengths are limited to
+MAX_HUFFMAN_BITS, so peeking MAX_HUFFMAN_BITS bits at a stream position
+looks up the symbol and its length in one step. All requested blocks are
+decoded in lockstep, one NumPy step per code within a block.
+
+Usage:
+    from code_streams import BitPackedCodes, HuffmanCoder, HuffmanCodes, code_bits, pack_codes
+    packed = pack_codes(codes, code_bits(num_codes))
+    coder = HuffmanCoder.from_counts(np.bincount(codes, minlength=num_codes))
+    stream, block_offsets = coder.encode(codes, block_size=1024)
+    codes = HuffmanCodes(stream, block_offsets, coder, len(codes), 1024)[indices]
+"""
+
+import heapq
+import numpy as np
+from typing import Dict, Optional, Tuple, Union
+
+
+CODE_ENCODINGS = ['array', 'bitpacked', 'huffman']
+
+# Codes per independently decodable Huffman block
+DEFAULT_CODE_BLOCK = 1024
+
+# Longest Huffman codeword; the decode table has 2**MAX_HUFFMAN_BITS entries
+MAX_HUFFMAN_BITS = 20
+
+# Codes packed or encoded per streaming step (a multiple of 8)
+CODE_STREAM_CHUNK = 1 << 18
+
+# Blocks decoded together in one lockstep pass
+DECODE_GROUP_BLOCKS = 8192
+
+
+def code_bits(num_codes: int) -> int:
+    """Bits per code for fixed-width packing: ceil(log2 num_codes), at least 1."""
+    return max(1, int(num_codes - 1).bit_length())
+
+
+def packed_code_bytes(num_vectors: int, bits: int) -> int:
+    """Bytes of a bit-packed stream of num_vectors codes."""
+    return (num_vectors * bits + 7) // 8
+
+
+def code_entropy_bits(counts: np.ndarray) -> float:
+    """Shannon entropy of the code distribution in bits per code (the entropy-coding lower bound)."""
+    counts = np.asarray(counts, dtype=np.float64)
+    total = counts.sum()
+    if total == 0:
+        return 0.0
+    p = counts[counts > 0] / total
+    return float(-np.sum(p * np.log2(p))) + 0.0
+
+
+def pack_codes(codes: np.ndarray, bits: int, out: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Pack codes into a little-endian bit stream of bits per code.
+
+    Args:
+        codes: (n,) non-negative integer codes below 2**bits
+        bits: bits per code
+        out: optional (packed_code_bytes(n, bits),) uint8 array to write into
+
+    Returns:
+        (packed_code_bytes(n, bits),) uint8 stream
+    """
+    codes = np.asarray(codes)
+    if out is None:
+        out = np.empty(packed_code_bytes(len(codes), bits), dtype=np.uint8)
+    shifts = np.arange(bits, dtype=np.uint64)
+    # Chunks of a multiple of 8 codes end on a byte boundary
+    for start in range(0, len(codes), CODE_STREAM_CHUNK):
+        chunk = np.asarray(codes[start:start + CODE_STREAM_CHUNK], dtype=np.uint64)
+        bit_matrix = ((chunk[:, None] >> shifts) & 1).astype(np.uint8)
+        packed = np.packbits(bit_matrix.ravel(), bitorder='little')
+        byte_start = start * bits // 8
+        out[byte_start:byte_start + len(packed)] = packed
+    return out
+
+
+def unpack_codes(packed: np.ndarray, bits: int, indices: np.ndarray) -> np.ndarray:
+    """
+    Read codes at arbitrary indices from a bit-packed stream.
+
+    Each code is gathered from the 8 bytes starting at its first byte;
+    bytes past the end of the stream only ever land above the code's bits.
+
+    Returns:
+        (len(indices),) int64 codes
+    """
+    indices = np.asarray(indices, dtype=np.int64)
+    bit_offsets = indices * bits
+    byte_index = (bit_offsets >> 3)[:, None] + np.arange(8)
+    np.minimum(byte_index, len(packed) - 1, out=byte_index)
+    words = np.ascontiguousarray(np.asarray(packed)[byte_index]).view('<u8')[:, 0]
+    values = (words >> (bit_offsets & 7).astype(np.uint64)) & np.uint64((1 << bits) - 1)
+    return values.astype(np.int64)
+
+
+def _as_indices(key, length: int) -> Tuple[np.ndarray, bool]:
+    """Resolve an int, slice or integer array key to indices; also whether it was a scalar."""
+    if isinstance(key, slice):
+        return np.arange(*key.indices(length), dtype=np.int64), False
+    if np.isscalar(key):
+        index = int(key)
+        if index < 0:
+            index += length
+        if not 0 <= index < length:
+            raise IndexError(f"Index {key} out of range for {length} codes")
+        return np.array([index], dtype=np.int64), True
+    indices = np.asarray(key)
+    if indices.dtype == bool:
+        return np.flatnonzero(indices), False
+    indices = indices.astype(np.int64)
+    indices = np.where(indices < 0, indices + length, indices)
+    if len(indices) > 0 and (indices.min() < 0 or indices.max() >= length):
+        raise IndexError(f"Index out of range for {length} codes")
+    return indices, False
+
+
+class _CodeStream:
+    """Read-only array-like view over an encoded code stream (indexing decodes)."""
+
+    dtype = np.dtype(np.int64)
+    ndim = 1
+
+    def __len__(self) -> int:
+        return self.length
+
+    @property
+    def shape(self) -> Tuple[int]:
+        return (self.length,)
+
+    def take(self, indices: np.ndarray) -> np.ndarray:
+        raise NotImplementedError
+
+    def __getitem__(self, key) -> Union[int, np.ndarray]:
+        indices, scalar = _as_indices(key, self.length)
+        values = self.take(indices)
+        return int(values[0]) if scalar else values
+
+    def __array__(self, dtype=None, copy=None) -> np.ndarray:
+        values = self.take(np.arange(self.length, dtype=np.int64))
+        return values if dtype is None else values.astype(dtype)
+
+
+class BitPackedCodes(_CodeStream):
+    """Codes stored at a fixed bit width (see pack_codes)."""
+
+    def __init__(self, packed: np.ndarray, bits: int, length: int):
+        self.packed = packed
+        self.bits = int(bits)
+        self.length = int(length)
+
+    def take(self, indices: np.ndarray) -> np.ndarray:
+        if len(indices) == 0 or self.length == 0:
+            return np.zeros(0, dtype=np.int64)
+        return unpack_codes(self.packed, self.bits, indices)
+
+
+def huffman_code_lengths(counts: np.ndarray, max_length: int = MAX_HUFFMAN_BITS) -> np.ndarray:
+    """
+    Huffman codeword lengths for symbol counts, limited to max_length bits.
+
+    Every symbol gets a codeword (zero counts are treated as one), so codes
+    appended later never fall outside the code. Over-long codes are limited
+    by halving the counts and rebuilding until the longest fits.
+
+    Returns:
+        (len(counts),) uint8 codeword lengths
+    """
+    counts = np.maximum(np.asarray(counts, dtype=np.int64), 1)
+    num_symbols = len(counts)
+    if num_symbols > (1 << max_length):
+        raise ValueError(f"{num_symbols} symbols do not fit in {max_length}-bit Huffman codes")
+    if num_symbols == 1:
+        return np.ones(1, dtype=np.uint8)
+
+    while True:
+        heap = [(int(count), symbol) for symbol, count in enumerate(counts)]
+        heapq.heapify(heap)
+        parent = np.zeros(2 * num_symbols - 1, dtype=np.int64)
+        next_node = num_symbols
+        while len(heap) > 1:
+            count_a, node_a = heapq.heappop(heap)
+            count_b, node_b = heapq.heappop(heap)
+            parent[node_a] = parent[node_b] = next_node
+            heapq.heappush(heap, (count_a + count_b, next_node))
+            next_node += 1
+        # Internal nodes are created after their children, so walk down from the root
+        depth = np.zeros(2 * num_symbols - 1, dtype=np.int64)
+        for node in range(2 * num_symbols - 3, -1, -1):
+            depth[node] = depth[parent[node]] + 1
+        lengths = depth[:num_symbols]
+        if lengths.max() <= max_length:
+            return lengths.astype(np.uint8)
+        counts = (counts + 1) // 2
+
+
+def canonical_codewords(lengths: np.ndarray) -> np.ndarray:
+    """Canonical Huffman codewords: symbols ordered by (length, symbol) get consecutive codes."""
+    lengths = np.asarray(lengths, dtype=np.int64)
+    codewords = np.zeros(len(lengths), dtype=np.int64)
+    code = 0
+    previous = 0
+    for symbol in np.lexsort((np.arange(len(lengths)), lengths)):
+        code <<= int(lengths[symbol]) - previous
+        previous = int(lengths[symbol])
+        codewords[symbol] = code
+        code += 1
+    return codewords
+
+
+class HuffmanCoder:
+    """Canonical Huffman code over codebook indices, with a table decoder."""
+
+    def __init__(self, lengths: np.ndarray):
+        self.lengths = np.asarray(lengths, dtype=np.uint8)
+        self.codewords = canonical_codewords(self.lengths)
+        self.table_bits = int(self.lengths.max())
+        if self.table_bits > MAX_HUFFMAN_BITS:
+            raise ValueError(f"Codeword length {self.table_bits} exceeds {MAX_HUFFMAN_BITS} bits")
+
+        # Every table index whose leading bits are a codeword maps to that codeword's symbol
+        spans = 1 << (self.table_bits - self.lengths.astype(np.int64))
+        starts = self.codewords << (self.table_bits - self.lengths.astype(np.int64))
+        order = np.argsort(starts)
+        self.table_symbols = np.repeat(order, spans[order]).astype(np.int32)
+        self.table_lengths = np.repeat(self.lengths[order], spans[order]).astype(np.int64)
+
+    @classmethod
+    def from_counts(cls, counts: np.ndarray, max_length: int = MAX_HUFFMAN_BITS) -> 'HuffmanCoder':
+        return cls(huffman_code_lengths(counts, max_length))
+
+    def block_bytes(self, codes: np.ndarray, block_size: int) -> np.ndarray:
+        """Encoded byte size of each block of codes (blocks are padded to whole bytes)."""
+        code_lengths = self.lengths[np.asarray(codes)].astype(np.int64)
+        if len(code_lengths) == 0:
+            return np.zeros(0, dtype=np.int64)
+        block_bits = np.add.reduceat(code_lengths, np.arange(0, len(code_lengths), block_size))
+        return (block_bits + 7) // 8
+
+    def encode(self, codes: np.ndarray, block_size: int = DEFAULT_CODE_BLOCK) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Encode codes into byte-aligned blocks.
+
+        Returns:
+            stream: (total_bytes,) uint8
+            block_offsets: (num_blocks + 1,) int64 byte offset of each block
+        """
+        codes = np.asarray(codes)
+        block_offsets = np.concatenate([[0], np.cumsum(self.block_bytes(codes, block_size))]).astype(np.int64)
+        stream = np.empty(int(block_offsets[-1]), dtype=np.uint8)
+        chunk_size = block_size * max(1, CODE_STREAM_CHUNK // block_size)
+        for start in range(0, len(codes), chunk_size):
+            chunk = np.asarray(codes[start:start + chunk_size])
+            first_block = start // block_size
+            offsets = block_offsets[first_block:first_block + (len(chunk) + block_size - 1) // block_size + 1]
+            stream[offsets[0]:offsets[-1]] = self._encode_blocks(chunk, offsets - offsets[0], block_size)
+        return stream, block_offsets
+
+    def _encode_blocks(self, codes: np.ndarray, block_offsets: np.ndarray, block_size: int) -> np.ndarray:
+        """Encode whole blocks of codes given their relative byte offsets."""
+        code_lengths = self.lengths[codes].astype(np.int64)
+        codewords = self.codewords[codes]
+        # Bit position of each codeword: its block's start plus the lengths before it in the block
+        exclusive = np.cumsum(code_lengths) - code_lengths
+        block_of = np.arange(len(codes)) // block_size
+        exclusive -= exclusive[block_of * block_size]
+        positions = block_offsets[block_of] * 8 + exclusive
+
+        bits = np.zeros(int(block_offsets[-1]) * 8, dtype=np.uint8)
+        for j in range(self.table_bits):
+            has_bit = code_lengths > j
+            bits[positions[has_bit] + j] = (codewords[has_bit] >> (code_lengths[has_bit] - 1 - j)) & 1
+        return np.packbits(bits)
+
+    def decode_blocks(self, stream: np.ndarray, starts: np.ndarray, count: int) -> np.ndarray:
+        """
+        Decode the first count codes of the blocks starting at byte offsets starts.
+
+        Returns:
+            (len(starts), count) int32 codes
+        """
+        stream = np.asarray(stream)
+        positions = np.asarray(starts, dtype=np.int64) * 8
+        out = np.empty((len(positions), count), dtype=np.int32)
+        last_byte = len(stream) - 1
+        peek_shift = 32 - self.table_bits
+        mask = (1 << self.table_bits) - 1
+        byte_steps = np.arange(4)
+        for t in range(count):
+            byte_index = np.minimum((positions >> 3)[:, None] + byte_steps, last_byte)
+            window = stream[byte_index].astype(np.int64)
+            word = (window[:, 0] << 24) | (window[:, 1] << 16) | (window[:, 2] << 8) | window[:, 3]
+            peek = (word >> (peek_shift - (positions & 7))) & mask
+            out[:, t] = self.table_symbols[peek]
+            positions += self.table_lengths[peek]
+        return out
+
+
+def code_stream_bits(codes: np.ndarray, num_codes: int, block_size: int = DEFAULT_CODE_BLOCK) -> Dict[str, float]:
+    """
+    Bits per code of every encoding, measured by encoding the codes.
+
+    Huffman bits include the block offset index (int64 per block) and the
+    codeword length table (one byte per codebook entry).
+
+    Returns:
+        dict of bits per code keyed by encoding, plus 'entropy'
+    """
+    codes = np.asarray(codes)
+    n = max(1, len(codes))
+    counts = np.bincount(codes, minlength=num_codes)
+    bits = code_bits(num_codes)
+    coder = HuffmanCoder.from_counts(counts)
+    stream, block_offsets = coder.encode(codes, block_size)
+    return {
+        'array': float(8 * np.min_scalar_type(max(0, num_codes - 1)).itemsize),
+        'bitpacked': float(8 * packed_code_bytes(len(codes), bits) / n),
+        'huffman': float(8 * (stream.nbytes + block_offsets.nbytes + coder.lengths.nbytes) / n),
+        'entropy': code_entropy_bits(counts)
+    }
+
+
+class HuffmanCodes(_CodeStream):
+    """Huffman-coded codes with block-level random access (see HuffmanCoder.encode)."""
+
+    def __init__(self, stream: np.ndarray, block_offsets: np.ndarray, coder: HuffmanCoder, length: int, block_size: int):
+        self.stream = stream
+        self.block_offsets = np.asarray(block_offsets, dtype=np.int64)
+        self.coder = coder
+        self.length = int(length)
+        self.block_size = int(block_size)
+
+    def take(self, indices: np.ndarray) -> np.ndarray:
+        values = np.empty(len(indices), dtype=np.int64)
+        if len(indices) == 0:
+            return values
+        blocks, inverse = np.unique(indices // self.block_size, return_inverse=True)
+        within = indices % self.block_size
+        for group in range(0, len(blocks), DECODE_GROUP_BLOCKS):
+            selected = (inverse >= group) & (inverse < group + DECODE_GROUP_BLOCKS)
+            # Decode each block only as far as the furthest code read from the group
+            count = int(within[selected].max()) + 1
+            decoded = self.coder.decode_blocks(
+                self.stream, self.block_offsets[blocks[group:group + DECODE_GROUP_BLOCKS]], count
+            )
+            values[selected] = decoded[inverse[selected] - group, within[selected]]
+        return values
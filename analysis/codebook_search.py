@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Codebook-Domain Search
+
+Exact top-k cosine search over a codebook store without touching every
+passage. All passages sharing a code have the same reconstruction, hence
+the same score, so a query only needs:
+
+- one GEMM against the unique (normalized) codebook: O(K·d)
+- an inverted list code -> passages, sorted by passage index, walked in
+  descending code score until k passages are collected: O(k)
+
+Passages carrying a residual correction no longer equal their codebook row;
+they are left out of the inverted lists and scored exactly, then merged into
+the top-k.
+
+Results match ExactSearcher over the decoded store: descending similarity,
+ties by ascending passage index. Within a code that secondary key is
+exact; when distinct codes score exactly equal (rare), the lower code is
+expanded first.
+
+Usage:
+    from codebook_search import CodebookSearcher
+    searcher = CodebookSearcher.from_store(open_compressed_store(store_dir))
+    indices, scores = searcher.search_batch(query_embeddings, k=100)   # (q, k) each
+"""
+
+import numpy as np
+from typing import Optional, Tuple
+
+from batched_search import DEFAULT_QUERY_BLOCK, normalize_rows, select_top_k, sort_top_k
+from compressed_store import CompressedStore, code_dtype_for
+from dtype_policy import DtypePolicy
+
+
+class CodebookSearcher:
+    """Top-k search scoring the codebook once per query and expanding an inverted code -> passages list."""
+
+    def __init__(
+        self,
+        codebook: np.ndarray,
+        codes: np.ndarray,
+        exact_rows: Optional[np.ndarray] = None,
+        exact_vectors: Optional[np.ndarray] = None
+    ):
+        """
+        Args:
+            codebook: (K, dim) unique reconstruction vectors
+            codes: (n,) codebook index of every passage
+            exact_rows: optional sorted passage indices scored exactly instead
+                        of through their code (e.g. residual-corrected rows)
+            exact_vectors: (len(exact_rows), dim) vectors of those passages
+        """
+        codes = np.asarray(codes)
+        self.num_passages = len(codes)
+        self.codebook = normalize_rows(codebook)
+        index_dtype = code_dtype_for(self.num_passages)
+
+        listed = np.ones(self.num_passages, dtype=bool)
+        self.exact_rows = np.zeros(0, dtype=index_dtype)
+        self.exact_vectors = np.zeros((0, self.codebook.shape[1]), dtype=self.codebook.dtype)
+        if exact_rows is not None and len(exact_rows) > 0:
+            self.exact_rows = np.asarray(exact_rows).astype(index_dtype)
+            self.exact_vectors = normalize_rows(exact_vectors).astype(self.codebook.dtype, copy=False)
+            listed[self.exact_rows] = False
+
+        # Inverted lists: passages grouped by code, ascending passage index within a code
+        passages = np.flatnonzero(listed)
+        order = np.argsort(codes[passages], kind='stable')
+        self.list_passages = passages[order].astype(index_dtype)
+        self.list_sizes = np.bincount(codes[passages], minlength=len(self.codebook)).astype(np.int64)
+        self.list_starts = np.concatenate([[0], np.cumsum(self.list_sizes)[:-1]])
+
+    @classmethod
+    def from_store(cls, store: CompressedStore, dtype_policy: Optional[DtypePolicy] = None) -> 'CodebookSearcher':
+        """
+        Searcher over a codebook store, scoring residual-corrected passages exactly.
+
+        Args:
+            store: open codebook store
+            dtype_policy: optional policy the codebook and corrected vectors are cast with
+        """
+        cast = dtype_policy.to_compute if dtype_policy is not None else np.asarray
+        if store.residuals is None:
+            return cls(cast(store.codebook), store.codes)
+        rows = np.asarray(store.residuals.rows)
+        return cls(cast(store.codebook), store.codes, rows, cast(store.decode(rows)))
+
+    def __len__(self) -> int:
+        return self.num_passages
+
+    @property
+    def num_codes(self) -> int:
+        return len(self.codebook)
+
+    def expand_codes(self, code_scores: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        First k listed passages of each query, walking codes by descending score.
+
+        Args:
+            code_scores: (q, K) similarity of each query with each codebook row
+            k: passages per query (at most the number of listed passages)
+
+        Returns:
+            indices, scores: (q, k) arrays, highest score first
+        """
+        num_queries = len(code_scores)
+        # Codes by descending score, equal scores by ascending code
+        ranked = np.lexsort((np.broadcast_to(np.arange(self.num_codes), code_scores.shape), -code_scores), axis=-1)
+        cumulative = np.cumsum(self.list_sizes[ranked], axis=1)
+
+        # Rank of the code holding the j-th hit of each query, via one searchsorted
+        # over the row-offset cumulative sizes
+        row_offset = np.arange(num_queries)[:, None] * (int(cumulative[:, -1].max(initial=0)) + 1)
+        positions = np.arange(k)[None, :]
+        rank = np.searchsorted((cumulative + row_offset).ravel(), (positions + row_offset).ravel(), side='right')
+        rank = rank.reshape(num_queries, k) - np.arange(num_queries)[:, None] * self.num_codes
+
+        hit_codes = np.take_along_axis(ranked, rank, axis=1)
+        within = positions - (np.take_along_axis(cumulative, rank, axis=1) - self.list_sizes[hit_codes])
+        indices = self.list_passages[self.list_starts[hit_codes] + within].astype(np.int64)
+        return indices, np.take_along_axis(code_scores, hit_codes, axis=1)
+
+    def search_batch(
+        self,
+        queries: np.ndarray,
+        k: int,
+        query_block: int = DEFAULT_QUERY_BLOCK
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Top-k passages for every query.
+
+        Args:
+            queries: (q, d) query embeddings (normalized here)
+            k: results per query
+            query_block: queries scored per GEMM
+
+        Returns:
+            indices: (q, k) passage indices, highest similarity first
+            scores: (q, k) cosine similarities
+        """
+        queries = normalize_rows(np.atleast_2d(queries)).astype(self.codebook.dtype, copy=False)
+        k = min(k, self.num_passages)
+        listed_k = min(k, len(self.list_passages))
+        indices = np.empty((len(queries), k), dtype=np.int64)
+        scores = np.empty((len(queries), k), dtype=self.codebook.dtype)
+        for start in range(0, len(queries), query_block):
+            block = queries[start:start + query_block]
+            block_indices, block_scores = self.expand_codes(block @ self.codebook.T, listed_k)
+            if len(self.exact_rows) > 0:
+                exact_scores = block @ self.exact_vectors.T
+                exact_indices = np.broadcast_to(self.exact_rows.astype(np.int64), exact_scores.shape)
+                block_scores, block_indices = select_top_k(
+                    np.concatenate([block_scores, exact_scores], axis=1),
+                    np.concatenate([block_indices, exact_indices], axis=1),
+                    k
+                )
+            indices[start:start + len(block)], scores[start:start + len(block)] = sort_top_k(block_scores, block_indices)
+        return indices, scores
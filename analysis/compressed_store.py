@@ -0,0 +1,851 @@
+#!/usr/bin/env python3
+"""
+Compressed Store Format
+
+On-disk format for compressed passage embeddings. Every compressed row is
+one of a small number of snapped centroids, so the store keeps:
+
+- codebook.npy       (num_codes, dim) array of unique reconstruction vectors
+- codes.npy          (n,) smallest unsigned integer dtype that fits num_codes
+- boundary_mask.npy  (n,) bool array (optional)
+- store_header.json  format version, shapes, dtypes and size accounting
+
+codes.npy can be replaced by a denser code stream (header 'code_encoding',
+see code_streams), read through an array-like view that decodes on indexing:
+
+- bitpacked: codes_packed.npy       ceil(log2 num_codes) bits per passage
+- huffman:   codes_huffman.npy      canonical Huffman stream of byte-aligned blocks
+             code_block_offsets.npy (num_blocks + 1,) byte offset of each block
+             code_lengths.npy       (num_codes,) codeword length per codebook entry
+
+A codebook store can carry a sparse residual side table (optional), holding
+scalar-quantized corrections for a subset of passages only:
+
+- residual_rows.npy    (num_residuals,) sorted passage indices
+- residual_codes.npy   (num_residuals, packed_dim) uint8 packed levels
+- residual_scale.npy   (dim,) float32 per-dimension scale
+- residual_offset.npy  (dim,) float32 per-dimension offset
+
+A boundary-aware codebook store can also keep the quantile sketch of the
+ambiguity scores its boundary threshold came from (optional, like the
+header not counted in store_bytes):
+
+- ambiguity_sketch.json  KLL sketch (see quantile_sketch), updated on append
+
+Product-quantized stores (format 'product-quantization') instead keep:
+
+- pq_codebooks.npy   (m, ksub, dsub) per-subspace codebooks
+- codes.npy          (n, m) uint8 codes, one byte per subspace
+
+Scalar-quantized stores (format 'scalar-quantization') keep:
+
+- sq_scale.npy       (dim,) float32 per-dimension scale
+- sq_offset.npy      (dim,) float32 per-dimension offset
+- codes.npy          (n, packed_dim) uint8 levels, nibble-packed for 4 bits
+
+All arrays are plain .npy files, so the store can be opened with
+memory mapping in milliseconds regardless of corpus size.
+
+Usage:
+    from compressed_store import save_compressed_store, open_compressed_store
+    save_compressed_store(output_dir, codebook, codes, boundary_mask)
+    store = open_compressed_store(output_dir)
+    vectors = store.decode()   # codebook rows plus any residual corrections
+    append_to_store(output_dir, new_codes, new_boundary_mask)
+"""
+
+import io
+import json
+import numpy as np
+from pathlib import Path
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Union
+
+from code_streams import (
+    DEFAULT_CODE_BLOCK, BitPackedCodes, HuffmanCoder, HuffmanCodes, code_bits, code_entropy_bits, pack_codes
+)
+from quantile_sketch import KLLSketch
+from scalar_quantization import decode_sq, packed_dim
+
+
+STORE_FORMAT = 'codebook-codes'
+PQ_STORE_FORMAT = 'product-quantization'
+SQ_STORE_FORMAT = 'scalar-quantization'
+STORE_VERSION = 1
+
+HEADER_FILENAME = 'store_header.json'
+CODEBOOK_FILENAME = 'codebook.npy'
+CODES_FILENAME = 'codes.npy'
+BOUNDARY_MASK_FILENAME = 'boundary_mask.npy'
+PQ_CODEBOOKS_FILENAME = 'pq_codebooks.npy'
+SQ_SCALE_FILENAME = 'sq_scale.npy'
+SQ_OFFSET_FILENAME = 'sq_offset.npy'
+RESIDUAL_ROWS_FILENAME = 'residual_rows.npy'
+RESIDUAL_CODES_FILENAME = 'residual_codes.npy'
+RESIDUAL_SCALE_FILENAME = 'residual_scale.npy'
+RESIDUAL_OFFSET_FILENAME = 'residual_offset.npy'
+AMBIGUITY_SKETCH_FILENAME = 'ambiguity_sketch.json'
+PACKED_CODES_FILENAME = 'codes_packed.npy'
+HUFFMAN_CODES_FILENAME = 'codes_huffman.npy'
+CODE_BLOCK_OFFSETS_FILENAME = 'code_block_offsets.npy'
+CODE_LENGTHS_FILENAME = 'code_lengths.npy'
+
+CODE_STREAM_FILES = {
+    'array': [CODES_FILENAME],
+    'bitpacked': [PACKED_CODES_FILENAME],
+    'huffman': [HUFFMAN_CODES_FILENAME, CODE_BLOCK_OFFSETS_FILENAME, CODE_LENGTHS_FILENAME]
+}
+
+
+@dataclass
+class ResidualTable:
+    """Scalar-quantized residuals for a sorted subset of passages (a sparse side table)."""
+    rows: np.ndarray
+    codes: np.ndarray
+    scale: np.ndarray
+    offset: np.ndarray
+    bits: int
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    @property
+    def dim(self) -> int:
+        return int(len(self.scale))
+
+    def add_to(self, vectors: np.ndarray, indices: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Add the decoded residuals to reconstructed vectors in place.
+
+        Args:
+            vectors: (len(indices), dim) reconstructed vectors
+            indices: passage index of each row of vectors (default: all passages)
+
+        Returns:
+            vectors
+        """
+        rows = np.asarray(self.rows)
+        if indices is None:
+            positions = np.arange(len(rows))
+            targets = rows
+        else:
+            indices = np.asarray(indices)
+            positions = np.minimum(np.searchsorted(rows, indices), max(0, len(rows) - 1))
+            hit = rows[positions] == indices if len(rows) else np.zeros(len(indices), dtype=bool)
+            positions = positions[hit]
+            targets = np.flatnonzero(hit)
+        if len(positions) > 0:
+            vectors[targets] += decode_sq(self.codes[positions], self.scale, self.offset, self.bits, self.dim)
+        return vectors
+
+
+@dataclass
+class CompressedStore:
+    """
+    A compressed passage store: codebook, per-passage codes and header.
+
+    codes is a code array, or a BitPackedCodes / HuffmanCodes view for
+    stores with a code stream encoding.
+    """
+    codebook: np.ndarray
+    codes: Union[np.ndarray, BitPackedCodes, HuffmanCodes]
+    boundary_mask: Optional[np.ndarray]
+    header: Dict[str, Any]
+    residuals: Optional[ResidualTable] = None
+    ambiguity_sketch: Optional[KLLSketch] = None
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    @property
+    def dim(self) -> int:
+        return int(self.codebook.shape[1])
+
+    def decode(self, indices: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Reconstruct compressed vectors from codes.
+
+        Args:
+            indices: optional passage indices to decode (default: all)
+
+        Returns:
+            (len(indices), dim) array of reconstructed vectors
+        """
+        codes = self.codes if indices is None else self.codes[indices]
+        vectors = self.codebook[np.asarray(codes)]
+        if self.residuals is None:
+            return vectors
+        vectors = vectors.astype(np.result_type(vectors, np.float32), copy=False)
+        return self.residuals.add_to(vectors, indices)
+
+
+@dataclass
+class ProductQuantizedStore:
+    """A product-quantized passage store: subspace codebooks, (n, m) codes and header."""
+    codebooks: np.ndarray
+    codes: np.ndarray
+    header: Dict[str, Any]
+    boundary_mask: Optional[np.ndarray] = None
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    @property
+    def dim(self) -> int:
+        return int(self.header['dim'])
+
+    def decode(self, indices: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Reconstruct compressed vectors from PQ codes.
+
+        Args:
+            indices: optional passage indices to decode (default: all)
+
+        Returns:
+            (len(indices), dim) array of reconstructed vectors
+        """
+        codes = np.asarray(self.codes if indices is None else self.codes[indices])
+        m = self.codebooks.shape[0]
+        reconstructed = np.asarray(self.codebooks)[np.arange(m), codes]
+        return reconstructed.reshape(len(codes), -1)[:, :self.dim]
+
+
+@dataclass
+class ScalarQuantizedStore:
+    """A scalar-quantized passage store: per-dimension scale/offset, packed levels and header."""
+    scale: np.ndarray
+    offset: np.ndarray
+    codes: np.ndarray
+    header: Dict[str, Any]
+    boundary_mask: Optional[np.ndarray] = None
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    @property
+    def dim(self) -> int:
+        return int(self.header['dim'])
+
+    @property
+    def bits(self) -> int:
+        return int(self.header['bits'])
+
+    def decode(self, indices: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Reconstruct compressed vectors from packed levels.
+
+        Args:
+            indices: optional passage indices to decode (default: all)
+
+        Returns:
+            (len(indices), dim) float32 array of reconstructed vectors
+        """
+        codes = self.codes if indices is None else self.codes[indices]
+        return decode_sq(codes, self.scale, self.offset, self.bits, self.dim)
+
+
+def code_dtype_for(num_codes: int) -> np.dtype:
+    """Smallest unsigned integer dtype able to index num_codes entries."""
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if num_codes <= np.iinfo(dtype).max + 1:
+            return np.dtype(dtype)
+    return np.dtype(np.uint64)
+
+
+class CompressedStoreWriter:
+    """
+    Writes a compressed store chunk by chunk.
+
+    codes.npy and boundary_mask.npy are created up front as memory-mapped
+    .npy files, so codes can be streamed in without holding all of them.
+    With a code_encoding other than 'array', close() encodes codes.npy into
+    the code stream and removes it.
+    """
+
+    def __init__(
+        self,
+        output_dir: Path,
+        codebook: np.ndarray,
+        num_vectors: int,
+        has_boundary_mask: bool = False,
+        code_encoding: str = 'array',
+        code_block_size: int = DEFAULT_CODE_BLOCK
+    ):
+        if code_encoding not in CODE_STREAM_FILES:
+            raise ValueError(f"Unknown code encoding: {code_encoding} (expected one of {list(CODE_STREAM_FILES)})")
+        self.output_dir = Path(output_dir)
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.codebook = np.ascontiguousarray(codebook)
+        self.num_vectors = int(num_vectors)
+        self.code_dtype = code_dtype_for(len(self.codebook))
+        self.code_encoding = code_encoding
+        self.code_block_size = int(code_block_size)
+
+        np.save(self.output_dir / CODEBOOK_FILENAME, self.codebook)
+        self.codes = np.lib.format.open_memmap(
+            self.output_dir / CODES_FILENAME, mode='w+', dtype=self.code_dtype, shape=(self.num_vectors,)
+        )
+        self.boundary_mask = None
+        if has_boundary_mask:
+            self.boundary_mask = np.lib.format.open_memmap(
+                self.output_dir / BOUNDARY_MASK_FILENAME, mode='w+', dtype=bool, shape=(self.num_vectors,)
+            )
+
+    def write(self, start: int, codes: np.ndarray, boundary_mask: Optional[np.ndarray] = None):
+        """Write codes (and boundary flags) for rows [start, start + len(codes))."""
+        stop = start + len(codes)
+        if len(codes) > 0 and int(np.max(codes)) >= len(self.codebook):
+            raise ValueError(f"Code {int(np.max(codes))} out of range for codebook of size {len(self.codebook)}")
+        self.codes[start:stop] = codes
+        if self.boundary_mask is not None:
+            if boundary_mask is None:
+                raise ValueError("Store has a boundary mask but no boundary flags were written")
+            self.boundary_mask[start:stop] = boundary_mask
+
+    def close(
+        self,
+        extra_header: Optional[Dict[str, Any]] = None,
+        residuals: Optional[ResidualTable] = None,
+        ambiguity_sketch: Optional[KLLSketch] = None
+    ) -> Dict[str, Any]:
+        """
+        Flush arrays, write the optional residual side table and ambiguity
+        sketch, then store_header.json; returns the header.
+        """
+        self.codes.flush()
+        self.codes = None
+        code_header = _encode_code_stream(
+            self.output_dir, len(self.codebook), self.num_vectors, self.code_encoding, self.code_block_size
+        )
+        files = [CODEBOOK_FILENAME] + CODE_STREAM_FILES[self.code_encoding]
+        if self.boundary_mask is not None:
+            self.boundary_mask.flush()
+            self.boundary_mask = None
+            files.append(BOUNDARY_MASK_FILENAME)
+
+        residual_header = {'has_residuals': residuals is not None}
+        if residuals is not None:
+            files.extend(_save_residuals(self.output_dir, residuals, self.num_vectors))
+            row_bytes = int(code_dtype_for(self.num_vectors).itemsize + np.asarray(residuals.codes).shape[1])
+            residual_header.update({
+                'num_residuals': int(len(residuals)),
+                'residual_bits': int(residuals.bits),
+                'residual_bytes_per_row': row_bytes,
+                'residual_bytes_per_vector': float(row_bytes * len(residuals) / max(1, self.num_vectors))
+            })
+
+        sketch_header = {'has_ambiguity_sketch': ambiguity_sketch is not None}
+        if ambiguity_sketch is not None:
+            ambiguity_sketch.save(self.output_dir / AMBIGUITY_SKETCH_FILENAME)
+            sketch_header['ambiguity_sketch_items'] = ambiguity_sketch.num_retained
+
+        return _write_header(self.output_dir, files, {
+            'format': STORE_FORMAT,
+            'version': STORE_VERSION,
+            'num_vectors': self.num_vectors,
+            'dim': int(self.codebook.shape[1]),
+            'num_codes': int(len(self.codebook)),
+            'code_dtype': self.code_dtype.name,
+            'code_bytes_per_vector': int(self.code_dtype.itemsize),
+            **code_header,
+            'codebook_dtype': self.codebook.dtype.name,
+            'has_boundary_mask': BOUNDARY_MASK_FILENAME in files,
+            **residual_header,
+            **sketch_header
+        }, extra_header)
+
+
+def _code_histogram(codes: np.ndarray, num_codes: int, chunk_size: int = 1 << 20) -> np.ndarray:
+    """Count of each codebook index over a (possibly memory-mapped) code array."""
+    counts = np.zeros(num_codes, dtype=np.int64)
+    for start in range(0, len(codes), chunk_size):
+        counts += np.bincount(np.asarray(codes[start:start + chunk_size]), minlength=num_codes)
+    return counts
+
+
+def _code_bits_per_vector(output_dir: Path, encoding: str, num_vectors: int) -> float:
+    """On-disk bits per passage of a store's code files (block index and code table included)."""
+    code_bytes = sum((output_dir / name).stat().st_size for name in CODE_STREAM_FILES[encoding])
+    return float(8 * code_bytes / num_vectors) if num_vectors > 0 else 0.0
+
+
+def _encode_code_stream(output_dir: Path, num_codes: int, num_vectors: int, encoding: str, block_size: int) -> Dict[str, Any]:
+    """
+    Re-encode codes.npy into the requested code stream (removing codes.npy).
+
+    Returns:
+        header fields describing the code stream
+    """
+    codes_path = output_dir / CODES_FILENAME
+    codes = np.load(codes_path, mmap_mode='r')
+    counts = _code_histogram(codes, num_codes)
+    header = {'code_encoding': encoding}
+    if encoding == 'bitpacked':
+        header['code_bits'] = code_bits(num_codes)
+        np.save(output_dir / PACKED_CODES_FILENAME, pack_codes(codes, header['code_bits']))
+    elif encoding == 'huffman':
+        coder = HuffmanCoder.from_counts(counts)
+        stream, block_offsets = coder.encode(codes, block_size)
+        header['code_block_size'] = int(block_size)
+        header['code_max_length'] = int(coder.table_bits)
+        np.save(output_dir / HUFFMAN_CODES_FILENAME, stream)
+        np.save(output_dir / CODE_BLOCK_OFFSETS_FILENAME, block_offsets)
+        np.save(output_dir / CODE_LENGTHS_FILENAME, coder.lengths)
+    del codes
+    if encoding != 'array':
+        codes_path.unlink()
+
+    header['code_bits_per_vector'] = _code_bits_per_vector(output_dir, encoding, num_vectors)
+    # Lower bound for any code stream over the distribution at write time
+    header['code_entropy_bits_per_vector'] = code_entropy_bits(counts)
+    return header
+
+
+def _open_codes(store_dir: Path, header: Dict[str, Any], mmap_mode: Optional[str]):
+    """Code array, or an array-like view over the store's code stream."""
+    encoding = header.get('code_encoding', 'array')
+    if encoding == 'bitpacked':
+        return BitPackedCodes(
+            np.load(store_dir / PACKED_CODES_FILENAME, mmap_mode=mmap_mode), header['code_bits'], header['num_vectors']
+        )
+    if encoding == 'huffman':
+        return HuffmanCodes(
+            np.load(store_dir / HUFFMAN_CODES_FILENAME, mmap_mode=mmap_mode),
+            np.load(store_dir / CODE_BLOCK_OFFSETS_FILENAME),
+            HuffmanCoder(np.load(store_dir / CODE_LENGTHS_FILENAME)),
+            header['num_vectors'],
+            header['code_block_size']
+        )
+    return np.load(store_dir / CODES_FILENAME, mmap_mode=mmap_mode)
+
+
+def _save_residuals(output_dir: Path, residuals: ResidualTable, num_vectors: int) -> List[str]:
+    """Write a residual side table; returns the file names written."""
+    rows = np.asarray(residuals.rows)
+    codes = np.asarray(residuals.codes)
+    if len(rows) != len(codes):
+        raise ValueError(f"{len(rows)} residual rows but {len(codes)} residual codes")
+    if len(rows) > 0 and (np.any(np.diff(rows.astype(np.int64)) <= 0) or int(rows[-1]) >= num_vectors):
+        raise ValueError("Residual rows must be strictly increasing passage indices")
+    if codes.dtype != np.uint8 or codes.ndim != 2 or codes.shape[1] != packed_dim(residuals.dim, residuals.bits):
+        raise ValueError(f"Expected (n, {packed_dim(residuals.dim, residuals.bits)}) uint8 residual codes, "
+                         f"got {codes.shape} {codes.dtype}")
+
+    np.save(output_dir / RESIDUAL_ROWS_FILENAME, rows.astype(code_dtype_for(num_vectors), copy=False))
+    np.save(output_dir / RESIDUAL_CODES_FILENAME, np.ascontiguousarray(codes))
+    np.save(output_dir / RESIDUAL_SCALE_FILENAME, np.asarray(residuals.scale, dtype=np.float32))
+    np.save(output_dir / RESIDUAL_OFFSET_FILENAME, np.asarray(residuals.offset, dtype=np.float32))
+    return [RESIDUAL_ROWS_FILENAME, RESIDUAL_CODES_FILENAME, RESIDUAL_SCALE_FILENAME, RESIDUAL_OFFSET_FILENAME]
+
+
+def _write_header(
+    output_dir: Path,
+    files: List[str],
+    header: Dict[str, Any],
+    extra_header: Optional[Dict[str, Any]] = None
+) -> Dict[str, Any]:
+    """Add size accounting for files to header and write store_header.json."""
+    store_bytes = sum((output_dir / name).stat().st_size for name in files)
+    dense_float32_bytes = header['num_vectors'] * header['dim'] * 4
+    header = dict(header, **{
+        'files': files,
+        'store_bytes': int(store_bytes),
+        'dense_float32_bytes': int(dense_float32_bytes),
+        'bytes_per_vector': float(store_bytes / header['num_vectors']) if header['num_vectors'] > 0 else 0.0,
+        'compression_ratio_vs_float32': float(dense_float32_bytes / store_bytes) if store_bytes > 0 else 0.0
+    })
+    if extra_header:
+        header.update(extra_header)
+
+    with open(output_dir / HEADER_FILENAME, 'w') as f:
+        json.dump(header, f, indent=2)
+
+    return header
+
+
+def save_compressed_store(
+    output_dir: Path,
+    codebook: np.ndarray,
+    codes: np.ndarray,
+    boundary_mask: Optional[np.ndarray] = None,
+    extra_header: Optional[Dict[str, Any]] = None,
+    residuals: Optional[ResidualTable] = None,
+    ambiguity_sketch: Optional[KLLSketch] = None,
+    code_encoding: str = 'array',
+    code_block_size: int = DEFAULT_CODE_BLOCK
+) -> Dict[str, Any]:
+    """
+    Write a compressed store to output_dir.
+
+    Args:
+        output_dir: directory to write the store into
+        codebook: (num_codes, dim) array of reconstruction vectors
+        codes: (n,) integer array of codebook indices
+        boundary_mask: optional (n,) boolean array of boundary flags
+        extra_header: optional extra fields merged into the header
+        residuals: optional residual side table for a subset of passages
+        ambiguity_sketch: optional quantile sketch of the ambiguity scores
+        code_encoding: 'array', 'bitpacked' or 'huffman' (see code_streams)
+        code_block_size: codes per Huffman block
+
+    Returns:
+        header dict as written to store_header.json
+    """
+    if boundary_mask is not None and len(boundary_mask) != len(codes):
+        raise ValueError(f"Boundary mask length {len(boundary_mask)} does not match {len(codes)} codes")
+
+    writer = CompressedStoreWriter(
+        output_dir, codebook, len(codes), boundary_mask is not None, code_encoding, code_block_size
+    )
+    writer.write(0, np.asarray(codes), boundary_mask)
+    return writer.close(extra_header, residuals, ambiguity_sketch)
+
+
+def save_pq_store(
+    output_dir: Path,
+    codebooks: np.ndarray,
+    codes: np.ndarray,
+    dim: int,
+    extra_header: Optional[Dict[str, Any]] = None
+) -> Dict[str, Any]:
+    """
+    Write a product-quantized store to output_dir.
+
+    Args:
+        output_dir: directory to write the store into
+        codebooks: (m, ksub, dsub) subspace codebooks
+        codes: (n, m) uint8 codes
+        dim: original vector dimension (m * dsub may include zero padding)
+        extra_header: optional extra fields merged into the header
+
+    Returns:
+        header dict as written to store_header.json
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    codes = np.asarray(codes)
+    m, ksub, dsub = codebooks.shape
+    if codes.dtype != np.uint8 or codes.ndim != 2 or codes.shape[1] != m:
+        raise ValueError(f"Expected (n, {m}) uint8 codes, got {codes.shape} {codes.dtype}")
+
+    np.save(output_dir / PQ_CODEBOOKS_FILENAME, np.ascontiguousarray(codebooks))
+    np.save(output_dir / CODES_FILENAME, np.ascontiguousarray(codes))
+
+    return _write_header(output_dir, [PQ_CODEBOOKS_FILENAME, CODES_FILENAME], {
+        'format': PQ_STORE_FORMAT,
+        'version': STORE_VERSION,
+        'num_vectors': int(len(codes)),
+        'dim': int(dim),
+        'num_subspaces': int(m),
+        'ksub': int(ksub),
+        'subspace_dim': int(dsub),
+        'num_codes': int(m * ksub),
+        'code_dtype': codes.dtype.name,
+        'code_bytes_per_vector': int(m * codes.dtype.itemsize),
+        'codebook_dtype': codebooks.dtype.name,
+        'has_boundary_mask': False
+    }, extra_header)
+
+
+def save_sq_store(
+    output_dir: Path,
+    scale: np.ndarray,
+    offset: np.ndarray,
+    codes: np.ndarray,
+    bits: int,
+    dim: int,
+    extra_header: Optional[Dict[str, Any]] = None
+) -> Dict[str, Any]:
+    """
+    Write a scalar-quantized store to output_dir.
+
+    Args:
+        output_dir: directory to write the store into
+        scale, offset: (dim,) quantization parameters
+        codes: (n, packed_dim) uint8 packed levels
+        bits: 8 or 4 bits per level
+        dim: vector dimension
+        extra_header: optional extra fields merged into the header
+
+    Returns:
+        header dict as written to store_header.json
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    codes = np.asarray(codes)
+    if codes.dtype != np.uint8 or codes.ndim != 2 or codes.shape[1] != packed_dim(dim, bits):
+        raise ValueError(f"Expected (n, {packed_dim(dim, bits)}) uint8 codes, got {codes.shape} {codes.dtype}")
+
+    np.save(output_dir / SQ_SCALE_FILENAME, np.asarray(scale, dtype=np.float32))
+    np.save(output_dir / SQ_OFFSET_FILENAME, np.asarray(offset, dtype=np.float32))
+    np.save(output_dir / CODES_FILENAME, np.ascontiguousarray(codes))
+
+    return _write_header(output_dir, [SQ_SCALE_FILENAME, SQ_OFFSET_FILENAME, CODES_FILENAME], {
+        'format': SQ_STORE_FORMAT,
+        'version': STORE_VERSION,
+        'num_vectors': int(len(codes)),
+        'dim': int(dim),
+        'bits': int(bits),
+        'num_codes': int(1 << bits),
+        'code_dtype': codes.dtype.name,
+        'code_bytes_per_vector': int(codes.shape[1]),
+        'has_boundary_mask': False
+    }, extra_header)
+
+
+# .npy header readers and writers by format version
+_NPY_HEADER_IO = {
+    (1, 0): (np.lib.format.read_array_header_1_0, np.lib.format.write_array_header_1_0),
+    (2, 0): (np.lib.format.read_array_header_2_0, np.lib.format.write_array_header_2_0),
+}
+
+
+def _append_npy_rows(path: Path, rows: np.ndarray, widen: bool = False, keep: Optional[int] = None) -> np.dtype:
+    """
+    Append rows to a .npy file in place and grow the shape in its header.
+
+    The data is written first and the header last, so an interrupted append
+    leaves the old array readable. If the larger shape no longer fits the
+    header padding, or widen is set and rows need a wider dtype than the
+    file has, the file is rewritten instead. With keep, only the first keep
+    rows are kept and rows replace the rest (used to re-encode the partly
+    filled tail of a code stream); the replaced rows are overwritten.
+
+    Returns:
+        dtype of the file after the append
+    """
+    path = Path(path)
+    rows = np.asarray(rows)
+    with open(path, 'rb') as f:
+        version = np.lib.format.read_magic(f)
+        read_header, write_header = _NPY_HEADER_IO.get(version, (None, None))
+        if read_header is None:
+            raise ValueError(f"Unsupported .npy format version {version} in {path}")
+        shape, fortran_order, dtype = read_header(f)
+        data_offset = f.tell()
+    if fortran_order or tuple(rows.shape[1:]) != tuple(shape[1:]):
+        raise ValueError(f"Cannot append rows of shape {rows.shape} to {path} with shape {shape}")
+
+    keep = shape[0] if keep is None else int(keep)
+    new_dtype = np.promote_types(dtype, rows.dtype) if widen else dtype
+    new_shape = (keep + len(rows),) + tuple(shape[1:])
+    header_buffer = io.BytesIO()
+    write_header(header_buffer, {
+        'descr': np.lib.format.dtype_to_descr(new_dtype), 'fortran_order': False, 'shape': new_shape
+    })
+    header_bytes = header_buffer.getvalue()
+
+    if new_dtype != dtype or len(header_bytes) != data_offset:
+        existing = np.load(path, mmap_mode='r')
+        combined = np.concatenate([np.asarray(existing[:keep], dtype=new_dtype), rows.astype(new_dtype)])
+        del existing
+        np.save(path, combined)
+        return new_dtype
+
+    with open(path, 'r+b') as f:
+        f.seek(data_offset + keep * dtype.itemsize * int(np.prod(shape[1:], dtype=np.int64)))
+        f.write(np.ascontiguousarray(rows, dtype=dtype).tobytes())
+        f.truncate()
+        f.flush()
+        f.seek(0)
+        f.write(header_bytes)
+    return dtype
+
+
+def _append_code_stream(store_dir: Path, header: Dict[str, Any], codes: np.ndarray):
+    """
+    Append codes to a store's codes.npy or code stream in place.
+
+    Packed streams are extended from their last byte-aligned group of 8
+    codes, Huffman streams from the start of their last (partial) block,
+    so only that tail is decoded and re-encoded with the existing code.
+    """
+    encoding = header.get('code_encoding', 'array')
+    num_vectors = header['num_vectors']
+    if encoding == 'array':
+        _append_npy_rows(store_dir / CODES_FILENAME, codes.astype(header['code_dtype']))
+        return
+
+    existing = _open_codes(store_dir, header, 'r')
+    if encoding == 'bitpacked':
+        # Groups of 8 codes end on a byte boundary
+        tail_start = num_vectors - num_vectors % 8
+        tail = np.concatenate([existing[tail_start:num_vectors], codes])
+        packed = pack_codes(tail, header['code_bits'])
+        del existing
+        _append_npy_rows(store_dir / PACKED_CODES_FILENAME, packed, keep=tail_start * header['code_bits'] // 8)
+        return
+
+    block_size = header['code_block_size']
+    first_block = num_vectors // block_size
+    tail = np.concatenate([existing[first_block * block_size:num_vectors], codes])
+    stream, block_offsets = existing.coder.encode(tail, block_size)
+    stream_start = int(existing.block_offsets[first_block])
+    del existing
+    _append_npy_rows(store_dir / HUFFMAN_CODES_FILENAME, stream, keep=stream_start)
+    _append_npy_rows(store_dir / CODE_BLOCK_OFFSETS_FILENAME, block_offsets[1:] + stream_start, keep=first_block + 1)
+
+
+def append_to_store(
+    store_dir: Path,
+    codes: np.ndarray,
+    boundary_mask: Optional[np.ndarray] = None,
+    residual_rows: Optional[np.ndarray] = None,
+    residual_codes: Optional[np.ndarray] = None,
+    ambiguity_scores: Optional[np.ndarray] = None
+) -> Dict[str, Any]:
+    """
+    Append passages to a codebook store in place, keeping its codebook.
+
+    Args:
+        store_dir: directory containing a 'codebook-codes' store
+        codes: (m,) codebook indices of the new passages
+        boundary_mask: (m,) boundary flags, required if the store has a mask
+        residual_rows: passage indices (>= the old passage count) of new
+                       residual rows, required with residual_codes if the
+                       store has a residual side table
+        residual_codes: (len(residual_rows), packed_dim) uint8 packed levels
+        ambiguity_scores: (m,) ambiguity scores of the new passages, required
+                          if the store has an ambiguity sketch
+
+    Returns:
+        updated header dict as written to store_header.json
+    """
+    store_dir = Path(store_dir)
+    with open(store_dir / HEADER_FILENAME, 'r') as f:
+        header = json.load(f)
+    if header.get('format') != STORE_FORMAT:
+        raise ValueError(f"Appending is only supported for '{STORE_FORMAT}' stores, not {header.get('format')}")
+
+    codes = np.asarray(codes)
+    if len(codes) > 0 and int(np.max(codes)) >= header['num_codes']:
+        raise ValueError(f"Code {int(np.max(codes))} out of range for codebook of size {header['num_codes']}")
+    num_vectors = header['num_vectors'] + len(codes)
+
+    _append_code_stream(store_dir, header, codes)
+    if header.get('has_boundary_mask'):
+        if boundary_mask is None or len(boundary_mask) != len(codes):
+            raise ValueError("Store has a boundary mask; boundary flags are required for every new passage")
+        _append_npy_rows(store_dir / BOUNDARY_MASK_FILENAME, np.asarray(boundary_mask, dtype=bool))
+
+    residual_header = {}
+    if header.get('has_residuals'):
+        if residual_rows is None or residual_codes is None:
+            raise ValueError("Store has a residual side table; residual rows and codes are required")
+        residual_rows = np.asarray(residual_rows)
+        if len(residual_rows) > 0 and int(residual_rows.min()) < header['num_vectors']:
+            raise ValueError("Appended residual rows must index new passages")
+        row_dtype = _append_npy_rows(
+            store_dir / RESIDUAL_ROWS_FILENAME, residual_rows.astype(code_dtype_for(num_vectors)), widen=True
+        )
+        _append_npy_rows(store_dir / RESIDUAL_CODES_FILENAME, np.asarray(residual_codes, dtype=np.uint8))
+        num_residuals = header['num_residuals'] + len(residual_rows)
+        row_bytes = int(row_dtype.itemsize + np.asarray(residual_codes).shape[1])
+        residual_header = {
+            'num_residuals': int(num_residuals),
+            'residual_bytes_per_row': row_bytes,
+            'residual_bytes_per_vector': float(row_bytes * num_residuals / max(1, num_vectors))
+        }
+
+    sketch_header = {}
+    if header.get('has_ambiguity_sketch'):
+        if ambiguity_scores is None or len(ambiguity_scores) != len(codes):
+            raise ValueError("Store has an ambiguity sketch; ambiguity scores are required for every new passage")
+        sketch = KLLSketch.load(store_dir / AMBIGUITY_SKETCH_FILENAME).update(ambiguity_scores)
+        sketch.save(store_dir / AMBIGUITY_SKETCH_FILENAME)
+        sketch_header['ambiguity_sketch_items'] = sketch.num_retained
+
+    # Recompute the size accounting over the same files
+    # The code entropy was measured over the codes at write time only
+    encoding = header.get('code_encoding', 'array')
+    header = {key: value for key, value in header.items()
+              if key not in ('files', 'store_bytes', 'dense_float32_bytes', 'bytes_per_vector',
+                             'compression_ratio_vs_float32', 'code_entropy_bits_per_vector')}
+    header.update(residual_header, **sketch_header, num_vectors=int(num_vectors))
+    if 'code_bits_per_vector' in header:
+        header['code_bits_per_vector'] = _code_bits_per_vector(store_dir, encoding, num_vectors)
+    files = [CODEBOOK_FILENAME] + CODE_STREAM_FILES[encoding]
+    if header.get('has_boundary_mask'):
+        files.append(BOUNDARY_MASK_FILENAME)
+    if header.get('has_residuals'):
+        files.extend([RESIDUAL_ROWS_FILENAME, RESIDUAL_CODES_FILENAME, RESIDUAL_SCALE_FILENAME, RESIDUAL_OFFSET_FILENAME])
+    return _write_header(store_dir, files, header)
+
+
+def is_compressed_store(store_dir: Path) -> bool:
+    """Whether store_dir contains a compressed store."""
+    return (Path(store_dir) / HEADER_FILENAME).exists()
+
+
+def open_compressed_store(
+    store_dir: Path,
+    mmap: bool = True
+) -> Union[CompressedStore, ProductQuantizedStore, ScalarQuantizedStore]:
+    """
+    Open a compressed store.
+
+    Args:
+        store_dir: directory containing the store
+        mmap: memory-map the arrays instead of reading them into RAM
+
+    Returns:
+        CompressedStore, or ProductQuantizedStore / ScalarQuantizedStore for
+        product- and scalar-quantized stores
+    """
+    store_dir = Path(store_dir)
+    header_path = store_dir / HEADER_FILENAME
+    if not header_path.exists():
+        raise FileNotFoundError(f"Compressed store header not found: {header_path}")
+
+    with open(header_path, 'r') as f:
+        header = json.load(f)
+
+    if header.get('format') not in (STORE_FORMAT, PQ_STORE_FORMAT, SQ_STORE_FORMAT):
+        raise ValueError(f"Unsupported store format: {header.get('format')}")
+    if header.get('version', 0) > STORE_VERSION:
+        raise ValueError(f"Store version {header['version']} is newer than supported version {STORE_VERSION}")
+
+    mmap_mode = 'r' if mmap else None
+    if header['format'] == PQ_STORE_FORMAT:
+        return ProductQuantizedStore(
+            codebooks=np.load(store_dir / PQ_CODEBOOKS_FILENAME, mmap_mode=mmap_mode),
+            codes=np.load(store_dir / CODES_FILENAME, mmap_mode=mmap_mode),
+            header=header
+        )
+    if header['format'] == SQ_STORE_FORMAT:
+        return ScalarQuantizedStore(
+            scale=np.load(store_dir / SQ_SCALE_FILENAME),
+            offset=np.load(store_dir / SQ_OFFSET_FILENAME),
+            codes=np.load(store_dir / CODES_FILENAME, mmap_mode=mmap_mode),
+            header=header
+        )
+
+    codebook = np.load(store_dir / CODEBOOK_FILENAME, mmap_mode=mmap_mode)
+    codes = _open_codes(store_dir, header, mmap_mode)
+
+    boundary_mask = None
+    if header.get('has_boundary_mask'):
+        boundary_mask = np.load(store_dir / BOUNDARY_MASK_FILENAME, mmap_mode=mmap_mode)
+
+    ambiguity_sketch = None
+    if header.get('has_ambiguity_sketch'):
+        ambiguity_sketch = KLLSketch.load(store_dir / AMBIGUITY_SKETCH_FILENAME)
+
+    residuals = None
+    if header.get('has_residuals'):
+        residuals = ResidualTable(
+            rows=np.load(store_dir / RESIDUAL_ROWS_FILENAME, mmap_mode=mmap_mode),
+            codes=np.load(store_dir / RESIDUAL_CODES_FILENAME, mmap_mode=mmap_mode),
+            scale=np.load(store_dir / RESIDUAL_SCALE_FILENAME),
+            offset=np.load(store_dir / RESIDUAL_OFFSET_FILENAME),
+            bits=int(header['residual_bits'])
+        )
+
+    return CompressedStore(
+        codebook=codebook,
+        codes=codes,
+        boundary_mask=boundary_mask,
+        header=header,
+        residuals=residuals,
+        ambiguity_sketch=ambiguity_sketch
+    )
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+Dtype Policy
+
+One floating point policy for the compression and evaluation scripts, so
+that nothing silently upcasts to float64 and doubles memory bandwidth:
+
+- float32 (default): store and compute in float32
+- float16:           store vectors and codebooks in float16, compute in
+                     float32 (CPU BLAS has no float16 GEMM, and float16
+                     accumulation loses precision quickly)
+- float64:           reference precision, used for drift reports
+
+Reductions that sum over many rows (MSE, inertia) always accumulate in
+float64 regardless of the policy.
+
+Usage:
+    from dtype_policy import DtypePolicy
+    policy = DtypePolicy('float16')
+    vectors = policy.to_compute(vectors)
+    codebook = policy.to_storage(codebook)
+    embeddings = policy.view(np.load(path, mmap_mode='r'))   # cast per read
+"""
+
+import numpy as np
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, Optional
+
+
+DTYPE_CHOICES = ['float32', 'float16', 'float64']
+DEFAULT_DTYPE = 'float32'
+
+# Rows per block for float64-accumulated reductions
+REDUCTION_BLOCK_ROWS = 65536
+
+
+@dataclass
+class DtypePolicy:
+    """Storage and compute dtypes for vectors and codebooks."""
+    name: str = DEFAULT_DTYPE
+
+    def __post_init__(self):
+        if self.name not in DTYPE_CHOICES:
+            raise ValueError(f"Unknown dtype: {self.name} (expected one of {DTYPE_CHOICES})")
+
+    @property
+    def storage(self) -> np.dtype:
+        """Dtype arrays are stored in."""
+        return np.dtype(self.name)
+
+    @property
+    def compute(self) -> np.dtype:
+        """Dtype arithmetic runs in (never narrower than float32)."""
+        return np.promote_types(self.storage, np.float32)
+
+    def to_storage(self, array: np.ndarray) -> np.ndarray:
+        """Cast to the storage dtype (no copy if already stored that way)."""
+        return np.asarray(array).astype(self.storage, copy=False)
+
+    def to_compute(self, array: np.ndarray) -> np.ndarray:
+        """Round to the storage dtype, then cast to the compute dtype."""
+        return self.to_storage(array).astype(self.compute, copy=False)
+
+    def view(self, array: np.ndarray) -> 'ComputeView':
+        """Lazy to_compute view of a (memory-mapped) array, cast one read at a time."""
+        return ComputeView(array, self)
+
+
+class ComputeView:
+    """
+    Read-only view of an array that applies a policy's to_compute to every read.
+
+    Streaming code reads memory-mapped embeddings one slice, batch or sample
+    at a time; wrapping the memmap keeps each read under the policy without
+    materializing the converted file. Anything that needs the whole array
+    (np.asarray) gets it converted block by block.
+    """
+
+    def __init__(self, array: np.ndarray, policy: DtypePolicy):
+        self.array = array
+        self.policy = policy
+
+    @property
+    def shape(self):
+        return self.array.shape
+
+    @property
+    def ndim(self) -> int:
+        return self.array.ndim
+
+    @property
+    def size(self) -> int:
+        return self.array.size
+
+    @property
+    def dtype(self) -> np.dtype:
+        return self.policy.compute
+
+    def __len__(self) -> int:
+        return len(self.array)
+
+    def __getitem__(self, key) -> np.ndarray:
+        return self.policy.to_compute(self.array[key])
+
+    def __array__(self, dtype=None, copy=None) -> np.ndarray:
+        converted = np.empty(self.shape, dtype=self.dtype)
+        for start in range(0, len(self), REDUCTION_BLOCK_ROWS):
+            converted[start:start + REDUCTION_BLOCK_ROWS] = self[start:start + REDUCTION_BLOCK_ROWS]
+        return converted if dtype is None else converted.astype(dtype, copy=False)
+
+
+def mean_squared_error(a: np.ndarray, b: np.ndarray) -> float:
+    """Mean squared difference, accumulated blockwise in float64."""
+    total = 0.0
+    for start in range(0, len(a), REDUCTION_BLOCK_ROWS):
+        diff = np.asarray(a[start:start + REDUCTION_BLOCK_ROWS], dtype=np.float64) - \
+            np.asarray(b[start:start + REDUCTION_BLOCK_ROWS], dtype=np.float64)
+        total += float(np.einsum('ij,ij->', diff, diff))
+    return total / max(1, a.size)
+
+
+def reconstruction_mse(vectors: np.ndarray, codebook: np.ndarray, codes: np.ndarray) -> float:
+    """MSE of vectors against codebook[codes], accumulated blockwise in float64."""
+    total = 0.0
+    for start in range(0, len(vectors), REDUCTION_BLOCK_ROWS):
+        block_codes = np.asarray(codes[start:start + REDUCTION_BLOCK_ROWS])
+        diff = np.asarray(vectors[start:start + REDUCTION_BLOCK_ROWS], dtype=np.float64) - \
+            np.asarray(codebook, dtype=np.float64)[block_codes]
+        total += float(np.einsum('ij,ij->', diff, diff))
+    return total / max(1, vectors.size)
+
+
+def codebook_drift(
+    vectors: np.ndarray,
+    codebook: np.ndarray,
+    codes: np.ndarray,
+    policy: DtypePolicy,
+    mse_fn: Callable[[np.ndarray, np.ndarray, np.ndarray], float] = reconstruction_mse
+) -> Dict[str, float]:
+    """
+    Reconstruction drift from storing the codebook under policy vs float64.
+
+    Args:
+        vectors: (n, d) original vectors
+        codebook: (num_codes, d) codebook at full precision
+        codes: (n,) codebook index per vector
+        policy: dtype policy the codebook is stored with
+        mse_fn: (vectors, codebook, codes) -> MSE (default: flat codebook lookup;
+                pass pq_reconstruction_mse for product-quantized codebooks)
+
+    Returns:
+        dict with the MSE under the policy, the float64 MSE, their difference
+        and the largest absolute codebook rounding error
+    """
+    reference = np.asarray(codebook, dtype=np.float64)
+    stored = policy.to_storage(codebook).astype(np.float64)
+    mse = mse_fn(vectors, stored, codes)
+    mse_float64 = mse_fn(vectors, reference, codes)
+    return {
+        'dtype': policy.name,
+        'mse': mse,
+        'mse_float64': mse_float64,
+        'mse_abs_diff': abs(mse - mse_float64),
+        'mse_rel_diff': abs(mse - mse_float64) / mse_float64 if mse_float64 > 0 else 0.0,
+        'max_codebook_abs_error': float(np.max(np.abs(stored - reference))) if reference.size else 0.0
+    }
+
+
+def metric_drift(
+    metrics: Dict[str, float],
+    reference_metrics: Dict[str, float],
+    keys: Optional[Iterable[str]] = None
+) -> Dict[str, Dict[str, float]]:
+    """
+    Per-metric drift of metrics against float64 reference metrics.
+
+    Args:
+        metrics: metric values under the dtype policy
+        reference_metrics: the same metrics computed in float64
+        keys: metrics to compare (default: numeric keys present in both)
+
+    Returns:
+        key -> {'value', 'float64', 'abs_diff'}
+    """
+    if keys is None:
+        keys = [key for key, value in metrics.items()
+                if isinstance(value, (int, float)) and key in reference_metrics]
+    return {
+        key: {
+            'value': float(metrics[key]),
+            'float64': float(reference_metrics[key]),
+            'abs_diff': float(abs(metrics[key] - reference_metrics[key]))
+        }
+        for key in keys
+    }
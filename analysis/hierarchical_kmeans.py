@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+"""
+Hierarchical (Tree) K-Means
+
+Flat k-means pays k distance evaluations per vector on every assignment,
+which makes codebooks with thousands of centroids expensive to fit and to
+search. A k-means tree splits the data into `branching` clusters, then
+splits each cluster again, level by level, until the leaves hold k
+centroids in total. Leaf budgets are shared out in proportion to cluster
+sizes, so dense regions get more leaves.
+
+Two assignments are provided:
+
+- tree:  descend from the root, picking the nearest child on each level
+         (about branching * depth distance evaluations per vector; may
+         miss the true nearest leaf across a branch boundary)
+- exact: blocked nearest-centroid search over all leaves (k evaluations)
+
+Usage:
+    from hierarchical_kmeans import fit_kmeans_tree, tree_assign
+    tree, labels = fit_kmeans_tree(vectors, k=4096, branching=64)
+    ids, distances = tree_assign(tree, vectors)
+"""
+
+import time
+import numpy as np
+from dataclasses import dataclass
+from typing import Dict, List, Tuple
+
+from sklearn.cluster import KMeans
+
+from centroid_assignment import DEFAULT_BLOCK_BYTES, assign_nearest
+
+
+DEFAULT_BRANCHING = 16
+
+
+@dataclass
+class KMeansTree:
+    """
+    A k-means tree stored level by level.
+
+    levels[0] holds the children of the (implicit) root. The children of
+    node j on level l are rows offsets[l][j]:offsets[l][j + 1] of
+    levels[l + 1]. The last level holds the leaf centroids, which form
+    the flat codebook of the tree.
+    """
+    levels: List[np.ndarray]
+    offsets: List[np.ndarray]
+
+    @property
+    def leaves(self) -> np.ndarray:
+        return self.levels[-1]
+
+    @property
+    def depth(self) -> int:
+        return len(self.levels)
+
+    @property
+    def k(self) -> int:
+        return len(self.levels[-1])
+
+
+def tree_depth(k: int, branching: int) -> int:
+    """Smallest depth whose full tree (branching ** depth leaves) holds k leaves."""
+    depth = 1
+    while branching ** depth < k:
+        depth += 1
+    return depth
+
+
+def allocate_leaves(counts: np.ndarray, total: int) -> np.ndarray:
+    """
+    Share a leaf budget over child clusters in proportion to their sizes.
+
+    Every child gets at least one leaf and at most one leaf per member;
+    the rest is split by largest remainder.
+
+    Args:
+        counts: (c,) member count per child, all positive
+        total: leaf budget of the parent, at least c
+
+    Returns:
+        (c,) int64 leaf budget per child
+    """
+    counts = np.asarray(counts, dtype=np.int64)
+    allocation = np.ones(len(counts), dtype=np.int64)
+    spare = int(min(total, counts.sum())) - len(counts)
+    if spare > 0:
+        share = spare * counts / counts.sum()
+        extra = np.floor(share).astype(np.int64)
+        leftover = spare - int(extra.sum())
+        # Largest fractional parts first; the stable sort breaks ties by child index
+        extra[np.argsort(extra - share, kind='stable')[:leftover]] += 1
+        allocation += extra
+    return np.minimum(allocation, counts)
+
+
+def fit_node(
+    vectors: np.ndarray,
+    num_clusters: int,
+    random_state: int = 42,
+    n_init: int = 10
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Fit one tree node: KMeans over the node's members.
+
+    Nodes with a single cluster take the mean, and nodes with no more
+    members than clusters keep every member as its own centroid.
+
+    Returns:
+        centroids: (c, d) child centroids, c <= num_clusters
+        labels: (m,) child index per member
+    """
+    if num_clusters <= 1:
+        return vectors.mean(axis=0, dtype=np.float64, keepdims=True).astype(vectors.dtype), \
+            np.zeros(len(vectors), dtype=np.int64)
+    if len(vectors) <= num_clusters:
+        return vectors.copy(), np.arange(len(vectors), dtype=np.int64)
+
+    kmeans = KMeans(n_clusters=num_clusters, random_state=random_state, n_init=n_init)
+    kmeans.fit(vectors)
+    labels = kmeans.labels_.astype(np.int64)
+
+    # Drop clusters that ended up empty so every child owns members (and leaves)
+    counts = np.bincount(labels, minlength=num_clusters)
+    if np.all(counts > 0):
+        return kmeans.cluster_centers_.astype(vectors.dtype, copy=False), labels
+    keep = counts > 0
+    remap = np.cumsum(keep) - 1
+    return kmeans.cluster_centers_[keep].astype(vectors.dtype, copy=False), remap[labels]
+
+
+def fit_kmeans_tree(
+    vectors: np.ndarray,
+    k: int,
+    branching: int = DEFAULT_BRANCHING,
+    random_state: int = 42,
+    n_init: int = 10,
+    depth: int = None
+) -> Tuple[KMeansTree, np.ndarray]:
+    """
+    Fit a k-means tree with about k leaves.
+
+    Each level is fitted breadth first, so the children of every node are
+    contiguous in the next level. Inner nodes split into at most
+    `branching` children; nodes on the last level split into their whole
+    leaf budget.
+
+    Args:
+        vectors: (n, d) array of vectors
+        k: total number of leaves (capped at n; fewer if clusters are tiny)
+        branching: maximum children per inner node (two-level tree when
+            k <= branching ** 2)
+        random_state: random seed for every node fit
+        n_init: KMeans restarts per node fit
+        depth: number of levels (default: tree_depth(k, branching))
+
+    Returns:
+        tree: the fitted KMeansTree
+        labels: (n,) leaf index per vector from the node fits
+    """
+    vectors = np.asarray(vectors)
+    n = len(vectors)
+    k = max(1, min(int(k), n))
+    branching = max(2, int(branching))
+    if depth is None:
+        depth = tree_depth(k, branching)
+
+    labels = np.zeros(n, dtype=np.int64)
+    levels, offsets = [], []
+    # (member row indices, leaf budget) per node on the current level
+    frontier = [(np.arange(n), k)]
+
+    for level in range(depth):
+        last = level == depth - 1
+        level_centroids = []
+        level_offsets = [0]
+        next_frontier = []
+
+        for members, budget in frontier:
+            num_children = budget if last else min(branching, budget)
+            centroids, node_labels = fit_node(vectors[members], num_children, random_state, n_init)
+            start = level_offsets[-1]
+            level_centroids.append(centroids)
+            level_offsets.append(start + len(centroids))
+
+            if last:
+                labels[members] = start + node_labels
+                continue
+
+            order = np.argsort(node_labels, kind='stable')
+            counts = np.bincount(node_labels, minlength=len(centroids))
+            budgets = allocate_leaves(counts, budget)
+            for child_members, child_budget in zip(np.split(members[order], np.cumsum(counts)[:-1]), budgets):
+                next_frontier.append((child_members, int(child_budget)))
+
+        levels.append(np.concatenate(level_centroids))
+        if level > 0:
+            # Children of node j on the previous level: level_offsets[j]:level_offsets[j + 1]
+            offsets.append(np.asarray(level_offsets, dtype=np.int64))
+        frontier = next_frontier
+
+    return KMeansTree(levels=levels, offsets=offsets), labels
+
+
+def tree_assign(
+    tree: KMeansTree,
+    vectors: np.ndarray,
+    block_bytes: int = DEFAULT_BLOCK_BYTES
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Approximate nearest-leaf assignment by descending the tree.
+
+    On each level, vectors are grouped by their current node and searched
+    against that node's children only.
+
+    Args:
+        tree: fitted KMeansTree
+        vectors: (n, d) array of vectors
+        block_bytes: byte budget for one distance block
+
+    Returns:
+        ids: (n,) int64 leaf indices
+        distances: (n,) Euclidean distances to the chosen leaves
+    """
+    node, distances = assign_nearest(vectors, tree.levels[0], block_bytes)
+
+    for level in range(1, tree.depth):
+        offsets = tree.offsets[level - 1]
+        children = tree.levels[level]
+        order = np.argsort(node, kind='stable')
+        bounds = np.searchsorted(node[order], np.arange(len(offsets)))
+        next_node = np.empty_like(node)
+
+        for parent in np.flatnonzero(np.diff(bounds)):
+            rows = order[bounds[parent]:bounds[parent + 1]]
+            lo, hi = offsets[parent], offsets[parent + 1]
+            ids, distances[rows] = assign_nearest(np.asarray(vectors[rows]), children[lo:hi], block_bytes)
+            next_node[rows] = lo + ids
+        node = next_node
+
+    return node, distances
+
+
+def exact_assign(
+    tree: KMeansTree,
+    vectors: np.ndarray,
+    block_bytes: int = DEFAULT_BLOCK_BYTES
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Exact nearest-leaf assignment: blocked search over all leaves."""
+    return assign_nearest(vectors, tree.leaves, block_bytes)
+
+
+def tree_evaluations_per_vector(tree: KMeansTree, ids: np.ndarray) -> float:
+    """Mean number of centroid distances a tree descent evaluated per vector."""
+    evaluations = float(len(tree.levels[0]))
+    node = ids
+    # Walk the leaves back up; each level costs the size of the chosen node's family
+    for level in range(tree.depth - 1, 0, -1):
+        offsets = tree.offsets[level - 1]
+        parent = np.searchsorted(offsets, node, side='right') - 1
+        evaluations += float(np.mean(offsets[parent + 1] - offsets[parent]))
+        node = parent
+    return evaluations
+
+
+def time_assignment(assign, vectors: np.ndarray, repeats: int = 3) -> Tuple[float, np.ndarray, np.ndarray]:
+    """Best wall time over repeats and the (ids, distances) of the last run."""
+    best = float('inf')
+    for _ in range(max(1, repeats)):
+        start = time.perf_counter()
+        ids, distances = assign(vectors)
+        best = min(best, time.perf_counter() - start)
+    return best, ids, distances
+
+
+def assignment_stats(seconds: float, distances: np.ndarray, n: int, dim: int, evaluations: float) -> Dict:
+    """Throughput and per-dimension MSE of one assignment run."""
+    return {
+        'seconds': float(seconds),
+        'vectors_per_sec': float(n / seconds) if seconds > 0 else float('inf'),
+        'mse': float(np.sum(distances.astype(np.float64) ** 2) / max(1, n * dim)),
+        'distance_evaluations_per_vector': float(evaluations)
+    }
+
+
+def compare_tree_to_flat(
+    vectors: np.ndarray,
+    tree: KMeansTree,
+    flat_centroids: np.ndarray,
+    repeats: int = 3
+) -> Dict:
+    """
+    Compare tree and exact leaf assignment against flat k-means.
+
+    Args:
+        vectors: (n, d) vectors to assign
+        tree: fitted KMeansTree
+        flat_centroids: (k, d) centroids of a flat k-means with the same k
+        repeats: timed runs per assignment; the fastest is reported
+
+    Returns:
+        dict with 'flat', 'tree' and 'exact' assignment stats (seconds,
+        vectors/sec, MSE per dimension, distance evaluations per vector)
+        and the fraction of vectors the tree assigns to the exact leaf
+    """
+    n, dim = vectors.shape
+
+    seconds, _, distances = time_assignment(lambda v: assign_nearest(v, flat_centroids), vectors, repeats)
+    flat = assignment_stats(seconds, distances, n, dim, len(flat_centroids))
+
+    seconds, tree_ids, distances = time_assignment(lambda v: tree_assign(tree, v), vectors, repeats)
+    tree_stats = assignment_stats(seconds, distances, n, dim, tree_evaluations_per_vector(tree, tree_ids))
+
+    seconds, exact_ids, distances = time_assignment(lambda v: exact_assign(tree, v), vectors, repeats)
+    exact = assignment_stats(seconds, distances, n, dim, tree.k)
+
+    for stats in (tree_stats, exact):
+        stats['speed_vs_flat'] = flat['seconds'] / stats['seconds'] if stats['seconds'] > 0 else float('inf')
+        stats['mse_vs_flat'] = stats['mse'] / flat['mse'] if flat['mse'] > 0 else 1.0
+
+    return {
+        'num_vectors': int(n),
+        'k': int(len(flat_centroids)),
+        'tree_leaves': int(tree.k),
+        'tree_depth': int(tree.depth),
+        'flat': flat,
+        'tree': tree_stats,
+        'exact': exact,
+        'tree_exact_agreement': float(np.mean(tree_ids == exact_ids))
+    }
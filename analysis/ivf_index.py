@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Inverted-File (IVF) Index
+
+Approximate top-k cosine search that reuses the k-means centroids of the
+compression run as its coarse quantizer:
+
+- every passage is assigned to its nearest centroid (blocked, see
+  centroid_assignment), giving one posting list per centroid
+- posting lists hold passage ids (ascending within a list) and their
+  normalized vectors, stored contiguously in list order, so a probed list
+  is a single slice
+- a query is routed to its nprobe nearest centroids (one GEMM per query
+  block) and only the passages of those lists are scored
+
+The stored vectors can be the original embeddings or the decoded compressed
+ones; the posting lists are the same either way. nprobe = number of lists
+searches every passage and matches exact search.
+
+Results are ordered by descending similarity, ties by ascending passage
+index. Queries whose probed lists hold fewer than k passages are padded
+with index -1 and score -inf.
+
+Usage:
+    from ivf_index import IVFIndex
+    index = IVFIndex(centroids, passage_embeddings, nprobe=8)
+    indices, scores = index.search_batch(query_embeddings, k=100)   # (q, k) each
+"""
+
+import numpy as np
+from typing import Tuple
+
+from batched_search import DEFAULT_QUERY_BLOCK, normalize_rows, select_top_k, sort_top_k
+from centroid_assignment import DEFAULT_BLOCK_BYTES, assign_nearest, squared_distances
+
+
+DEFAULT_NPROBE = 8
+
+
+class IVFIndex:
+    """Posting lists of passages per k-means centroid, searched by probing the nprobe nearest lists."""
+
+    def __init__(
+        self,
+        centroids: np.ndarray,
+        vectors: np.ndarray,
+        nprobe: int = DEFAULT_NPROBE,
+        block_bytes: int = DEFAULT_BLOCK_BYTES
+    ):
+        """
+        Args:
+            centroids: (num_lists, dim) coarse quantizer (unsnapped k-means centroids)
+            vectors: (n, dim) passage vectors stored in the posting lists
+            nprobe: lists probed per query (clamped to num_lists)
+            block_bytes: byte budget for one assignment distance block
+        """
+        self.centroids = np.asarray(centroids)
+        self.centroid_sq_norms = np.einsum('ij,ij->i', self.centroids, self.centroids)
+        self.num_passages = len(vectors)
+        self.nprobe = nprobe
+
+        labels, _ = assign_nearest(vectors, self.centroids, block_bytes)
+        order = np.argsort(labels, kind='stable')
+        self.list_passages = order.astype(np.int64)
+        self.list_sizes = np.bincount(labels, minlength=len(self.centroids)).astype(np.int64)
+        self.list_starts = np.concatenate([[0], np.cumsum(self.list_sizes)[:-1]]).astype(np.int64)
+        # Normalized vectors in posting-list order
+        self.list_vectors = normalize_rows(np.asarray(vectors)[order])
+
+    def __len__(self) -> int:
+        return self.num_passages
+
+    @property
+    def num_lists(self) -> int:
+        return len(self.centroids)
+
+    def probe(self, queries: np.ndarray) -> np.ndarray:
+        """
+        Posting lists probed by each query.
+
+        Returns:
+            (q, min(nprobe, num_lists)) list ids, nearest centroid first
+        """
+        nprobe = max(1, min(self.nprobe, self.num_lists))
+        distances = squared_distances(np.atleast_2d(queries), self.centroids, self.centroid_sq_norms)
+        if nprobe < self.num_lists:
+            nearest = np.argpartition(distances, nprobe - 1, axis=1)[:, :nprobe]
+        else:
+            nearest = np.broadcast_to(np.arange(self.num_lists), distances.shape)
+        order = np.argsort(np.take_along_axis(distances, nearest, axis=1), axis=1, kind='stable')
+        return np.take_along_axis(nearest, order, axis=1)
+
+    def candidate_counts(self, queries: np.ndarray) -> np.ndarray:
+        """(q,) number of passages scored for each query at the current nprobe."""
+        return self.list_sizes[self.probe(queries)].sum(axis=1)
+
+    def _list_positions(self, lists: np.ndarray) -> np.ndarray:
+        """Positions (into the list-ordered arrays) of every passage in lists."""
+        sizes = self.list_sizes[lists]
+        total = int(sizes.sum())
+        shift = self.list_starts[lists] - (np.cumsum(sizes) - sizes)
+        return np.repeat(shift, sizes) + np.arange(total)
+
+    def search_batch(
+        self,
+        queries: np.ndarray,
+        k: int,
+        query_block: int = DEFAULT_QUERY_BLOCK
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Approximate top-k passages for every query.
+
+        Args:
+            queries: (q, d) query embeddings (routed raw, scored normalized)
+            k: results per query
+            query_block: queries routed per GEMM
+
+        Returns:
+            indices: (q, k) passage indices, highest similarity first (-1 padded)
+            scores: (q, k) cosine similarities (-inf padded)
+        """
+        queries = np.atleast_2d(queries)
+        k = min(k, self.num_passages)
+        normalized = normalize_rows(queries).astype(self.list_vectors.dtype, copy=False)
+        indices = np.full((len(queries), k), -1, dtype=np.int64)
+        scores = np.full((len(queries), k), -np.inf, dtype=self.list_vectors.dtype)
+        for start in range(0, len(queries), query_block):
+            probed = self.probe(queries[start:start + query_block])
+            for row, lists in enumerate(probed, start):
+                positions = self._list_positions(lists)
+                candidate_scores = (self.list_vectors[positions] @ normalized[row])[None, :]
+                candidate_scores, candidates = select_top_k(candidate_scores, self.list_passages[positions][None, :], k)
+                found, found_scores = sort_top_k(candidate_scores, candidates)
+                indices[row, :found.shape[1]] = found[0]
+                scores[row, :found.shape[1]] = found_scores[0]
+        return indices, scores
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""
+K-Means Fit Cache
+
+Shares k-means fits across compression modes and grid values. The grid
+step only affects snapping, so every (grid, mode) pair over the same data
+can reuse one fit keyed by (dataset hash, k, seed, method).
+
+Each cached fit holds the centroids, the labels and the top-2 centroid
+distances per vector (used for boundary classification). Fits live in an
+in-memory LRU and, optionally, in an on-disk directory with size-bounded
+least-recently-used eviction.
+
+Usage:
+    from kmeans_cache import KMeansFitCache
+    cache = KMeansFitCache(cache_dir=Path('results/kmeans_cache'), max_disk_bytes=2 * 1024**3)
+    fit, hit = cache.get_or_fit(vectors, k, seed, fit_fn, method='sklearn')
+"""
+
+import os
+import hashlib
+import weakref
+import numpy as np
+from pathlib import Path
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional, Tuple
+
+from centroid_assignment import nearest_two, assign_nearest
+
+
+# Fit function signature: (vectors, k, seed) -> (centroids, labels)
+FitFunction = Callable[[np.ndarray, int, int], Tuple[np.ndarray, np.ndarray]]
+
+DEFAULT_MAX_MEMORY_BYTES = 1024 * 1024 * 1024
+
+
+@dataclass
+class KMeansFit:
+    """A cached k-means fit."""
+    centroids: np.ndarray
+    labels: np.ndarray
+    top2_distances: np.ndarray
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.centroids.nbytes + self.labels.nbytes + self.top2_distances.nbytes)
+
+    @property
+    def inertia(self) -> float:
+        """Sum of squared distances to the nearest centroid."""
+        return float(np.sum(self.top2_distances[:, 0].astype(np.float64) ** 2))
+
+    @property
+    def ambiguity_scores(self) -> np.ndarray:
+        """Ambiguity score per vector: xi = d2 - d1."""
+        return self.top2_distances[:, 1] - self.top2_distances[:, 0]
+
+
+def dataset_fingerprint(vectors: np.ndarray) -> str:
+    """Content hash of a vector matrix (shape, dtype and data)."""
+    hasher = hashlib.blake2b(digest_size=16)
+    hasher.update(repr((vectors.shape, vectors.dtype.str)).encode())
+    hasher.update(np.ascontiguousarray(vectors).data)
+    return hasher.hexdigest()
+
+
+def build_fit(vectors: np.ndarray, centroids: np.ndarray, labels: np.ndarray) -> KMeansFit:
+    """Attach top-2 centroid distances to a fit."""
+    if len(centroids) >= 2:
+        _, top2 = nearest_two(vectors, centroids)
+    else:
+        _, d1 = assign_nearest(vectors, centroids)
+        top2 = np.stack([d1, d1], axis=1)
+
+    return KMeansFit(
+        centroids=np.asarray(centroids),
+        labels=np.asarray(labels, dtype=np.int64),
+        top2_distances=top2
+    )
+
+
+class KMeansFitCache:
+    """In-memory LRU of k-means fits with an optional size-bounded disk tier."""
+
+    def __init__(
+        self,
+        cache_dir: Optional[Path] = None,
+        max_disk_bytes: Optional[int] = None,
+        max_memory_bytes: int = DEFAULT_MAX_MEMORY_BYTES
+    ):
+        self.cache_dir = Path(cache_dir) if cache_dir is not None else None
+        self.max_disk_bytes = max_disk_bytes
+        self.max_memory_bytes = max_memory_bytes
+        self._memory: "OrderedDict[str, KMeansFit]" = OrderedDict()
+        self._fingerprints: Dict[int, Tuple[weakref.ref, str]] = {}
+        self.stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'disk_evictions': 0}
+
+        if self.cache_dir is not None:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def _fingerprint(self, vectors: np.ndarray) -> str:
+        # Hashing a large matrix is not free; remember it per live array object
+        entry = self._fingerprints.get(id(vectors))
+        if entry is not None and entry[0]() is vectors:
+            return entry[1]
+        fingerprint = dataset_fingerprint(vectors)
+        self._fingerprints[id(vectors)] = (weakref.ref(vectors), fingerprint)
+        return fingerprint
+
+    def make_key(self, vectors: np.ndarray, k: int, seed: int, method: str) -> str:
+        """Cache key for a fit: (dataset hash, k, seed, method)."""
+        return f"{self._fingerprint(vectors)}_k{int(k)}_s{int(seed)}_{method}"
+
+    def get_or_fit(
+        self,
+        vectors: np.ndarray,
+        k: int,
+        seed: int,
+        fit_fn: FitFunction,
+        method: str = 'sklearn'
+    ) -> Tuple[KMeansFit, bool]:
+        """
+        Return a cached fit, computing and storing it on a miss.
+
+        Args:
+            vectors: (n, d) array the fit is computed on
+            k: number of clusters
+            seed: random seed
+            fit_fn: function (vectors, k, seed) -> (centroids, labels)
+            method: fit algorithm name, part of the key
+
+        Returns:
+            (fit, hit) where hit is True when no fitting was needed
+        """
+        key = self.make_key(vectors, k, seed, method)
+
+        fit = self._memory.get(key)
+        if fit is not None:
+            self._memory.move_to_end(key)
+            self.stats['memory_hits'] += 1
+            return fit, True
+
+        fit = self._load_from_disk(key)
+        if fit is not None:
+            self.stats['disk_hits'] += 1
+            self._store_in_memory(key, fit)
+            return fit, True
+
+        self.stats['misses'] += 1
+        centroids, labels = fit_fn(vectors, k, seed)
+        return self.put(vectors, k, seed, centroids, labels, method), False
+
+    def put(
+        self,
+        vectors: np.ndarray,
+        k: int,
+        seed: int,
+        centroids: np.ndarray,
+        labels: np.ndarray,
+        method: str = 'sklearn'
+    ) -> KMeansFit:
+        """Store an externally computed fit (e.g. a warm-started one) under its key."""
+        key = self.make_key(vectors, k, seed, method)
+        fit = build_fit(vectors, centroids, labels)
+        self._store_in_memory(key, fit)
+        self._save_to_disk(key, fit)
+        return fit
+
+    def _store_in_memory(self, key: str, fit: KMeansFit):
+        self._memory[key] = fit
+        self._memory.move_to_end(key)
+        total = sum(entry.nbytes for entry in self._memory.values())
+        # Always keep the newest entry, even if it alone exceeds the budget
+        while total > self.max_memory_bytes and len(self._memory) > 1:
+            _, evicted = self._memory.popitem(last=False)
+            total -= evicted.nbytes
+
+    def _disk_path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.npz"
+
+    def _load_from_disk(self, key: str) -> Optional[KMeansFit]:
+        if self.cache_dir is None:
+            return None
+        path = self._disk_path(key)
+        if not path.exists():
+            return None
+
+        with np.load(path) as data:
+            fit = KMeansFit(
+                centroids=data['centroids'],
+                labels=data['labels'],
+                top2_distances=data['top2_distances']
+            )
+        # Touch for LRU ordering
+        os.utime(path)
+        return fit
+
+    def _save_to_disk(self, key: str, fit: KMeansFit):
+        if self.cache_dir is None:
+            return
+        path = self._disk_path(key)
+        tmp_path = path.with_suffix('.tmp.npz')
+        np.savez(
+            tmp_path,
+            centroids=fit.centroids,
+            labels=fit.labels,
+            top2_distances=fit.top2_distances
+        )
+        os.replace(tmp_path, path)
+        self._evict_disk()
+
+    def _evict_disk(self):
+        if self.cache_dir is None or self.max_disk_bytes is None:
+            return
+        entries = sorted(self.cache_dir.glob('*.npz'), key=lambda p: p.stat().st_mtime)
+        total = sum(p.stat().st_size for p in entries)
+        # Oldest first; the newest entry is always kept
+        for path in entries[:-1]:
+            if total <= self.max_disk_bytes:
+                break
+            total -= path.stat().st_size
+            path.unlink()
+            self.stats['disk_evictions'] += 1
@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+"""
+Warm-Started K-Means Ladder
+
+Fits a whole ladder of k values in one sweep instead of cold-starting every k.
+The smallest k is fitted from scratch. Each following rung k + delta starts
+from the previous solution: the highest-inertia cluster is bisected delta
+times (a local 2-means on its members only), then Lloyd iterations (sklearn
+KMeans with an explicit init) refine the grown solution until the centroid
+shift falls below tol. Splitting reuses the previous rung's labels, so no
+distance pass over the whole corpus is needed to choose and split clusters.
+
+Usage:
+    from kmeans_ladder import kmeans_ladder, compare_ladder_to_cold
+    fits, report = kmeans_ladder(vectors, [8, 16, 32, 64], seed=42)
+    centroids, labels = fits[32]
+"""
+
+import time
+import numpy as np
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sklearn.cluster import KMeans
+
+from kmeans_cache import FitFunction, KMeansFitCache
+from streaming_kmeans import full_kmeans
+
+
+# Rows per block when accumulating per-cluster inertia
+INERTIA_BLOCK_ROWS = 65536
+
+
+def cluster_inertia(vectors: np.ndarray, centroids: np.ndarray, labels: np.ndarray) -> np.ndarray:
+    """
+    Sum of squared distances to the assigned centroid, per cluster.
+
+    Args:
+        vectors: (n, d) array of vectors
+        centroids: (k, d) array of centroids
+        labels: (n,) cluster index per vector
+
+    Returns:
+        (k,) float64 array of per-cluster inertia
+    """
+    inertia = np.zeros(len(centroids), dtype=np.float64)
+    for start in range(0, len(vectors), INERTIA_BLOCK_ROWS):
+        block_labels = labels[start:start + INERTIA_BLOCK_ROWS]
+        residuals = np.asarray(vectors[start:start + INERTIA_BLOCK_ROWS]) - centroids[block_labels]
+        inertia += np.bincount(
+            block_labels,
+            weights=np.einsum('ij,ij->i', residuals, residuals),
+            minlength=len(centroids)
+        )
+    return inertia
+
+
+def _principal_direction(points: np.ndarray, rng: np.random.Generator, iterations: int = 10) -> np.ndarray:
+    """Leading principal direction of centered points by power iteration."""
+    direction = rng.standard_normal(points.shape[1])
+    for _ in range(iterations):
+        direction = points.T @ (points @ direction)
+        norm = np.linalg.norm(direction)
+        if norm == 0:
+            # Degenerate cluster (all points equal): any direction will do
+            direction = rng.standard_normal(points.shape[1])
+            break
+        direction /= norm
+    return direction / np.linalg.norm(direction)
+
+
+def _bisect(members: np.ndarray, rng: np.random.Generator, iterations: int = 10) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    2-means on one cluster's members, initialized along its principal axis.
+
+    Returns:
+        children: (2, d) child centroids
+        side: (len(members),) bool, True for members of the second child
+    """
+    center = members.mean(axis=0)
+    centered = members - center
+    direction = _principal_direction(centered, rng)
+    spread = np.sqrt(np.mean((centered @ direction) ** 2))
+    if spread == 0:
+        # All members coincide; nudge the second child so it can attract points later
+        offset = rng.standard_normal(members.shape[1]) * 1e-6
+        return np.stack([center, center + offset]), np.zeros(len(members), dtype=bool)
+
+    children = np.stack([center + spread * direction, center - spread * direction])
+    side = np.zeros(len(members), dtype=bool)
+    for _ in range(iterations):
+        # Nearer child by the sign of the projection onto the separating direction
+        midpoint = children.mean(axis=0)
+        new_side = (members - midpoint) @ (children[1] - children[0]) > 0
+        if np.all(new_side) or not np.any(new_side):
+            break
+        children = np.stack([members[~new_side].mean(axis=0), members[new_side].mean(axis=0)])
+        if np.array_equal(new_side, side):
+            break
+        side = new_side
+    return children, side
+
+
+def split_clusters(
+    vectors: np.ndarray,
+    centroids: np.ndarray,
+    labels: np.ndarray,
+    num_splits: int,
+    random_state: int = 42
+) -> np.ndarray:
+    """
+    Grow a k-cluster solution by num_splits bisections of the highest-inertia cluster.
+
+    Clusters are split one at a time: the current highest-inertia cluster
+    is bisected with a local 2-means on its members (principal-axis init),
+    and both children's inertia is recomputed before the next split. Only
+    the members of the split cluster are touched, so the cost per split is
+    proportional to its size.
+
+    Args:
+        vectors: (n, d) array of vectors
+        centroids: (k, d) array of centroids
+        labels: (n,) cluster index per vector
+        num_splits: number of clusters to add
+        random_state: random seed for the power iteration
+
+    Returns:
+        (k + num_splits, d) initial centroids for the next rung
+    """
+    rng = np.random.default_rng(random_state)
+    k = len(centroids)
+    inertia = list(cluster_inertia(vectors, centroids, labels))
+
+    # Member indices per cluster, grouped once
+    order = np.argsort(labels, kind='stable')
+    bounds = np.concatenate([[0], np.cumsum(np.bincount(labels, minlength=k))])
+    members = [order[bounds[c]:bounds[c + 1]] for c in range(k)]
+    new_centroids = [np.asarray(c, dtype=np.float64) for c in centroids]
+
+    for _ in range(num_splits):
+        cluster = int(np.argmax(inertia))
+        # Indices stay ascending (stable grouping), so the gather reads forward
+        indices = members[cluster]
+        if len(indices) < 2:
+            # Nothing left to split: duplicate with a tiny offset
+            new_centroids.append(new_centroids[cluster] + rng.standard_normal(len(new_centroids[cluster])) * 1e-6)
+            members.append(indices[:0])
+            inertia.append(0.0)
+            continue
+
+        points = np.asarray(vectors[indices], dtype=np.float64)
+        children, side = _bisect(points, rng)
+        for child, (child_centroid, child_rows) in enumerate(((children[0], ~side), (children[1], side))):
+            residuals = points[child_rows] - child_centroid
+            child_inertia = float(np.einsum('ij,ij->', residuals, residuals))
+            if child == 0:
+                new_centroids[cluster] = child_centroid
+                members[cluster] = indices[child_rows]
+                inertia[cluster] = child_inertia
+            else:
+                new_centroids.append(child_centroid)
+                members.append(indices[child_rows])
+                inertia.append(child_inertia)
+
+    return np.vstack(new_centroids).astype(centroids.dtype, copy=False)
+
+
+def refine_kmeans(
+    vectors: np.ndarray,
+    init_centroids: np.ndarray,
+    random_state: int = 42,
+    max_iter: int = 100,
+    tol: float = 1e-4
+) -> Tuple[np.ndarray, np.ndarray, int]:
+    """
+    Lloyd iterations from explicit initial centroids, stopping on convergence.
+
+    Returns:
+        centroids: (k, d) refined centroids
+        labels: (n,) cluster index per vector
+        iterations: Lloyd iterations run
+    """
+    kmeans = KMeans(
+        n_clusters=len(init_centroids),
+        init=init_centroids,
+        n_init=1,
+        max_iter=max_iter,
+        tol=tol,
+        random_state=random_state
+    )
+    kmeans.fit(vectors)
+    return kmeans.cluster_centers_, kmeans.labels_, int(kmeans.n_iter_)
+
+
+def ladder_k_values(k_values: Iterable[int], num_vectors: int) -> List[int]:
+    """Sorted distinct k values that can be fitted on num_vectors points."""
+    return sorted(set(int(k) for k in k_values if 1 <= int(k) < num_vectors))
+
+
+def kmeans_ladder(
+    vectors: np.ndarray,
+    k_values: Iterable[int],
+    random_state: int = 42,
+    fit_fn: Optional[FitFunction] = None,
+    max_iter: int = 100,
+    tol: float = 1e-4
+) -> Tuple[Dict[int, Tuple[np.ndarray, np.ndarray]], List[Dict]]:
+    """
+    Fit every k in k_values, warm-starting each rung from the one below.
+
+    Args:
+        vectors: (n, d) array of vectors
+        k_values: cluster counts to fit (deduplicated and sorted; k >= n is skipped)
+        random_state: random seed
+        fit_fn: cold-start fit for the smallest k, (vectors, k, seed) -> (centroids, labels)
+                (default: full KMeans with n_init=10)
+        max_iter: maximum Lloyd iterations per rung
+        tol: convergence tolerance per rung
+
+    Returns:
+        fits: k -> (centroids, labels)
+        report: one dict per rung with k, warm_started, iterations, inertia and time_seconds
+    """
+    if fit_fn is None:
+        fit_fn = full_kmeans
+
+    fits = {}
+    report = []
+    previous_k = None
+    for k in ladder_k_values(k_values, len(vectors)):
+        start_time = time.time()
+        if previous_k is None:
+            centroids, labels = fit_fn(vectors, k, random_state)
+            iterations = None
+        else:
+            previous_centroids, previous_labels = fits[previous_k]
+            init = split_clusters(vectors, previous_centroids, previous_labels, k - previous_k, random_state)
+            centroids, labels, iterations = refine_kmeans(vectors, init, random_state, max_iter, tol)
+        elapsed = time.time() - start_time
+
+        labels = np.asarray(labels, dtype=np.int64)
+        fits[k] = (centroids, labels)
+        report.append({
+            'k': k,
+            'warm_started': previous_k is not None,
+            'iterations': iterations,
+            'inertia': float(np.sum(cluster_inertia(vectors, centroids, labels))),
+            'time_seconds': float(elapsed)
+        })
+        previous_k = k
+
+    return fits, report
+
+
+def compare_ladder_to_cold(
+    vectors: np.ndarray,
+    report: List[Dict],
+    random_state: int = 42,
+    fit_fn: Optional[FitFunction] = None
+) -> Dict:
+    """
+    Refit every ladder rung from scratch and compare inertia and time.
+
+    Args:
+        vectors: (n, d) array of vectors
+        report: rung report returned by kmeans_ladder
+        random_state: random seed
+        fit_fn: cold-start fit function (default: full KMeans with n_init=10)
+
+    Returns:
+        dict with per-k cold inertia, inertia ratio (ladder / cold) and times,
+        plus ladder and cold totals
+    """
+    if fit_fn is None:
+        fit_fn = full_kmeans
+
+    rungs = []
+    for rung in report:
+        start_time = time.time()
+        centroids, labels = fit_fn(vectors, rung['k'], random_state)
+        cold_time = time.time() - start_time
+        cold_inertia = float(np.sum(cluster_inertia(vectors, centroids, np.asarray(labels, dtype=np.int64))))
+        rungs.append(dict(rung, **{
+            'cold_inertia': cold_inertia,
+            'inertia_ratio_vs_cold': rung['inertia'] / cold_inertia if cold_inertia > 0 else 1.0,
+            'cold_time_seconds': float(cold_time)
+        }))
+
+    ladder_time = sum(r['time_seconds'] for r in rungs)
+    cold_time = sum(r['cold_time_seconds'] for r in rungs)
+    return {
+        'rungs': rungs,
+        'ladder_time_seconds': float(ladder_time),
+        'cold_time_seconds': float(cold_time),
+        'max_inertia_ratio_vs_cold': float(max((r['inertia_ratio_vs_cold'] for r in rungs), default=1.0))
+    }
+
+
+def seed_fit_cache(
+    fit_cache: KMeansFitCache,
+    vectors: np.ndarray,
+    fits: Dict[int, Tuple[np.ndarray, np.ndarray]],
+    random_state: int,
+    method: str
+):
+    """Store ladder fits in a fit cache so compression paths pick them up by key."""
+    for k, (centroids, labels) in fits.items():
+        fit_cache.put(vectors, k, random_state, centroids, labels, method)
@@ -0,0 +1,477 @@
+#!/usr/bin/env python3
+"""
+Lattice Quantizers
+
+Lattice snapping and lattice-point deduplication for the compression scripts.
+
+Snapped centroids lie on an integer lattice: the cubic grid point
+round(v / step) * step is identified by its int64 coordinates round(v / step).
+Deduplication hashes those integer rows instead of sorting whole float rows,
+and returns an inverse mapping so callers can turn cluster labels straight
+into codebook indices.
+
+Lattices are pluggable (see LATTICE_QUANTIZERS). Each one is applied to
+consecutive blocks of a vector and scaled so its point density matches
+step * Z^d, so every lattice costs the same bits per dimension at a given
+step and differs only in distortion:
+
+- grid:    the cubic lattice Z^d (np.round(v / step) * step)
+- d4, dn:  the checkerboard lattice D_n (integer points with even coordinate
+           sum) on 4-D blocks or on the whole vector
+- a3_star, an_star: the dual root lattice A_n* (A_3* is body-centred cubic)
+                    on 3-D blocks or on the whole vector
+- e8:      E8 = D8 ∪ (D8 + ½) on 8-D blocks (the last block is zero-padded)
+
+Every lattice encodes to int64 keys that are linear in the lattice point,
+so 2 * keys at step equal the keys of the same points at step / 2.
+
+Usage:
+    from lattice_quantizers import lattice_keys, lattice_points, unique_rows
+    keys = lattice_keys(centroids, step, lattice='e8')
+    first, inverse = unique_rows(keys)
+    codebook = lattice_points(keys[first], step, lattice='e8')
+    codes = inverse[labels]
+"""
+
+import numpy as np
+from typing import Dict, Optional, Tuple
+
+
+# Fixed odd 64-bit multipliers make row hashes reproducible across runs
+_HASH_SEED = 0x5EED1A77
+
+# Coordinates decoded per batch; full-size temporaries are memory bound
+LATTICE_BATCH_VALUES = 131072
+
+E8_BLOCK = 8
+
+# A_n* blocks of up to this many (n + 1) coordinates are decoded without sorting
+A_STAR_PAIRWISE_MAX = 16
+
+
+def lattice_coordinates(vectors: np.ndarray, step: float) -> np.ndarray:
+    """Integer coordinates of the cubic grid points nearest to vectors."""
+    return np.round(vectors / step).astype(np.int64)
+
+
+def _nearest_dn(columns: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Nearest point of D_n (integer vectors with even coordinate sum) per column.
+
+    Rounds every coordinate; points whose rounded sum is odd re-round the
+    coordinate with the largest rounding error the other way, which adds
+    1 - 2|r| to that point's squared error. Works on (n, count) columns so
+    every step is an elementwise pass over n rows rather than a reduction
+    over a short axis.
+
+    Returns:
+        points: (n, count) nearest D_n points
+        sq_error: (count,) squared distance to them
+    """
+    points = np.rint(columns)
+    residual = columns - points
+    sq_error = np.add.reduce(residual * residual, axis=0)
+    coordinate_sum = np.add.reduce(points, axis=0)
+    odd = np.floor(coordinate_sum * 0.5) * 2 != coordinate_sum
+    magnitude = np.abs(residual)
+    worst = np.maximum.reduce(magnitude, axis=0)
+    sq_error += odd * (1 - 2 * worst)
+
+    flip = magnitude == worst
+    flip &= odd
+    tied = np.add.reduce(flip, axis=0, dtype=np.int32) > 1
+    if np.any(tied):
+        # Several coordinates share the largest error: flip only the first
+        first = np.argmax(flip[:, tied], axis=0)
+        flip[:, tied] = np.arange(len(columns))[:, None] == first
+    points += np.copysign(flip.astype(points.dtype), residual)
+    return points, sq_error
+
+
+def e8_nearest(blocks: np.ndarray) -> np.ndarray:
+    """
+    Nearest E8 point to each 8-D row (Conway–Sloane decoder).
+
+    The nearest points of D8 and of the coset D8 + ½ are both found; the
+    closer one is the nearest E8 point.
+
+    Args:
+        blocks: (n, 8) array
+
+    Returns:
+        (n, 8) int64 array of doubled E8 coordinates (2 * point)
+    """
+    blocks = np.asarray(blocks)
+    columns = np.ascontiguousarray(blocks.T, dtype=np.result_type(blocks, np.float32))
+    return _e8_nearest_columns(columns).T
+
+
+def _e8_nearest_columns(columns: np.ndarray) -> np.ndarray:
+    """Doubled coordinates of the nearest E8 point per (8, count) column."""
+    integer_points, integer_error = _nearest_dn(columns)
+    half_points, half_error = _nearest_dn(columns - 0.5)
+    # Doubled coordinates: 2p for D8 points, 2(p + ½) = 2p + 1 for the coset
+    use_half = (half_error < integer_error).astype(columns.dtype)
+    doubled = 2 * integer_points + use_half * (2 * (half_points - integer_points) + 1)
+    return doubled.astype(np.int64)
+
+
+def _an_star_offsets_sorted(residual: np.ndarray) -> np.ndarray:
+    """
+    0/1 offsets moving rint(y) to the nearest A_n* point, by sorting residuals.
+
+    Adding 1 to the k coordinates with the largest residuals r leaves a
+    projected squared error of ||r||^2 + sum(1 - 2r over those k) -
+    (sum(r) - k)^2 / (n + 1); the best k over 0 .. n wins.
+
+    Args:
+        residual: (n + 1, count) y - rint(y) per column
+
+    Returns:
+        (n + 1, count) boolean offsets
+    """
+    size, count = residual.shape
+    order = np.argsort(-residual, axis=0, kind='stable')
+    ranked = np.take_along_axis(residual, order, axis=0)
+    sq_norms = np.concatenate([np.zeros((1, count)), np.cumsum(1 - 2 * ranked[:-1], axis=0)])
+    sums = np.add.reduce(residual, axis=0) - np.arange(size)[:, None]
+    best = np.argmin(sq_norms - sums * sums / size, axis=0)
+
+    ranks = np.empty_like(order)
+    np.put_along_axis(ranks, order, np.arange(size)[:, None], axis=0)
+    return ranks < best
+
+
+def _an_star_offsets_pairwise(residual: np.ndarray) -> np.ndarray:
+    """
+    Same offsets as _an_star_offsets_sorted without a sort, for short columns.
+
+    Each coordinate's residual is tried as the threshold for "the k largest";
+    tied residuals enter together, which is enough because the error is
+    concave in k across a run of equal residuals. Costs O(n^2) elementwise
+    passes, which beats sorting along a short axis for small n.
+    """
+    size = len(residual)
+    gain = 1 - 2 * residual
+    total = np.add.reduce(residual, axis=0)
+    best_cost = -(total * total) / size
+    threshold = np.full(residual.shape[1], np.inf, dtype=residual.dtype)
+    for j in range(size):
+        above = residual >= residual[j]
+        sums = total - np.add.reduce(above, axis=0, dtype=np.int32)
+        cost = np.add.reduce(gain * above, axis=0) - sums * sums / size
+        better = cost < best_cost
+        best_cost = np.where(better, cost, best_cost)
+        threshold = np.where(better, residual[j], threshold)
+    return residual >= threshold
+
+
+class LatticeQuantizer:
+    """
+    Nearest-point quantizer for a lattice applied blockwise to vectors.
+
+    A vector of dimension d is split into consecutive blocks of `block`
+    coordinates (the whole vector if block is None); a shorter trailing
+    block uses the same lattice family in its own dimension. Each block is
+    scaled by step * density_factor(n) so the lattice has the point
+    density of step * Z^n.
+
+    Subclasses implement nearest() and decode() on (n, count) columns of
+    unit-density coordinates.
+    """
+
+    name = ''
+
+    def __init__(self, block: Optional[int] = None):
+        self.block = block
+
+    def density_factor(self, n: int) -> float:
+        """Scale giving the n-dimensional lattice unit point density."""
+        raise NotImplementedError
+
+    def nearest(self, columns: np.ndarray) -> np.ndarray:
+        """(n, count) int64 keys of the nearest lattice point per column."""
+        raise NotImplementedError
+
+    def decode(self, keys: np.ndarray) -> np.ndarray:
+        """(n, count) float64 lattice points for (n, count) keys."""
+        raise NotImplementedError
+
+    def _block_slices(self, dim: int):
+        """(start, stop, block dimension) of the full blocks, then the trailing block."""
+        block = dim if self.block is None else min(self.block, dim)
+        full = dim - dim % block
+        if full:
+            yield 0, full, block
+        if full < dim:
+            yield full, dim, dim - full
+
+    def _map_blocks(self, array: np.ndarray, fn, dtype: np.dtype) -> np.ndarray:
+        """Apply fn to (n, count) columns of every block, in cache-sized batches."""
+        count, dim = array.shape
+        out = np.empty((count, dim), dtype=dtype)
+        for start, stop, n in self._block_slices(dim):
+            blocks = np.ascontiguousarray(array[:, start:stop]).reshape(-1, n)
+            mapped = np.empty(blocks.shape, dtype=dtype)
+            batch = max(1, LATTICE_BATCH_VALUES // n)
+            for row in range(0, len(blocks), batch):
+                mapped[row:row + batch] = fn(np.ascontiguousarray(blocks[row:row + batch].T)).T
+            out[:, start:stop] = mapped.reshape(count, stop - start)
+        return out
+
+    def keys(self, vectors: np.ndarray, step: float) -> np.ndarray:
+        """
+        Integer keys of the nearest points of the scaled lattice.
+
+        Args:
+            vectors: (count, d) array
+            step: lattice scale (point density of step * Z^d)
+
+        Returns:
+            (count, d) int64 keys
+        """
+        vectors = np.asarray(vectors)
+        compute_dtype = np.result_type(vectors, np.float32)
+
+        def nearest(columns):
+            return self.nearest((columns / (step * self.density_factor(len(columns)))).astype(compute_dtype))
+
+        return self._map_blocks(vectors, nearest, np.int64)
+
+    def points(self, keys: np.ndarray, step: float) -> np.ndarray:
+        """(count, d) float64 lattice points for keys returned by keys()."""
+        def decode(columns):
+            return self.decode(columns) * (step * self.density_factor(len(columns)))
+
+        return self._map_blocks(np.asarray(keys), decode, np.float64)
+
+
+class CubicLattice(LatticeQuantizer):
+    """Z^d: round every coordinate. Keys are the integer coordinates."""
+
+    name = 'grid'
+
+    def density_factor(self, n: int) -> float:
+        return 1.0
+
+    def nearest(self, columns: np.ndarray) -> np.ndarray:
+        return np.rint(columns).astype(np.int64)
+
+    def decode(self, keys: np.ndarray) -> np.ndarray:
+        return keys.astype(np.float64)
+
+    def keys(self, vectors: np.ndarray, step: float) -> np.ndarray:
+        # Coordinates are independent, so no blocking is needed
+        return lattice_coordinates(vectors, step)
+
+    def points(self, keys: np.ndarray, step: float) -> np.ndarray:
+        return keys * float(step)
+
+
+class CheckerboardLattice(LatticeQuantizer):
+    """
+    D_n: integer vectors with even coordinate sum (O(n) per point).
+
+    Keys are the integer coordinates. det(D_n) = 2, so blocks are scaled
+    by 2^(-1/n) to match the density of Z^n.
+    """
+
+    def __init__(self, block: Optional[int] = None):
+        super().__init__(block)
+        self.name = 'dn' if block is None else f'd{block}'
+
+    def density_factor(self, n: int) -> float:
+        return 2.0 ** (-1.0 / n)
+
+    def nearest(self, columns: np.ndarray) -> np.ndarray:
+        return _nearest_dn(columns)[0].astype(np.int64)
+
+    def decode(self, keys: np.ndarray) -> np.ndarray:
+        return keys.astype(np.float64)
+
+
+class DualRootLattice(LatticeQuantizer):
+    """
+    A_n*: the projection of Z^(n+1) onto the hyperplane of zero-sum vectors.
+
+    An n-D block is carried into that hyperplane by the Householder
+    reflection swapping e_(n+1) and the unit all-ones vector. The nearest
+    point is rint(y) plus ones on the k coordinates with the largest
+    rounding residuals, for the best k (McKilliam et al.). Short blocks
+    scan the residuals pairwise; long ones sort them, O(n log n). Keys are the
+    integer point z shifted so z_(n+1) = 0, with z_(n+1) dropped.
+    det(A_n*) = 1 / sqrt(n + 1).
+    """
+
+    def __init__(self, block: Optional[int] = None):
+        super().__init__(block)
+        self.name = 'an_star' if block is None else f'a{block}_star'
+
+    def density_factor(self, n: int) -> float:
+        return (n + 1.0) ** (1.0 / (2 * n))
+
+    def nearest(self, columns: np.ndarray) -> np.ndarray:
+        n, count = columns.shape
+        u = 1.0 / np.sqrt(n + 1)
+        total = np.add.reduce(columns, axis=0)
+        y = np.empty((n + 1, count), dtype=columns.dtype)
+        y[:n] = columns - (u * u / (1 - u)) * total
+        y[n] = u * total
+
+        z = np.rint(y)
+        residual = y - z
+        if n + 1 <= A_STAR_PAIRWISE_MAX:
+            z += _an_star_offsets_pairwise(residual)
+        else:
+            z += _an_star_offsets_sorted(residual)
+        return (z[:n] - z[n]).astype(np.int64)
+
+    def decode(self, keys: np.ndarray) -> np.ndarray:
+        n = len(keys)
+        u = 1.0 / np.sqrt(n + 1)
+        keys = keys.astype(np.float64)
+        # y = z - mean(z) with z = (keys, 0); reflect back and keep the first n coordinates
+        mean = np.add.reduce(keys, axis=0) / (n + 1)
+        return keys - mean - (u / (1 - u)) * mean
+
+
+class E8Lattice(LatticeQuantizer):
+    """
+    E8 = D8 ∪ (D8 + ½) on 8-D blocks; a shorter last block is zero-padded.
+
+    E8 has the point density of Z^8, and its keys are the doubled, hence
+    integer, coordinates.
+    """
+
+    name = 'e8'
+
+    def __init__(self):
+        super().__init__(E8_BLOCK)
+
+    def density_factor(self, n: int) -> float:
+        return 1.0
+
+    def nearest(self, columns: np.ndarray) -> np.ndarray:
+        n = len(columns)
+        if n < E8_BLOCK:
+            padded = np.zeros((E8_BLOCK, columns.shape[1]), dtype=columns.dtype)
+            padded[:n] = columns
+            return _e8_nearest_columns(padded)[:n]
+        return _e8_nearest_columns(columns)
+
+    def decode(self, keys: np.ndarray) -> np.ndarray:
+        return keys * 0.5
+
+
+LATTICE_QUANTIZERS: Dict[str, LatticeQuantizer] = {
+    quantizer.name: quantizer
+    for quantizer in [
+        CubicLattice(),
+        CheckerboardLattice(4),
+        CheckerboardLattice(),
+        DualRootLattice(3),
+        DualRootLattice(),
+        E8Lattice(),
+    ]
+}
+
+LATTICES = list(LATTICE_QUANTIZERS)
+
+
+def get_lattice_quantizer(lattice: str) -> LatticeQuantizer:
+    """Look up a lattice quantizer by name."""
+    if lattice not in LATTICE_QUANTIZERS:
+        raise ValueError(f"Unknown lattice: {lattice} (expected one of {LATTICES})")
+    return LATTICE_QUANTIZERS[lattice]
+
+
+def lattice_keys(vectors: np.ndarray, step: float, lattice: str = 'grid') -> np.ndarray:
+    """Integer keys of the lattice points nearest to vectors."""
+    return get_lattice_quantizer(lattice).keys(vectors, step)
+
+
+def lattice_points(keys: np.ndarray, step: float, lattice: str = 'grid') -> np.ndarray:
+    """Lattice points for integer keys returned by lattice_keys."""
+    return get_lattice_quantizer(lattice).points(keys, step)
+
+
+def snap_to_lattice(vectors: np.ndarray, step: float, lattice: str = 'grid') -> np.ndarray:
+    """Snap vectors to the nearest point of the scaled lattice."""
+    return lattice_points(lattice_keys(vectors, step, lattice), step, lattice)
+
+
+
+
+def _hash_multipliers(dim: int) -> np.ndarray:
+    rng = np.random.default_rng(_HASH_SEED)
+    return rng.integers(0, np.iinfo(np.int64).max, size=dim, dtype=np.uint64) | np.uint64(1)
+
+
+def hash_rows(rows: np.ndarray) -> np.ndarray:
+    """
+    64-bit hash of each row of an integer array.
+
+    Args:
+        rows: (n, d) integer array
+
+    Returns:
+        (n,) uint64 array of row hashes
+    """
+    rows = np.ascontiguousarray(rows).astype(np.int64, copy=False).view(np.uint64)
+    multipliers = _hash_multipliers(rows.shape[1])
+    # Multiply-add wraps modulo 2^64; mix the high bits back down afterwards
+    hashes = (rows * multipliers).sum(axis=1, dtype=np.uint64)
+    hashes ^= hashes >> np.uint64(29)
+    hashes *= np.uint64(0xBF58476D1CE4E5B9)
+    hashes ^= hashes >> np.uint64(32)
+    return hashes
+
+
+def unique_rows(rows: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Deduplicate the rows of an integer array by hashing.
+
+    Unique rows are ordered by first occurrence. Hash collisions are
+    detected and resolved with an exact row comparison.
+
+    Args:
+        rows: (n, d) integer array (e.g. lattice coordinates)
+
+    Returns:
+        first: (u,) indices of the first occurrence of each unique row
+        inverse: (n,) index into first for every input row, so that
+                 rows[first[inverse]] == rows
+    """
+    n = len(rows)
+    if n == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+    hashes = hash_rows(rows)
+    _, first, inverse = np.unique(hashes, return_index=True, return_inverse=True)
+    inverse = inverse.reshape(-1)
+
+    if np.any(rows != rows[first[inverse]]):
+        # Hash collision: fall back to an exact lexicographic dedupe
+        _, first, inverse = np.unique(rows, axis=0, return_index=True, return_inverse=True)
+        inverse = inverse.reshape(-1)
+
+    # Reorder unique rows by first occurrence
+    order = np.argsort(first, kind='stable')
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+
+    return first[order].astype(np.int64), rank[inverse].astype(np.int64)
+
+
+def unique_float_rows(vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Deduplicate rows of a float array by exact bit pattern.
+
+    Args:
+        vectors: (n, d) float array
+
+    Returns:
+        first, inverse as in unique_rows
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float64) + 0.0  # fold -0.0 into 0.0
+    return unique_rows(vectors.view(np.int64))
@@ -0,0 +1,464 @@
+#!/usr/bin/env python3
+"""
+MS MARCO Incremental Append
+
+Appends new passages to the compressed stores of an earlier
+msmarco_run_compression.py run without refitting k-means.
+
+- Reads the run's persisted k-means centroids, codebooks and boundary threshold
+- Encodes only the passages past the end of the stores (passages_embeddings.npy
+  has grown), chunk by chunk over the memory-mapped embeddings
+- Appends codes, boundary flags and residual rows to the stores in place
+- Tracks drift against the original fit: reconstruction MSE of the appended
+  passages and boundary-fraction creep
+- Runs a full refit (msmarco_run_compression.py with the run's settings) only
+  when drift exceeds the configured bounds
+
+Usage:
+    python analysis/msmarco_append.py
+    python analysis/msmarco_append.py --input-dir data/msmarco_subset --results-dir results/msmarco
+    python analysis/msmarco_append.py --max-mse-increase 0.05 --max-boundary-creep 0.02 --no-refit
+"""
+
+import json
+import subprocess
+import sys
+import argparse
+import time
+import numpy as np
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+try:
+    from tqdm import tqdm
+except ImportError:
+    print("ERROR: tqdm not installed")
+    print("Install with: pip install tqdm")
+    sys.exit(1)
+
+sys.path.insert(0, str(Path(__file__).parent))
+from centroid_assignment import assign_nearest, boundary_assign
+from compressed_store import AMBIGUITY_SKETCH_FILENAME, append_to_store, open_compressed_store
+from dtype_policy import DtypePolicy
+from msmarco_run_compression import build_boundary_codebook, snap_and_dedupe
+from quantile_sketch import KLLSketch
+from scalar_quantization import pack_levels, quantize_levels
+
+
+APPEND_DRIFT_FILENAME = 'append_drift.json'
+
+
+def load_run_config(results_dir: Path) -> Dict:
+    """Load the run configuration of a lattice compression run (or one config directory of a sweep)."""
+    config_path = results_dir / 'run_config.json'
+    if not config_path.exists():
+        raise FileNotFoundError(f"Run configuration not found: {config_path}")
+    with open(config_path, 'r') as f:
+        run_config = json.load(f)
+    if run_config.get('mode', 'lattice') != 'lattice':
+        raise ValueError(f"Appending is only supported for lattice runs, not --mode {run_config['mode']}")
+    if 'append_reference' not in run_config:
+        raise ValueError(f"{config_path} has no append_reference; rerun msmarco_run_compression.py to create one")
+    return run_config
+
+
+def build_code_tables(centroids: np.ndarray, run_config: Dict) -> Dict[str, np.ndarray]:
+    """
+    Rebuild the codebooks and centroid -> code maps of both stores from the centroids.
+
+    Snapping and deduplication are deterministic, so this reproduces the
+    codebooks the run saved.
+    """
+    grid = run_config['grid']
+    lattice = run_config.get('lattice', 'grid')
+    baseline_codebook, baseline_centroid_codes = snap_and_dedupe(centroids, grid, lattice)
+    tables = {
+        'baseline_codebook': baseline_codebook,
+        'baseline_centroid_codes': baseline_centroid_codes
+    }
+    if run_config.get('boundary_encoding', 'finer-grid') == 'residual':
+        tables.update(
+            boundary_codebook=baseline_codebook,
+            bulk_codes=baseline_centroid_codes,
+            boundary_codes=baseline_centroid_codes
+        )
+    else:
+        boundary_codebook, bulk_codes, boundary_codes = build_boundary_codebook(
+            centroids, grid, run_config['boundary']['boundary_step'], lattice
+        )
+        tables.update(boundary_codebook=boundary_codebook, bulk_codes=bulk_codes, boundary_codes=boundary_codes)
+    return tables
+
+
+def check_codebook(codebook: np.ndarray, store, dtype_policy: DtypePolicy, name: str):
+    """Fail if a rebuilt codebook does not match the one stored on disk."""
+    if not np.array_equal(dtype_policy.to_storage(codebook), np.asarray(store.codebook)):
+        raise ValueError(f"Rebuilt {name} codebook does not match the stored one; the run cannot be appended to")
+
+
+def encode_new_passages(
+    embeddings: np.ndarray,
+    start: int,
+    centroids: np.ndarray,
+    tables: Dict[str, np.ndarray],
+    threshold: Optional[float],
+    reassign: bool,
+    baseline_store,
+    boundary_store,
+    chunk_size: int
+) -> Dict:
+    """
+    Encode passages [start, n) for both stores, chunk by chunk.
+
+    Returns:
+        dict with baseline_codes, boundary_codes, boundary_mask, residual_rows,
+        residual_codes (None without a residual table), ambiguity_scores (None
+        with a single centroid), and the float64 sum of squared baseline
+        reconstruction errors
+    """
+    n, dim = embeddings.shape
+    num_new = n - start
+    baseline_codes = np.empty(num_new, dtype=np.int64)
+    boundary_codes = np.empty(num_new, dtype=np.int64)
+    boundary_mask = np.zeros(num_new, dtype=bool)
+    ambiguity_scores = np.zeros(num_new, dtype=np.float64) if threshold is not None else None
+    residuals = boundary_store.residuals
+    residual_rows: List[np.ndarray] = []
+    residual_codes: List[np.ndarray] = []
+    stored_baseline = np.asarray(baseline_store.codebook, dtype=np.float32)
+    stored_boundary = np.asarray(boundary_store.codebook, dtype=np.float32)
+    sq_error_sum = 0.0
+
+    for chunk_start in tqdm(range(start, n, chunk_size), desc="Encoding new passages"):
+        chunk = np.asarray(embeddings[chunk_start:chunk_start + chunk_size])
+        rows = slice(chunk_start - start, chunk_start - start + len(chunk))
+        if threshold is None:
+            labels, _ = assign_nearest(chunk, centroids)
+            chunk_boundary = np.zeros(len(chunk), dtype=bool)
+            chunk_codes = tables['bulk_codes'][labels]
+        else:
+            labels, top2, chunk_boundary, chunk_codes = boundary_assign(
+                chunk, centroids, threshold, tables['bulk_codes'], tables['boundary_codes'],
+                tables['boundary_codebook'] if reassign else None
+            )
+            ambiguity_scores[rows] = top2[:, 1] - top2[:, 0]
+        if reassign:
+            chunk_baseline, _ = assign_nearest(chunk, tables['baseline_codebook'])
+        else:
+            chunk_baseline = tables['baseline_centroid_codes'][labels]
+
+        baseline_codes[rows] = chunk_baseline
+        boundary_codes[rows] = chunk_codes
+        boundary_mask[rows] = chunk_boundary
+
+        diff = chunk.astype(np.float64) - stored_baseline[chunk_baseline]
+        sq_error_sum += float(np.einsum('ij,ij->', diff, diff))
+
+        if residuals is not None and np.any(chunk_boundary):
+            local = np.flatnonzero(chunk_boundary)
+            residual = chunk[local].astype(np.float32) - stored_boundary[chunk_codes[local]]
+            levels = quantize_levels(residual, residuals.scale, residuals.offset, residuals.bits)
+            residual_rows.append(chunk_start + local)
+            residual_codes.append(pack_levels(levels, residuals.bits))
+
+    result = {
+        'baseline_codes': baseline_codes,
+        'boundary_codes': boundary_codes,
+        'boundary_mask': boundary_mask,
+        'residual_rows': None,
+        'residual_codes': None,
+        'ambiguity_scores': ambiguity_scores,
+        'sq_error_sum': sq_error_sum
+    }
+    if residuals is not None:
+        packed = np.asarray(residuals.codes).shape[1]
+        result['residual_rows'] = np.concatenate(residual_rows) if residual_rows else np.zeros(0, dtype=np.int64)
+        result['residual_codes'] = np.concatenate(residual_codes) if residual_codes else np.zeros((0, packed), dtype=np.uint8)
+    return result
+
+
+def new_drift_state(reference: Dict, bounds: Dict) -> Dict:
+    """Empty drift state for a fit's reference point."""
+    return {
+        'reference': reference,
+        'bounds': bounds,
+        'appended_passages': 0,
+        'appended_sq_error_sum': 0.0,
+        'appended_boundary_passages': 0,
+        'appends': []
+    }
+
+
+def load_drift_state(results_dir: Path, reference: Dict, bounds: Dict) -> Dict:
+    """Drift state of earlier appends, restarted whenever the reference fit changed."""
+    state_path = results_dir / APPEND_DRIFT_FILENAME
+    if state_path.exists():
+        with open(state_path, 'r') as f:
+            state = json.load(f)
+        if state.get('reference') == reference:
+            state['bounds'] = bounds
+            return state
+    return new_drift_state(reference, bounds)
+
+
+def update_drift(state: Dict, num_new: int, sq_error_sum: float, num_boundary: int, dim: int) -> List[str]:
+    """
+    Fold one append into the cumulative drift and check it against the bounds.
+
+    Drift is measured over every passage appended since the last fit:
+    reconstruction MSE relative to the fit's MSE, and the absolute change in
+    the fraction of boundary passages.
+
+    Returns:
+        reasons the drift exceeds its bounds (empty if it does not)
+    """
+    reference = state['reference']
+    bounds = state['bounds']
+    state['appended_passages'] += int(num_new)
+    state['appended_sq_error_sum'] += float(sq_error_sum)
+    state['appended_boundary_passages'] += int(num_boundary)
+
+    appended = max(1, state['appended_passages'])
+    mse = state['appended_sq_error_sum'] / (appended * dim)
+    mse_increase = mse / reference['reconstruction_mse'] - 1 if reference['reconstruction_mse'] > 0 else 0.0
+    boundary_fraction = state['appended_boundary_passages'] / appended
+    boundary_creep = boundary_fraction - reference['boundary_fraction']
+    state.update({
+        'reconstruction_mse': float(mse),
+        'reconstruction_mse_increase': float(mse_increase),
+        'boundary_fraction': float(boundary_fraction),
+        'boundary_fraction_creep': float(boundary_creep)
+    })
+
+    reasons = []
+    if mse_increase > bounds['max_mse_increase']:
+        reasons.append(f"reconstruction MSE up {mse_increase:.1%} (bound {bounds['max_mse_increase']:.1%})")
+    if abs(boundary_creep) > bounds['max_boundary_creep']:
+        reasons.append(f"boundary fraction moved {boundary_creep:+.3f} (bound ±{bounds['max_boundary_creep']:.3f})")
+    state['refit_needed'] = bool(reasons)
+    return reasons
+
+
+def refit_command(run_config: Dict, input_dir: Path, results_dir: Path) -> List[str]:
+    """msmarco_run_compression.py invocation reproducing the run's settings on the grown corpus."""
+    baseline = run_config['baseline']
+    boundary = run_config['boundary']
+    cmd = [
+        sys.executable, str(Path(__file__).parent / 'msmarco_run_compression.py'),
+        '--input-dir', str(input_dir),
+        '--output-dir', str(results_dir),
+        '--grid', str(run_config['grid']),
+        '--k', str(run_config['k']),
+        '--seed', str(run_config['seed']),
+        '--lattice', run_config.get('lattice', 'grid'),
+        '--kmeans-mode', run_config['kmeans_mode'],
+        '--dtype', run_config.get('dtype', 'float32'),
+        '--boundary-encoding', run_config.get('boundary_encoding', 'finer-grid'),
+        '--code-encoding', run_config.get('code_encoding', 'array')
+    ]
+    if 'code_block_size' in run_config:
+        cmd += ['--code-block-size', str(run_config['code_block_size'])]
+    # Absent from run configs written before they were recorded (argparse defaults apply)
+    for key in ('kmeans_batch_size', 'kmeans_epochs', 'kmeans_sample_size'):
+        if key in run_config:
+            cmd += ['--' + key.replace('_', '-'), str(run_config[key])]
+    if 'kmeans_branching' in run_config:
+        cmd += ['--kmeans-branching', str(run_config['kmeans_branching'])]
+    if run_config.get('kmeans_exact_assignment'):
+        cmd.append('--kmeans-exact-assignment')
+    if 'residual_bits' in boundary:
+        cmd += ['--residual-bits', str(boundary['residual_bits'])]
+    if baseline.get('assignment') == 'nearest-snapped':
+        cmd.append('--reassign-after-snap')
+    if run_config.get('out_of_core'):
+        cmd += ['--out-of-core', '--chunk-size', str(baseline.get('chunk_size', 65536))]
+        if 'threshold_estimator' in run_config:
+            cmd += ['--threshold-estimator', run_config['threshold_estimator']]
+    return cmd
+
+
+def save_drift_state(state: Dict, results_dir: Path):
+    """Write the drift state next to run_config.json."""
+    with open(results_dir / APPEND_DRIFT_FILENAME, 'w') as f:
+        json.dump(state, f, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Append new passages to existing MS MARCO compressed stores'
+    )
+    parser.add_argument(
+        '--input-dir',
+        default='data/msmarco_subset',
+        help='Input directory containing the grown passages_embeddings.npy'
+    )
+    parser.add_argument(
+        '--results-dir',
+        default='results/msmarco',
+        help='Output directory of the msmarco_run_compression.py run to append to'
+    )
+    parser.add_argument(
+        '--chunk-size',
+        type=int,
+        default=65536,
+        help='New passages encoded per chunk (default: 65536)'
+    )
+    parser.add_argument(
+        '--max-mse-increase',
+        type=float,
+        default=0.10,
+        help='Refit when the reconstruction MSE of appended passages exceeds the fit MSE '
+             'by more than this fraction (default: 0.10)'
+    )
+    parser.add_argument(
+        '--max-boundary-creep',
+        type=float,
+        default=0.05,
+        help='Refit when the boundary fraction of appended passages moves by more than this '
+             'from the fit (default: 0.05)'
+    )
+    parser.add_argument(
+        '--no-refit',
+        action='store_true',
+        help='Only report when drift exceeds the bounds instead of refitting'
+    )
+
+    args = parser.parse_args()
+
+    input_dir = Path(args.input_dir)
+    results_dir = Path(args.results_dir)
+    bounds = {'max_mse_increase': float(args.max_mse_increase), 'max_boundary_creep': float(args.max_boundary_creep)}
+
+    print("="*80)
+    print("MS MARCO INCREMENTAL APPEND")
+    print("="*80)
+    print(f"\nConfiguration:")
+    print(f"  - Input: {input_dir}")
+    print(f"  - Results: {results_dir}")
+    print(f"  - Refit bounds: MSE +{bounds['max_mse_increase']:.1%}, boundary fraction ±{bounds['max_boundary_creep']:.3f}")
+    print("="*80)
+
+    try:
+        run_config = load_run_config(results_dir)
+        reference = run_config['append_reference']
+        dtype_policy = DtypePolicy(run_config.get('dtype', 'float32'))
+
+        baseline_dir = results_dir / 'baseline'
+        boundary_dir = results_dir / 'boundary'
+        baseline_store = open_compressed_store(baseline_dir)
+        boundary_store = open_compressed_store(boundary_dir)
+        if len(baseline_store) != len(boundary_store):
+            raise ValueError(f"Stores disagree on the passage count: {len(baseline_store)} vs {len(boundary_store)}")
+
+        embeddings_path = input_dir / 'passages_embeddings.npy'
+        embeddings = np.load(embeddings_path, mmap_mode='r')
+        start = len(baseline_store)
+        print(f"\n✓ Stores hold {start:,} passages; {embeddings_path} has {len(embeddings):,}")
+        if len(embeddings) < start:
+            raise ValueError("The embeddings have fewer passages than the stores; was the corpus rebuilt?")
+        if len(embeddings) == start:
+            print("✓ No new passages to append")
+            return 0
+
+        centroids = np.load(results_dir / reference['centroids_file'])
+        tables = build_code_tables(centroids, run_config)
+        check_codebook(tables['baseline_codebook'], baseline_store, dtype_policy, 'baseline')
+        check_codebook(tables['boundary_codebook'], boundary_store, dtype_policy, 'boundary')
+        reassign = run_config['baseline'].get('assignment') == 'nearest-snapped'
+
+        start_time = time.time()
+        encoded = encode_new_passages(
+            embeddings, start, centroids, tables, reference['boundary_threshold'],
+            reassign, baseline_store, boundary_store, args.chunk_size
+        )
+        encode_time = time.time() - start_time
+        del baseline_store, boundary_store
+
+        baseline_header = append_to_store(baseline_dir, encoded['baseline_codes'])
+        boundary_header = append_to_store(
+            boundary_dir, encoded['boundary_codes'], encoded['boundary_mask'],
+            encoded['residual_rows'], encoded['residual_codes'], encoded['ambiguity_scores']
+        )
+        num_new = len(embeddings) - start
+        num_boundary = int(np.sum(encoded['boundary_mask']))
+        print(f"✓ Appended {num_new:,} passages in {encode_time:.3f}s "
+              f"({num_boundary:,} boundary, {boundary_header['bytes_per_vector']:.2f} bytes/vector in {boundary_dir})")
+
+        # The sketch now covers the whole corpus; its 10th percentile shows
+        # where a refit would put the threshold
+        sketch_threshold = None
+        if boundary_header.get('has_ambiguity_sketch'):
+            sketch_threshold = KLLSketch.load(boundary_dir / AMBIGUITY_SKETCH_FILENAME).quantile(0.10)
+            print(f"✓ Ambiguity sketch threshold: {sketch_threshold:.6f} "
+                  f"(fit: {reference['boundary_threshold']:.6f})")
+
+        state = load_drift_state(results_dir, reference, bounds)
+        batch_mse = encoded['sq_error_sum'] / (num_new * embeddings.shape[1])
+        reasons = update_drift(state, num_new, encoded['sq_error_sum'], num_boundary, embeddings.shape[1])
+        state['appends'].append({
+            'timestamp': datetime.now().isoformat(),
+            'start': int(start),
+            'num_passages': int(num_new),
+            'reconstruction_mse': float(batch_mse),
+            'boundary_fraction': float(num_boundary / num_new),
+            'encode_time_seconds': float(encode_time),
+            'sketch_boundary_threshold': sketch_threshold,
+            'store_num_vectors': int(baseline_header['num_vectors'])
+        })
+        run_config['num_passages'] = int(baseline_header['num_vectors'])
+        with open(results_dir / 'run_config.json', 'w') as f:
+            json.dump(run_config, f, indent=2)
+
+        print(f"\nDrift over {state['appended_passages']:,} appended passages:")
+        print(f"  - Reconstruction MSE: {state['reconstruction_mse']:.6f} vs {reference['reconstruction_mse']:.6f} "
+              f"at fit ({state['reconstruction_mse_increase']:+.1%})")
+        print(f"  - Boundary fraction: {state['boundary_fraction']:.4f} vs {reference['boundary_fraction']:.4f} "
+              f"at fit ({state['boundary_fraction_creep']:+.4f})")
+
+        if not reasons:
+            save_drift_state(state, results_dir)
+            print(f"✓ Drift within bounds; saved {results_dir / APPEND_DRIFT_FILENAME}")
+            return 0
+
+        print(f"\n⚠ Drift exceeds bounds: {'; '.join(reasons)}")
+        if args.no_refit:
+            save_drift_state(state, results_dir)
+            print(f"  - Refit skipped (--no-refit); saved {results_dir / APPEND_DRIFT_FILENAME}")
+            return 0
+
+        cmd = refit_command(run_config, input_dir, results_dir)
+        print(f"  - Refitting: {' '.join(cmd[1:])}")
+        refit_start = time.time()
+        result = subprocess.run(cmd, capture_output=True, text=True)
+        if result.returncode != 0:
+            save_drift_state(state, results_dir)
+            print(result.stdout + result.stderr)
+            raise RuntimeError("Refit failed; the appended stores are kept")
+
+        refitted = load_run_config(results_dir)
+        fresh = new_drift_state(refitted['append_reference'], bounds)
+        fresh['last_refit'] = {
+            'timestamp': datetime.now().isoformat(),
+            'reasons': reasons,
+            'appended_passages': state['appended_passages'],
+            'refit_time_seconds': float(time.time() - refit_start)
+        }
+        save_drift_state(fresh, results_dir)
+        print(f"✓ Refit complete in {fresh['last_refit']['refit_time_seconds']:.2f}s "
+              f"({refitted['num_passages']:,} passages); drift tracking restarted")
+        return 0
+
+    except Exception as e:
+        print("\n" + "="*80)
+        print("FAILURE: Could not append passages")
+        print("="*80)
+        print(f"\nError: {e}")
+        import traceback
+        traceback.print_exc()
+
+        return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -7,11 +7,31 @@ Evaluates retrieval quality using compressed embeddings.
 NO SIMULATION. REAL METRICS.
 - Computes Recall@10, Recall@100, MRR, NDCG@10
 - Uses real relevance judgments from MS MARCO
-- Saves metrics for baseline and boundary-aware modes
+- Saves metrics for baseline and boundary-aware modes (or product/scalar quantization)
+- Scores scalar-quantized stores directly against their packed codes
+- Optionally searches codebook stores in the codebook domain (--scorer codebook):
+  one GEMM against the unique codebook, then an inverted code -> passages list
+- Optionally searches an IVF index over the run's k-means centroids (--scorer ivf),
+  reporting metrics and latency per --nprobe value
+- Optionally scores PQ and codebook stores by asymmetric distance computation
+  (--scorer adc): per-query lookup tables summed over each passage's codes,
+  with throughput compared against exact float scoring
+- Optionally reranks the top --rerank-depth compressed candidates against the
+  memory-mapped original embeddings, reporting quality, latency and bytes touched per depth
+- Searches query batches with one GEMM per block (passages normalized once) and
+  records batched throughput and single-query latency percentiles in perf.json
 
 Usage:
     python analysis/msmarco_eval_retrieval.py
     python analysis/msmarco_eval_retrieval.py --mode baseline
+    python analysis/msmarco_eval_retrieval.py --mode pq
+    python analysis/msmarco_eval_retrieval.py --mode sq4
+    python analysis/msmarco_eval_retrieval.py --dtype float16 --report-dtype-drift
+    python analysis/msmarco_eval_retrieval.py --query-batch-size 512 --latency-queries 200
+    python analysis/msmarco_eval_retrieval.py --scorer codebook
+    python analysis/msmarco_eval_retrieval.py --scorer ivf --nprobe 1 4 16 64 --ivf-vectors original
+    python analysis/msmarco_eval_retrieval.py --mode pq --scorer adc
+    python analysis/msmarco_eval_retrieval.py --rerank-depth 100 200 500 --rerank-dtype float16
 """
 
 import json
@@ -19,7 +39,7 @@ import sys
 import argparse
 import numpy as np
 from pathlib import Path
-from typing import List, Dict, Set, Tuple
+from typing import List, Dict, Optional, Sequence, Set, Union
 import time
 
 try:
@@ -29,6 +49,19 @@ except ImportError:
     print("Install with: pip install tqdm")
     sys.exit(1)
 
+# Import the compressed store reader
+sys.path.insert(0, str(Path(__file__).parent))
+from batched_search import DEFAULT_QUERY_BLOCK, ExactSearcher
+from codebook_search import CodebookSearcher
+from compressed_store import (
+    CompressedStore, ProductQuantizedStore, ScalarQuantizedStore, is_compressed_store, open_compressed_store
+)
+from dtype_policy import DEFAULT_DTYPE, DTYPE_CHOICES, DtypePolicy, metric_drift
+from ivf_index import DEFAULT_NPROBE, IVFIndex
+from product_quantization import ADCScorer
+from rerank import RERANK_DTYPES, RerankSearcher, open_rerank_vectors
+from scalar_quantization import PackedScalarScorer
+
 
 def load_qrels(qrels_path: Path) -> Dict[str, Set[str]]:
     """
@@ -78,10 +111,146 @@ def load_passages_metadata(passages_path: Path) -> List[Dict]:
     return passages
 
 
+def load_compressed_passages(mode_dir: Path) -> np.ndarray:
+    """
+    Load compressed passage embeddings for one compression mode.
+    
+    Opens the memory-mapped codebook + codes store when present and decodes
+    it; falls back to a legacy materialized compressed_passages.npy.
+    
+    Returns:
+        (n_passages, embedding_dim) array of compressed passage embeddings
+    """
+    if is_compressed_store(mode_dir):
+        start_time = time.time()
+        store = open_compressed_store(mode_dir)
+        open_time_ms = (time.time() - start_time) * 1000
+        print(f"✓ Opened compressed store {mode_dir} ({store.header['format']}): {len(store)} passages, "
+              f"{store.header['num_codes']} codebook entries ({store.header['store_bytes']:,} bytes, {open_time_ms:.1f} ms)")
+        return store.decode()
+    
+    legacy_path = mode_dir / 'compressed_passages.npy'
+    if not legacy_path.exists():
+        raise FileNotFoundError(f"Compressed embeddings not found in {mode_dir}")
+    
+    print(f"Loading compressed embeddings from {legacy_path}...")
+    return np.load(legacy_path)
+
+
+def load_mode_run_config(mode_dir: Path) -> Optional[Dict]:
+    """
+    Run configuration of a pq / sq8 / sq4 compression run.
+    
+    Those runs write run_config.json next to their store; runs made before
+    that wrote it to the results directory, which is still read when its
+    mode matches the store directory.
+    
+    Returns:
+        run configuration dict, or None (e.g. for lattice stores)
+    """
+    for config_path in (mode_dir / 'run_config.json', mode_dir.parent / 'run_config.json'):
+        if config_path.exists():
+            with open(config_path, 'r') as f:
+                run_config = json.load(f)
+            if run_config.get('mode') == mode_dir.name:
+                return run_config
+    return None
+
+
+def open_packed_scorer(mode_dir: Path) -> Optional[PackedScalarScorer]:
+    """
+    Scorer over the packed codes of a scalar-quantized store.
+    
+    Returns:
+        PackedScalarScorer, or None if mode_dir does not hold a scalar-quantized store
+    """
+    if not is_compressed_store(mode_dir):
+        return None
+    store = open_compressed_store(mode_dir)
+    if not isinstance(store, ScalarQuantizedStore):
+        return None
+    print(f"✓ Opened compressed store {mode_dir} ({store.header['format']}): {len(store)} passages, "
+          f"{store.header['code_bytes_per_vector']} bytes/passage ({store.header['store_bytes']:,} bytes)")
+    return PackedScalarScorer(store.codes, store.scale, store.offset, store.bits, store.dim)
+
+
+def open_codebook_searcher(mode_dir: Path, dtype_policy: DtypePolicy) -> Optional[CodebookSearcher]:
+    """
+    Codebook-domain searcher over a codebook store.
+    
+    Returns:
+        CodebookSearcher, or None if mode_dir does not hold a codebook store
+    """
+    if not is_compressed_store(mode_dir):
+        return None
+    store = open_compressed_store(mode_dir)
+    if not isinstance(store, CompressedStore):
+        return None
+    searcher = CodebookSearcher.from_store(store, dtype_policy)
+    print(f"✓ Opened compressed store {mode_dir} ({store.header['format']}): {len(store)} passages, "
+          f"{searcher.num_codes} codebook entries, {len(searcher.exact_rows)} residual-corrected passages scored exactly")
+    return searcher
+
+
+def open_adc_scorer(mode_dir: Path, dtype_policy: DtypePolicy) -> Optional[ADCScorer]:
+    """
+    ADC scorer over the codes of a product-quantized or codebook store, with
+    the codebooks (hence lookup tables and scores) in the policy's compute dtype.
+    
+    Returns:
+        ADCScorer, or None if mode_dir holds neither (or a codebook store with
+        residual corrections, which its codes alone do not describe)
+    """
+    if not is_compressed_store(mode_dir):
+        return None
+    store = open_compressed_store(mode_dir)
+    if isinstance(store, ProductQuantizedStore):
+        scorer = ADCScorer(dtype_policy.to_compute(store.codebooks), store.codes, store.dim)
+    elif isinstance(store, CompressedStore) and store.residuals is None:
+        scorer = ADCScorer(dtype_policy.to_compute(store.codebook), store.codes, store.dim)
+    else:
+        return None
+    print(f"✓ Opened compressed store {mode_dir} ({store.header['format']}): {len(store)} passages, "
+          f"ADC over {scorer.m} x {scorer.codebooks.shape[1]} lookup tables in {scorer.codebooks.dtype}")
+    return scorer
+
+
+def load_ivf_centroids(results_dir: Path) -> np.ndarray:
+    """
+    Unsnapped k-means centroids persisted by a lattice compression run.
+    
+    Returns:
+        (k, embedding_dim) array of centroids
+    """
+    centroids_file = 'kmeans_centroids.npy'
+    config_path = results_dir / 'run_config.json'
+    if config_path.exists():
+        with open(config_path, 'r') as f:
+            centroids_file = json.load(f).get('append_reference', {}).get('centroids_file', centroids_file)
+    centroids_path = results_dir / centroids_file
+    if not centroids_path.exists():
+        raise FileNotFoundError(f"k-means centroids not found: {centroids_path} (IVF search needs a lattice compression run)")
+    return np.load(centroids_path)
+
+
+# --scorer choices: exact search over decoded passages, codebook-domain search,
+# IVF search over the k-means centroids, or ADC over the stored codes
+SCORERS = ['exact', 'codebook', 'ivf', 'adc']
+
+# --ivf-vectors choices: vectors stored in the IVF posting lists
+IVF_VECTORS = ['compressed', 'original']
+
+# Queries searched one at a time for the single-query latency percentiles
+DEFAULT_LATENCY_QUERIES = 100
+
+
 def search_top_k(query_embedding: np.ndarray, passage_embeddings: np.ndarray, k: int) -> np.ndarray:
     """
     Find top-k nearest passages to query using exact search.
     
+    Normalizes the passages on every call; build an ExactSearcher once to
+    search many queries.
+    
     Args:
         query_embedding: (embedding_dim,) array
         passage_embeddings: (n_passages, embedding_dim) array
@@ -90,18 +259,32 @@ def search_top_k(query_embedding: np.ndarray, passage_embeddings: np.ndarray, k:
     Returns:
         indices: (k,) array of passage indices, sorted by similarity (highest first)
     """
-    # Compute cosine similarity
-    # Normalize vectors
-    query_norm = query_embedding / (np.linalg.norm(query_embedding) + 1e-10)
-    passages_norm = passage_embeddings / (np.linalg.norm(passage_embeddings, axis=1, keepdims=True) + 1e-10)
-    
-    # Compute similarities
-    similarities = np.dot(passages_norm, query_norm)
-    
-    # Get top-k indices (argsort returns ascending, so we reverse)
-    top_k_indices = np.argsort(similarities)[::-1][:k]
+    indices, _ = ExactSearcher(passage_embeddings).search_batch(query_embedding[None, :], k)
+    return indices[0]
+
+
+def measure_query_latency(searcher, queries: np.ndarray, k: int) -> Dict:
+    """
+    Latency of searching queries one at a time (batch size 1).
     
-    return top_k_indices
+    Returns:
+        dict with the number of queries timed and mean / p50 / p95 / p99 latency in ms
+    """
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        searcher.search_batch(query[None, :], k)
+        latencies.append((time.perf_counter() - start) * 1000)
+    if not latencies:
+        return {'num_queries': 0}
+    latencies = np.array(latencies)
+    return {
+        'num_queries': int(len(latencies)),
+        'mean': float(latencies.mean()),
+        'p50': float(np.percentile(latencies, 50)),
+        'p95': float(np.percentile(latencies, 95)),
+        'p99': float(np.percentile(latencies, 99))
+    }
 
 
 def compute_recall_at_k(retrieved: List[str], relevant: Set[str], k: int) -> float:
@@ -195,52 +378,67 @@ def evaluate_retrieval(
     qrels: Dict[str, Set[str]],
     queries_metadata: List[Dict],
     passages_metadata: List[Dict],
-    top_k: int = 100
+    top_k: int = 100,
+    searcher: Optional[Union[ExactSearcher, PackedScalarScorer, CodebookSearcher]] = None,
+    query_batch_size: int = DEFAULT_QUERY_BLOCK,
+    latency_queries: int = DEFAULT_LATENCY_QUERIES
 ) -> Dict:
     """
     Evaluate retrieval metrics.
     
+    All queries with qrels are searched in batches of query_batch_size
+    first, then scored. The search is timed on its own (metric bookkeeping
+    excluded), and latency_queries of them are searched again one at a time
+    for single-query latency percentiles.
+    
     Args:
         query_embeddings: (n_queries, embedding_dim)
-        passage_embeddings: (n_passages, embedding_dim)
+        passage_embeddings: (n_passages, embedding_dim), or None with searcher
         qrels: query_id -> set of relevant passage_ids
         queries_metadata: list of query dicts with 'query_id'
         passages_metadata: list of passage dicts with 'passage_id'
         top_k: maximum k for retrieval
+        searcher: optional object with search_batch(queries, k) -> (indices, scores),
+                  replacing exact search over passage_embeddings
+        query_batch_size: queries searched per batch
+        latency_queries: queries timed one at a time (0 disables)
     
     Returns:
         metrics dict
     """
     print(f"\nEvaluating retrieval (top-{top_k})...")
     
+    start_time = time.time()
+    if searcher is None:
+        searcher = ExactSearcher(passage_embeddings)
+    index_time = time.time() - start_time
+    
     recall_10_scores = []
     recall_100_scores = []
     mrr_scores = []
     ndcg_10_scores = []
     
     num_queries = len(queries_metadata)
-    queries_with_qrels = 0
     
-    # Create passage_id to index mapping
-    passage_id_to_idx = {p['passage_id']: i for i, p in enumerate(passages_metadata)}
+    # Only queries with qrels are searched
+    evaluated = [i for i, query_meta in enumerate(queries_metadata) if query_meta['query_id'] in qrels]
+    queries_with_qrels = len(evaluated)
+    query_batch = np.asarray(query_embeddings)[evaluated]
     
-    start_time = time.time()
+    search_start = time.perf_counter()
+    all_top_indices = np.empty((queries_with_qrels, min(top_k, len(passages_metadata))), dtype=np.int64)
+    for start in tqdm(range(0, queries_with_qrels, query_batch_size), desc="Searching query batches"):
+        all_top_indices[start:start + query_batch_size], _ = searcher.search_batch(
+            query_batch[start:start + query_batch_size], top_k, query_batch_size
+        )
+    search_time = time.perf_counter() - search_start
     
-    for i, query_meta in enumerate(tqdm(queries_metadata, desc="Evaluating queries")):
-        query_id = query_meta['query_id']
-        
-        # Skip if no qrels for this query
-        if query_id not in qrels:
-            continue
-        
-        queries_with_qrels += 1
-        query_embedding = query_embeddings[i]
+    for row, i in enumerate(evaluated):
+        query_id = queries_metadata[i]['query_id']
+        top_indices = all_top_indices[row]
         
-        # Retrieve top-k passages
-        top_indices = search_top_k(query_embedding, passage_embeddings, top_k)
-        
-        # Convert indices to passage IDs
-        retrieved_ids = [passages_metadata[idx]['passage_id'] for idx in top_indices]
+        # Convert indices to passage IDs (approximate searchers pad short results with -1)
+        retrieved_ids = [passages_metadata[idx]['passage_id'] for idx in top_indices if idx >= 0]
         
         # Get relevant passage IDs for this query
         relevant_ids = qrels[query_id]
@@ -258,6 +456,10 @@ def evaluate_retrieval(
     
     eval_time = time.time() - start_time
     
+    # Evenly spaced queries, so the timed set does not depend on batch boundaries
+    latency_rows = np.linspace(0, queries_with_qrels - 1, min(latency_queries, queries_with_qrels)).astype(int)
+    single_query_latency = measure_query_latency(searcher, query_batch[latency_rows], top_k)
+    
     # Compute average metrics
     metrics = {
         'recall@10': float(np.mean(recall_10_scores)) if recall_10_scores else 0.0,
@@ -268,13 +470,329 @@ def evaluate_retrieval(
         'num_queries_with_qrels': int(queries_with_qrels),
         'num_passages': int(len(passages_metadata)),
         'evaluation_time_seconds': float(eval_time),
-        'avg_query_latency_ms': float(eval_time / queries_with_qrels * 1000) if queries_with_qrels > 0 else 0.0
+        'index_build_time_seconds': float(index_time),
+        'search_time_seconds': float(search_time),
+        'query_batch_size': int(query_batch_size),
+        'queries_per_second': float(queries_with_qrels / search_time) if search_time > 0 else 0.0,
+        # Batched search time per query (amortized, excludes metric computation)
+        'avg_query_latency_ms': float(search_time / queries_with_qrels * 1000) if queries_with_qrels > 0 else 0.0,
+        'single_query_latency_ms': single_query_latency
     }
     
     print(f"\n✓ Evaluation complete")
     print(f"  - Queries evaluated: {queries_with_qrels}")
-    print(f"  - Evaluation time: {eval_time:.2f} seconds")
-    print(f"  - Avg query latency: {metrics['avg_query_latency_ms']:.2f} ms")
+    print(f"  - Evaluation time: {eval_time:.2f} seconds (index build {index_time:.2f}s, search {search_time:.2f}s)")
+    print(f"  - Batched search: {metrics['queries_per_second']:,.0f} queries/sec "
+          f"({metrics['avg_query_latency_ms']:.3f} ms/query amortized, batches of {query_batch_size})")
+    if single_query_latency['num_queries']:
+        print(f"  - Single-query latency: p50 {single_query_latency['p50']:.2f} ms, "
+              f"p95 {single_query_latency['p95']:.2f} ms over {single_query_latency['num_queries']} queries")
+    
+    return metrics
+
+
+# Compression mode -> (results subdirectory, label)
+MODE_DIRS = {
+    'baseline': ('baseline', 'baseline'),
+    'boundary': ('boundary', 'boundary-aware'),
+    'pq': ('pq', 'pq'),
+    'sq8': ('sq8', 'sq8'),
+    'sq4': ('sq4', 'sq4')
+}
+
+# --mode choice -> compression modes evaluated
+EVAL_MODES = {
+    'baseline': ['baseline'],
+    'boundary': ['boundary'],
+    'both': ['baseline', 'boundary'],
+    'pq': ['pq'],
+    'sq8': ['sq8'],
+    'sq4': ['sq4']
+}
+
+DRIFT_METRICS = ['recall@10', 'recall@100', 'mrr', 'ndcg@10']
+
+# Exact-search fields kept as the ADC throughput reference
+EXACT_REFERENCE_METRICS = DRIFT_METRICS + [
+    'queries_per_second', 'avg_query_latency_ms', 'search_time_seconds', 'index_build_time_seconds',
+    'single_query_latency_ms'
+]
+
+# Per-nprobe fields kept in the IVF sweep
+IVF_SWEEP_METRICS = DRIFT_METRICS + [
+    'queries_per_second', 'avg_query_latency_ms', 'search_time_seconds', 'single_query_latency_ms'
+]
+
+
+def evaluate_ivf(
+    mode_dir: Path,
+    query_embeddings: np.ndarray,
+    qrels: Dict[str, Set[str]],
+    queries_metadata: List[Dict],
+    passages_metadata: List[Dict],
+    top_k: int,
+    dtype_policy: DtypePolicy,
+    nprobe_values: Sequence[int] = (DEFAULT_NPROBE,),
+    original_vectors: Optional[np.ndarray] = None,
+    query_batch_size: int = DEFAULT_QUERY_BLOCK,
+    latency_queries: int = DEFAULT_LATENCY_QUERIES,
+    rerank_depths: Sequence[int] = (),
+    rerank_vectors: Optional[np.ndarray] = None
+) -> Dict:
+    """
+    Evaluate IVF search over the run's k-means centroids, once per nprobe.
+    
+    The index is built once; its posting lists store original_vectors when
+    given, else the decoded compressed passages of mode_dir. With
+    rerank_depths, the index at the largest nprobe is also evaluated as the
+    first stage of a rerank against rerank_vectors.
+    
+    Returns:
+        metrics dict of the largest nprobe, with one entry per nprobe under 'ivf_sweep'
+    """
+    centroids = load_ivf_centroids(mode_dir.parent)
+    vectors = original_vectors if original_vectors is not None else load_compressed_passages(mode_dir)
+    
+    start_time = time.time()
+    index = IVFIndex(dtype_policy.to_compute(centroids), dtype_policy.to_compute(vectors))
+    index_time = time.time() - start_time
+    print(f"✓ Built IVF index for {mode_dir.name}: {index.num_lists} lists over {len(index)} "
+          f"{'original' if original_vectors is not None else 'compressed'} passages "
+          f"(largest list {int(index.list_sizes.max())}, {index_time:.2f}s)")
+    
+    queries = dtype_policy.to_compute(query_embeddings)
+    evaluated = [i for i, query_meta in enumerate(queries_metadata) if query_meta['query_id'] in qrels]
+    
+    sweep = []
+    for nprobe in sorted(set(nprobe_values)):
+        index.nprobe = nprobe
+        print(f"\nIVF search with nprobe={nprobe}")
+        metrics = evaluate_retrieval(
+            queries, None, qrels, queries_metadata, passages_metadata, top_k,
+            searcher=index,
+            query_batch_size=query_batch_size,
+            latency_queries=latency_queries
+        )
+        candidates = float(index.candidate_counts(queries[evaluated]).mean()) if evaluated else 0.0
+        sweep.append({
+            'nprobe': int(min(nprobe, index.num_lists)),
+            **{key: metrics[key] for key in IVF_SWEEP_METRICS},
+            'candidates_per_query': candidates,
+            'candidate_fraction': candidates / max(1, len(index))
+        })
+    
+    metrics['dtype'] = dtype_policy.name
+    metrics['search'] = 'ivf'
+    metrics['index_build_time_seconds'] = float(index_time)
+    metrics['ivf_vectors'] = 'original' if original_vectors is not None else 'compressed'
+    metrics['ivf_lists'] = int(index.num_lists)
+    metrics['ivf_sweep'] = sweep
+    
+    if rerank_depths:
+        # The sweep leaves the index at the largest nprobe, the one the metrics above describe
+        metrics['rerank_dtype'] = str(rerank_vectors.dtype)
+        metrics['rerank_sweep'] = evaluate_rerank(
+            index, rerank_vectors, rerank_depths, queries, qrels, queries_metadata, passages_metadata, top_k,
+            query_batch_size, latency_queries
+        )
+    return metrics
+
+
+# Per-depth fields kept in the rerank sweep
+RERANK_SWEEP_METRICS = IVF_SWEEP_METRICS
+
+
+def evaluate_rerank(
+    first_stage,
+    originals: np.ndarray,
+    depths: Sequence[int],
+    query_embeddings: np.ndarray,
+    qrels: Dict[str, Set[str]],
+    queries_metadata: List[Dict],
+    passages_metadata: List[Dict],
+    top_k: int,
+    query_batch_size: int = DEFAULT_QUERY_BLOCK,
+    latency_queries: int = DEFAULT_LATENCY_QUERIES
+) -> List[Dict]:
+    """
+    Evaluate two-stage retrieval once per rerank depth.
+    
+    Args:
+        first_stage: compressed searcher producing the candidates
+        originals: (n, dim) memory-mapped original embeddings
+        depths: candidates reranked per query, one evaluation each
+    
+    Returns:
+        one dict per depth: metrics, latency and rows / bytes read from the originals per query
+    """
+    if len(originals) != len(first_stage):
+        raise ValueError(f"Original embeddings have {len(originals)} rows but the compressed store has "
+                         f"{len(first_stage)} passages")
+    sweep = []
+    for depth in sorted(set(depths)):
+        print(f"\nTwo-stage search, reranking the top {depth} candidates")
+        searcher = RerankSearcher(first_stage, originals, depth)
+        metrics = evaluate_retrieval(
+            query_embeddings, None, qrels, queries_metadata, passages_metadata, top_k,
+            searcher=searcher,
+            query_batch_size=query_batch_size,
+            latency_queries=latency_queries
+        )
+        sweep.append({
+            'rerank_depth': int(depth),
+            **{key: metrics[key] for key in RERANK_SWEEP_METRICS},
+            **searcher.stats()
+        })
+    return sweep
+
+
+def evaluate_mode(
+    mode_dir: Path,
+    query_embeddings: np.ndarray,
+    qrels: Dict[str, Set[str]],
+    queries_metadata: List[Dict],
+    passages_metadata: List[Dict],
+    top_k: int,
+    dtype_policy: DtypePolicy,
+    report_drift: bool = False,
+    query_batch_size: int = DEFAULT_QUERY_BLOCK,
+    latency_queries: int = DEFAULT_LATENCY_QUERIES,
+    scorer: str = 'exact',
+    nprobe_values: Sequence[int] = (DEFAULT_NPROBE,),
+    ivf_vectors: Optional[np.ndarray] = None,
+    rerank_depths: Sequence[int] = (),
+    rerank_vectors: Optional[np.ndarray] = None
+) -> Dict:
+    """
+    Evaluate one compression mode under a dtype policy.
+    
+    Queries and decoded passages are rounded to the policy's storage dtype
+    and searched in its compute dtype. With report_drift, the evaluation is
+    repeated in float64 and the per-metric drift is written to dtype_drift.json.
+    With scorer='codebook', codebook stores are searched in the codebook
+    domain (other stores are searched as usual). With scorer='ivf', the
+    mode is evaluated by evaluate_ivf for every nprobe (no drift report; a
+    rerank uses the largest nprobe).
+    With scorer='adc', PQ and codebook stores are scored from their codes
+    and exact float search over the decoded passages is rerun as the
+    throughput reference ('exact_reference'). With rerank_depths, the same
+    search is also evaluated as the first stage of a rerank against
+    rerank_vectors, once per depth ('rerank_sweep').
+    
+    Returns:
+        metrics dict
+    """
+    if scorer == 'ivf':
+        return evaluate_ivf(
+            mode_dir, query_embeddings, qrels, queries_metadata, passages_metadata, top_k, dtype_policy,
+            nprobe_values, ivf_vectors, query_batch_size, latency_queries, rerank_depths, rerank_vectors
+        )
+    
+    passages = None
+    searcher = open_packed_scorer(mode_dir)
+    search = 'packed-sq'
+    index_time = None
+    if searcher is not None:
+        print(f"✓ Scoring {mode_dir.name} directly against {searcher.bits}-bit packed codes, "
+              f"queries in {dtype_policy.compute}")
+    elif scorer == 'codebook':
+        start_time = time.time()
+        searcher = open_codebook_searcher(mode_dir, dtype_policy)
+        index_time = time.time() - start_time
+        search = 'codebook'
+        if searcher is None:
+            print(f"  {mode_dir.name} is not a codebook store, falling back to exact search")
+    elif scorer == 'adc':
+        start_time = time.time()
+        searcher = open_adc_scorer(mode_dir, dtype_policy)
+        index_time = time.time() - start_time
+        search = 'adc'
+        if searcher is None:
+            print(f"  {mode_dir.name} has no codes ADC can score, falling back to exact search")
+    if searcher is None:
+        search = 'exact'
+        passages = load_compressed_passages(mode_dir)
+        print(f"✓ Loaded {mode_dir.name} embeddings: shape {passages.shape}, evaluating in {dtype_policy.compute}")
+    
+    metrics = evaluate_retrieval(
+        dtype_policy.to_compute(query_embeddings),
+        dtype_policy.to_compute(passages) if passages is not None else None,
+        qrels,
+        queries_metadata,
+        passages_metadata,
+        top_k,
+        searcher=searcher,
+        query_batch_size=query_batch_size,
+        latency_queries=latency_queries
+    )
+    metrics['dtype'] = dtype_policy.name
+    metrics['search'] = search
+    run_config = load_mode_run_config(mode_dir)
+    if run_config is not None:
+        print(f"✓ Read {run_config['mode']} run configuration ({run_config['num_passages']} passages, "
+              f"{run_config.get('dtype', 'float32')}{', out-of-core' if run_config.get('out_of_core') else ''})")
+        if run_config['num_passages'] != len(passages_metadata):
+            print(f"  WARNING: the {run_config['mode']} store was built from {run_config['num_passages']} passages, "
+                  f"metadata has {len(passages_metadata)}")
+        metrics['compression'] = {
+            **run_config.get(run_config['mode'], {}),
+            'out_of_core': run_config.get('out_of_core', False),
+            'compression_dtype': run_config.get('dtype')
+        }
+    if index_time is not None:
+        # Inverted lists are built when the searcher is opened
+        metrics['index_build_time_seconds'] = float(index_time)
+    if search == 'codebook':
+        metrics['codebook_entries'] = int(searcher.num_codes)
+    if search == 'adc':
+        print("\nRe-evaluating with exact float scoring for the ADC throughput reference...")
+        exact = evaluate_retrieval(
+            dtype_policy.to_compute(query_embeddings),
+            dtype_policy.to_compute(load_compressed_passages(mode_dir)),
+            qrels,
+            queries_metadata,
+            passages_metadata,
+            top_k,
+            query_batch_size=query_batch_size,
+            latency_queries=latency_queries
+        )
+        metrics['exact_reference'] = {key: exact[key] for key in EXACT_REFERENCE_METRICS}
+        metrics['speedup_vs_exact'] = (
+            metrics['queries_per_second'] / exact['queries_per_second'] if exact['queries_per_second'] > 0 else 0.0
+        )
+    
+    if rerank_depths:
+        first_stage = searcher if searcher is not None else ExactSearcher(dtype_policy.to_compute(passages))
+        metrics['rerank_dtype'] = str(rerank_vectors.dtype)
+        metrics['rerank_sweep'] = evaluate_rerank(
+            first_stage, rerank_vectors, rerank_depths,
+            dtype_policy.to_compute(query_embeddings), qrels, queries_metadata, passages_metadata, top_k,
+            query_batch_size, latency_queries
+        )
+    
+    if report_drift and dtype_policy.name != 'float64':
+        print("\nRe-evaluating in float64 for the dtype drift report...")
+        if passages is None:
+            passages = load_compressed_passages(mode_dir)
+        reference = evaluate_retrieval(
+            np.asarray(query_embeddings, dtype=np.float64),
+            np.asarray(passages, dtype=np.float64),
+            qrels,
+            queries_metadata,
+            passages_metadata,
+            top_k,
+            query_batch_size=query_batch_size,
+            latency_queries=0
+        )
+        drift = {
+            'dtype': dtype_policy.name,
+            'reference_dtype': 'float64',
+            'metrics': metric_drift(metrics, reference, DRIFT_METRICS)
+        }
+        save_metrics(drift, mode_dir / 'dtype_drift.json')
+        print("  - Drift vs float64: " + ", ".join(
+            f"{key}={values['abs_diff']:.2e}" for key, values in drift['metrics'].items()
+        ))
     
     return metrics
 
@@ -298,7 +816,35 @@ def print_metrics(metrics: Dict, mode: str):
     print(f"NDCG@10:     {metrics['ndcg@10']:.4f}")
     print(f"\nQueries:     {metrics['num_queries_with_qrels']} (with qrels)")
     print(f"Passages:    {metrics['num_passages']}")
-    print(f"Query latency: {metrics['avg_query_latency_ms']:.2f} ms")
+    print(f"Query latency: {metrics['avg_query_latency_ms']:.3f} ms amortized over batches of {metrics['query_batch_size']}"
+          f" ({metrics['queries_per_second']:,.0f} queries/sec)")
+    single = metrics['single_query_latency_ms']
+    if single['num_queries']:
+        print(f"Single query:  p50 {single['p50']:.2f} ms, p95 {single['p95']:.2f} ms, p99 {single['p99']:.2f} ms")
+    if 'exact_reference' in metrics:
+        exact = metrics['exact_reference']
+        print(f"Exact float:   {exact['queries_per_second']:,.0f} queries/sec, Recall@10 {exact['recall@10']:.4f} "
+              f"(ADC speedup {metrics['speedup_vs_exact']:.2f}x)")
+    if 'rerank_sweep' in metrics:
+        print(f"\nRerank ({metrics['rerank_dtype']} originals; depth 0 = compressed only):")
+        print(f"{'depth':>8} {'R@10':>8} {'R@100':>8} {'page KB/q':>9} {'QPS':>10} {'p50 ms':>8} {'p95 ms':>8}")
+        print(f"{0:>8} {metrics['recall@10']:8.4f} {metrics['recall@100']:8.4f} {0.0:9.1f} "
+              f"{metrics['queries_per_second']:10,.0f}")
+        for entry in metrics['rerank_sweep']:
+            entry_single = entry['single_query_latency_ms']
+            p50 = f"{entry_single['p50']:8.2f}" if entry_single['num_queries'] else f"{'-':>8}"
+            p95 = f"{entry_single['p95']:8.2f}" if entry_single['num_queries'] else f"{'-':>8}"
+            print(f"{entry['rerank_depth']:>8} {entry['recall@10']:8.4f} {entry['recall@100']:8.4f} "
+                  f"{entry['rerank_page_bytes_per_query'] / 1024:9.1f} {entry['queries_per_second']:10,.0f} {p50} {p95}")
+    if 'ivf_sweep' in metrics:
+        print(f"\nIVF ({metrics['ivf_lists']} lists, {metrics['ivf_vectors']} vectors):")
+        print(f"{'nprobe':>8} {'R@10':>8} {'R@100':>8} {'scanned':>9} {'QPS':>10} {'p50 ms':>8} {'p95 ms':>8}")
+        for entry in metrics['ivf_sweep']:
+            entry_single = entry['single_query_latency_ms']
+            p50 = f"{entry_single['p50']:8.2f}" if entry_single['num_queries'] else f"{'-':>8}"
+            p95 = f"{entry_single['p95']:8.2f}" if entry_single['num_queries'] else f"{'-':>8}"
+            print(f"{entry['nprobe']:>8} {entry['recall@10']:8.4f} {entry['recall@100']:8.4f} "
+                  f"{entry['candidate_fraction']:9.2%} {entry['queries_per_second']:10,.0f} {p50} {p95}")
     print("="*80)
 
 
@@ -308,9 +854,9 @@ def main():
     )
     parser.add_argument(
         '--mode',
-        choices=['baseline', 'boundary', 'both'],
+        choices=list(EVAL_MODES),
         default='both',
-        help='Which compression mode to evaluate (default: both)'
+        help='Which compression mode to evaluate; both = baseline + boundary (default: both)'
     )
     parser.add_argument(
         '--data-dir',
@@ -328,8 +874,77 @@ def main():
         default=100,
         help='Maximum k for retrieval (default: 100)'
     )
+    parser.add_argument(
+        '--dtype',
+        choices=DTYPE_CHOICES,
+        default=DEFAULT_DTYPE,
+        help='Floating point policy: float32, float16 storage (float32 compute) or float64 (default: float32)'
+    )
+    parser.add_argument(
+        '--report-dtype-drift',
+        action='store_true',
+        help='Repeat the evaluation in float64 and write per-metric drift to dtype_drift.json'
+    )
+    parser.add_argument(
+        '--scorer',
+        choices=SCORERS,
+        default='exact',
+        help='exact: search decoded passages; codebook: score the unique codebook and expand an inverted '
+             'code -> passages list (codebook stores only); ivf: probe posting lists of the run\'s k-means '
+             'centroids; adc: sum per-query lookup tables over PQ / codebook codes, compared against exact '
+             'float scoring (default: exact)'
+    )
+    parser.add_argument(
+        '--nprobe',
+        type=int,
+        nargs='+',
+        default=[DEFAULT_NPROBE],
+        help=f'IVF lists probed per query; several values are evaluated in turn (default: {DEFAULT_NPROBE})'
+    )
+    parser.add_argument(
+        '--ivf-vectors',
+        choices=IVF_VECTORS,
+        default='compressed',
+        help='Vectors stored in the IVF posting lists: the decoded compressed passages or the original '
+             'embeddings from --data-dir (default: compressed)'
+    )
+    parser.add_argument(
+        '--rerank-depth',
+        type=int,
+        nargs='+',
+        default=[],
+        help='Also evaluate two-stage retrieval: rerank the top R compressed candidates against the original '
+             'embeddings in --data-dir; several depths are evaluated in turn (with --scorer ivf, at the largest --nprobe)'
+    )
+    parser.add_argument(
+        '--rerank-dtype',
+        choices=RERANK_DTYPES,
+        default='float32',
+        help='Original embeddings used for reranking; float16 maps a half-precision copy written next to them '
+             '(default: float32)'
+    )
+    parser.add_argument(
+        '--query-batch-size',
+        type=int,
+        default=DEFAULT_QUERY_BLOCK,
+        help=f'Queries searched together with one GEMM per passage block (default: {DEFAULT_QUERY_BLOCK})'
+    )
+    parser.add_argument(
+        '--latency-queries',
+        type=int,
+        default=DEFAULT_LATENCY_QUERIES,
+        help=f'Queries searched one at a time for single-query latency percentiles, 0 to skip '
+             f'(default: {DEFAULT_LATENCY_QUERIES})'
+    )
     
     args = parser.parse_args()
+    if args.query_batch_size < 1:
+        parser.error('--query-batch-size must be at least 1')
+    if min(args.nprobe) < 1:
+        parser.error('--nprobe values must be at least 1')
+    if args.rerank_depth and min(args.rerank_depth) < 1:
+        parser.error('--rerank-depth values must be at least 1')
+    dtype_policy = DtypePolicy(args.dtype)
     
     data_dir = Path(args.data_dir)
     results_dir = Path(args.results_dir)
@@ -342,6 +957,13 @@ def main():
     print(f"  - Data: {data_dir}")
     print(f"  - Results: {results_dir}")
     print(f"  - Top-k: {args.top_k}")
+    print(f"  - Scorer: {args.scorer}")
+    if args.rerank_depth:
+        print(f"  - Rerank depth: {', '.join(map(str, sorted(set(args.rerank_depth))))} ({args.rerank_dtype} originals)")
+    if args.scorer == 'ivf':
+        print(f"  - nprobe: {', '.join(map(str, sorted(set(args.nprobe))))} ({args.ivf_vectors} vectors)")
+    print(f"  - Query batch size: {args.query_batch_size}")
+    print(f"  - Dtype: {args.dtype}")
     print("\nNO SIMULATION. REAL METRICS.")
     print("="*80)
     
@@ -360,81 +982,67 @@ def main():
         query_embeddings = np.load(query_embeddings_path)
         print(f"✓ Loaded query embeddings: shape {query_embeddings.shape}")
         
-        # Evaluate baseline
-        if args.mode in ['baseline', 'both']:
-            print("\n" + "="*80)
-            print("EVALUATING BASELINE")
-            print("="*80)
-            
-            baseline_embeddings_path = results_dir / 'baseline' / 'compressed_passages.npy'
-            if not baseline_embeddings_path.exists():
-                raise FileNotFoundError(f"Baseline compressed embeddings not found: {baseline_embeddings_path}")
-            
-            print(f"Loading baseline compressed embeddings from {baseline_embeddings_path}...")
-            baseline_embeddings = np.load(baseline_embeddings_path)
-            print(f"✓ Loaded baseline embeddings: shape {baseline_embeddings.shape}")
-            
-            baseline_metrics = evaluate_retrieval(
-                query_embeddings,
-                baseline_embeddings,
-                qrels,
-                queries_metadata,
-                passages_metadata,
-                args.top_k
-            )
-            
-            # Save metrics
-            baseline_metrics_path = results_dir / 'baseline' / 'metrics.json'
-            save_metrics(baseline_metrics, baseline_metrics_path)
-            
-            # Save performance info
-            perf_info = {
-                'avg_query_latency_ms': baseline_metrics['avg_query_latency_ms'],
-                'evaluation_time_seconds': baseline_metrics['evaluation_time_seconds'],
-                'mode': 'baseline'
-            }
-            perf_path = results_dir / 'baseline' / 'perf.json'
-            save_metrics(perf_info, perf_path)
-            
-            print_metrics(baseline_metrics, 'baseline')
+        ivf_vectors = None
+        if args.scorer == 'ivf' and args.ivf_vectors == 'original':
+            ivf_vectors = np.load(data_dir / 'passages_embeddings.npy', mmap_mode='r')
+            print(f"✓ Opened original passage embeddings for IVF posting lists: shape {ivf_vectors.shape}")
+        
+        rerank_vectors = None
+        if args.rerank_depth:
+            rerank_vectors = open_rerank_vectors(data_dir / 'passages_embeddings.npy', args.rerank_dtype)
+            print(f"✓ Memory-mapped original passage embeddings for reranking: shape {rerank_vectors.shape}, "
+                  f"{rerank_vectors.dtype}")
         
-        # Evaluate boundary-aware
-        if args.mode in ['boundary', 'both']:
+        for mode in EVAL_MODES[args.mode]:
+            mode_dir_name, mode_label = MODE_DIRS[mode]
             print("\n" + "="*80)
-            print("EVALUATING BOUNDARY-AWARE")
+            print(f"EVALUATING {mode_label.upper()}")
             print("="*80)
             
-            boundary_embeddings_path = results_dir / 'boundary' / 'compressed_passages.npy'
-            if not boundary_embeddings_path.exists():
-                raise FileNotFoundError(f"Boundary-aware compressed embeddings not found: {boundary_embeddings_path}")
-            
-            print(f"Loading boundary-aware compressed embeddings from {boundary_embeddings_path}...")
-            boundary_embeddings = np.load(boundary_embeddings_path)
-            print(f"✓ Loaded boundary-aware embeddings: shape {boundary_embeddings.shape}")
-            
-            boundary_metrics = evaluate_retrieval(
+            mode_metrics = evaluate_mode(
+                results_dir / mode_dir_name,
                 query_embeddings,
-                boundary_embeddings,
                 qrels,
                 queries_metadata,
                 passages_metadata,
-                args.top_k
+                args.top_k,
+                dtype_policy,
+                args.report_dtype_drift,
+                args.query_batch_size,
+                args.latency_queries,
+                args.scorer,
+                args.nprobe,
+                ivf_vectors,
+                args.rerank_depth,
+                rerank_vectors
             )
             
             # Save metrics
-            boundary_metrics_path = results_dir / 'boundary' / 'metrics.json'
-            save_metrics(boundary_metrics, boundary_metrics_path)
+            save_metrics(mode_metrics, results_dir / mode_dir_name / 'metrics.json')
             
             # Save performance info
             perf_info = {
-                'avg_query_latency_ms': boundary_metrics['avg_query_latency_ms'],
-                'evaluation_time_seconds': boundary_metrics['evaluation_time_seconds'],
-                'mode': 'boundary-aware'
+                'avg_query_latency_ms': mode_metrics['avg_query_latency_ms'],
+                'queries_per_second': mode_metrics['queries_per_second'],
+                'query_batch_size': mode_metrics['query_batch_size'],
+                'single_query_latency_ms': mode_metrics['single_query_latency_ms'],
+                'search_time_seconds': mode_metrics['search_time_seconds'],
+                'index_build_time_seconds': mode_metrics['index_build_time_seconds'],
+                'evaluation_time_seconds': mode_metrics['evaluation_time_seconds'],
+                'search': mode_metrics['search'],
+                'mode': mode_label
             }
-            perf_path = results_dir / 'boundary' / 'perf.json'
-            save_metrics(perf_info, perf_path)
+            if 'ivf_sweep' in mode_metrics:
+                perf_info['ivf_sweep'] = mode_metrics['ivf_sweep']
+            if 'rerank_sweep' in mode_metrics:
+                perf_info['rerank_dtype'] = mode_metrics['rerank_dtype']
+                perf_info['rerank_sweep'] = mode_metrics['rerank_sweep']
+            if 'exact_reference' in mode_metrics:
+                perf_info['exact_reference'] = mode_metrics['exact_reference']
+                perf_info['speedup_vs_exact'] = mode_metrics['speedup_vs_exact']
+            save_metrics(perf_info, results_dir / mode_dir_name / 'perf.json')
             
-            print_metrics(boundary_metrics, 'boundary-aware')
+            print_metrics(mode_metrics, mode_label)
         
         print("\n" + "="*80)
         print("SUCCESS: Retrieval evaluation complete")
@@ -7,101 +7,218 @@ Runs baseline and boundary-aware compression on MS MARCO passage embeddings.
 NO SIMULATION. REAL COMPRESSION.
 - Loads real embeddings from msmarco_embed.py
 - Applies baseline (lattice-hybrid) compression
-- Applies boundary-aware compression
+- Applies boundary-aware compression (boundary centroids on a finer grid, or
+  --boundary-encoding residual: quantized residuals for boundary passages only)
+- Shares one k-means fit across both modes (fit cache)
+- Fits k-means in full, mini-batch (streamed), sampled or hierarchical (tree) mode
+- Optionally runs out-of-core over memory-mapped embeddings, chunk by chunk, with
+  the boundary threshold taken from a mergeable quantile sketch of all ambiguity scores
+- Optionally sweeps a (grid, k) range over a process pool with shared-memory embeddings
+- Optionally runs product quantization (--mode pq) instead, m uint8 codes per passage
+- Optionally runs packed int8/int4 scalar quantization (--mode sq8|sq4) instead
+- Snaps centroids to the cubic grid or, with --lattice, to D4/D_n, A3*/A_n* or E8 lattices
+- Honors a --dtype policy (float32 default, float16 codebook storage)
 - Measures compression time
-- Saves compressed representations
+- Saves compressed representations (codebook + integer codes), optionally as a
+  bit-packed or Huffman-coded code stream (--code-encoding)
 
 Usage:
     python analysis/msmarco_run_compression.py
     python analysis/msmarco_run_compression.py --grid 0.1 --k 10
+    python analysis/msmarco_run_compression.py --grid 0.1 --k 10 --lattice e8
+    python analysis/msmarco_run_compression.py --grid 0.1 --k 10 --boundary-encoding residual --residual-bits 4
+    python analysis/msmarco_run_compression.py --k 256 --kmeans-mode minibatch --compare-full-inertia
+    python analysis/msmarco_run_compression.py --k 4096 --kmeans-mode hierarchical --kmeans-branching 64
+    python analysis/msmarco_run_compression.py --k 256 --out-of-core --chunk-size 65536
+    python analysis/msmarco_run_compression.py --k 4096 --code-encoding huffman
+    python analysis/msmarco_run_compression.py --grid-range 0.05 0.5 10 --k-range 8 64 8 --workers 8
+    python analysis/msmarco_run_compression.py --k-range 8 64 8 --kmeans-warm-start --compare-full-inertia
+    python analysis/msmarco_run_compression.py --mode pq --pq-m 8
+    python analysis/msmarco_run_compression.py --mode sq4
 """
 
 import json
+import os
 import sys
 import argparse
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
 from pathlib import Path
-from typing import List, Tuple, Dict
+from typing import List, Tuple, Dict, Optional
 import time
 
 try:
-    from sklearn.cluster import KMeans
     from tqdm import tqdm
 except ImportError as e:
     print(f"ERROR: Required library not installed: {e}")
-    print("Install dependencies with: pip install scikit-learn tqdm numpy")
+    print("Install dependencies with: pip install tqdm numpy")
     sys.exit(1)
 
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+try:
+    from threadpoolctl import threadpool_limits
+except ImportError:
+    threadpool_limits = None
+
+# Import the shared assignment engine
+sys.path.insert(0, str(Path(__file__).parent))
+from centroid_assignment import assign_nearest, boundary_assign, nearest_two
+from code_streams import CODE_ENCODINGS, DEFAULT_CODE_BLOCK
+from compressed_store import (
+    CompressedStoreWriter, ResidualTable, open_compressed_store, save_compressed_store, save_pq_store, save_sq_store
+)
+from dtype_policy import DEFAULT_DTYPE, DTYPE_CHOICES, ComputeView, DtypePolicy, codebook_drift, reconstruction_mse
+from hierarchical_kmeans import DEFAULT_BRANCHING
+from kmeans_cache import KMeansFit, KMeansFitCache, build_fit
+from kmeans_ladder import compare_ladder_to_cold, kmeans_ladder
+from lattice_quantizers import LATTICES, lattice_keys, lattice_points, unique_rows
+from product_quantization import PQ_MAX_KSUB, encode_pq, pq_reconstruction_mse, train_pq
+from quantile_sketch import DEFAULT_SKETCH_K, KLLSketch
+from scalar_quantization import SQ_BITS, dimension_ranges, encode_sq, sq_parameters, sq_reconstruction_mse
+from streaming_kmeans import KMEANS_MODES, KMeansConfig, sample_rows
+
+
+# How boundary-aware compression spends extra precision on boundary passages:
+# - finer-grid: code them by their centroid snapped to grid / 2 (one shared codebook)
+# - residual:   code them like bulk passages, plus a scalar-quantized residual in a side table
+BOUNDARY_ENCODINGS = ['finer-grid', 'residual']
+RESIDUAL_BITS = [8, 4]
+
+# How out-of-core compression finds the boundary threshold:
+# - sketch: quantile sketch over every passage's ambiguity score (one extra scoring pass)
+# - sample: exact percentile over a random sample of passages
+THRESHOLD_ESTIMATORS = ['sketch', 'sample']
+
+# Unsnapped k-means centroids of a single run, kept so new passages can be appended
+CENTROIDS_FILENAME = 'kmeans_centroids.npy'
+
 
 def snap_to_grid(vectors: np.ndarray, step: float) -> np.ndarray:
     """Snap vectors to grid with given step size."""
     return np.round(vectors / step) * step
 
 
-def run_kmeans(vectors: np.ndarray, k: int, random_state: int = 42) -> Tuple[np.ndarray, np.ndarray]:
+def fit_kmeans(
+    vectors: np.ndarray,
+    k: int,
+    random_state: int = 42,
+    kmeans_config: Optional[KMeansConfig] = None
+) -> Tuple[np.ndarray, np.ndarray]:
     """
-    Run KMeans clustering on vectors.
+    Fit KMeans on vectors.
     
     Args:
         vectors: (n_samples, n_features) array
         k: number of clusters
         random_state: random seed
+        kmeans_config: fitting mode (default: full-batch KMeans)
     
     Returns:
-        compressed: compressed vectors (cluster centroids)
         centroids: cluster centroids
+        labels: (n_samples,) cluster index per vector
     """
     if k <= 0:
         k = 1
     if len(vectors) <= k:
-        return vectors, vectors
+        return np.asarray(vectors), np.arange(len(vectors))
     
-    kmeans = KMeans(n_clusters=k, random_state=random_state, n_init=10)
-    kmeans.fit(vectors)
+    if kmeans_config is None:
+        kmeans_config = KMeansConfig()
     
-    # Assign each vector to its closest centroid
-    compressed = kmeans.cluster_centers_[kmeans.labels_]
-    centroids = kmeans.cluster_centers_
-    
-    return compressed, centroids
+    return kmeans_config.fit(vectors, k, random_state)
 
 
-def extract_unique_vectors(vectors: np.ndarray, tolerance: float = 1e-9) -> np.ndarray:
-    """Extract unique vectors from array."""
-    # Use numpy unique with tolerance for floating point comparison
-    # Round to avoid floating point issues
-    rounded = np.round(vectors / tolerance) * tolerance
-    unique_vectors = np.unique(rounded, axis=0)
-    return unique_vectors
+def get_kmeans_fit(
+    vectors: np.ndarray,
+    k: int,
+    random_state: int = 42,
+    fit_cache: Optional[KMeansFitCache] = None,
+    kmeans_config: Optional[KMeansConfig] = None
+) -> Tuple[KMeansFit, bool]:
+    """
+    Get the k-means fit for vectors, reusing fit_cache when given.
+    
+    Returns:
+        fit: centroids, labels and top-2 centroid distances
+        cache_hit: whether the fit came from the cache
+    """
+    if kmeans_config is None:
+        kmeans_config = KMeansConfig()
+    
+    def fit_fn(fit_vectors: np.ndarray, fit_k: int, seed: int) -> Tuple[np.ndarray, np.ndarray]:
+        return fit_kmeans(fit_vectors, fit_k, seed, kmeans_config)
+    
+    if fit_cache is None:
+        centroids, labels = fit_fn(vectors, k, random_state)
+        return build_fit(vectors, centroids, labels), False
+    
+    return fit_cache.get_or_fit(vectors, k, random_state, fit_fn, method=kmeans_config.cache_method)
 
 
-def classify_boundary_vectors(vectors: np.ndarray, centroids: np.ndarray, percentile: float = 10.0) -> np.ndarray:
+def snap_and_dedupe(centroids: np.ndarray, step: float, lattice: str = 'grid') -> Tuple[np.ndarray, np.ndarray]:
     """
-    Classify vectors as boundary based on ambiguity scores.
+    Snap centroids to the lattice and deduplicate them on their lattice keys.
     
     Args:
-        vectors: (n_samples, n_features) array
         centroids: (n_clusters, n_features) array
-        percentile: percentile threshold for boundary classification
+        step: grid step size (lattice scale)
+        lattice: lattice name (see LATTICES)
     
     Returns:
-        boundary_indices: boolean array indicating boundary vectors
+        unique_snapped: (num_codes, n_features) unique snapped centroids
+        centroid_codes: (n_clusters,) index into unique_snapped for each centroid
+    """
+    keys = lattice_keys(centroids, step, lattice)
+    first, centroid_codes = unique_rows(keys)
+    unique_snapped = lattice_points(keys[first], step, lattice).astype(centroids.dtype, copy=False)
+    return unique_snapped, centroid_codes
+
+
+def compare_kmeans_inertia(
+    vectors: np.ndarray,
+    k: int,
+    random_state: int,
+    fit_cache: KMeansFitCache,
+    kmeans_config: KMeansConfig
+) -> Dict:
     """
-    if len(centroids) < 2:
-        return np.zeros(len(vectors), dtype=bool)
+    Compare the inertia of the configured k-means mode against full k-means.
     
-    # Compute distances to all centroids for each vector
-    # distances[i, j] = distance from vector i to centroid j
-    distances = np.linalg.norm(vectors[:, None, :] - centroids[None, :, :], axis=2)
+    Returns:
+        dict with both inertias, their ratio and the full fit time
+    """
+    fit, _ = get_kmeans_fit(vectors, k, random_state, fit_cache, kmeans_config)
     
-    # Sort distances for each vector
-    sorted_distances = np.sort(distances, axis=1)
+    start_time = time.time()
+    full_fit, full_cache_hit = get_kmeans_fit(vectors, k, random_state, fit_cache, KMeansConfig(mode='full'))
+    full_time = time.time() - start_time
     
-    # Compute ambiguity scores: xi = d2 - d1
-    d1 = sorted_distances[:, 0]  # nearest centroid
-    d2 = sorted_distances[:, 1] if sorted_distances.shape[1] > 1 else d1  # 2nd nearest
-    ambiguity_scores = d2 - d1
+    return {
+        'mode': kmeans_config.mode,
+        'inertia': fit.inertia,
+        'full_inertia': full_fit.inertia,
+        'inertia_ratio_vs_full': float(fit.inertia / full_fit.inertia) if full_fit.inertia > 0 else 1.0,
+        'full_fit_time_seconds': float(full_time),
+        'full_fit_cache_hit': bool(full_cache_hit)
+    }
+
+
+def classify_by_ambiguity(ambiguity_scores: np.ndarray, percentile: float = 10.0) -> np.ndarray:
+    """
+    Classify vectors as boundary from precomputed ambiguity scores.
+    
+    Args:
+        ambiguity_scores: (n_samples,) array of d2 - d1 scores
+        percentile: percentile threshold for boundary classification
     
+    Returns:
+        boundary_indices: boolean array indicating boundary vectors
+    """
     # Find threshold at given percentile
     threshold = np.percentile(ambiguity_scores, percentile)
     
@@ -111,7 +228,137 @@ def classify_boundary_vectors(vectors: np.ndarray, centroids: np.ndarray, percen
     return boundary_mask
 
 
-def compress_baseline(vectors: np.ndarray, grid: float, k: int, random_state: int = 42) -> Tuple[np.ndarray, Dict]:
+def sketch_ambiguity(
+    embeddings: np.ndarray,
+    centroids: np.ndarray,
+    chunk_size: int = 65536,
+    sketch_k: int = DEFAULT_SKETCH_K,
+    seed: int = 0,
+    start: int = 0,
+    stop: Optional[int] = None
+) -> KLLSketch:
+    """
+    Quantile sketch of the ambiguity scores (d2 - d1) of rows [start, stop), chunk by chunk.
+    
+    Args:
+        embeddings: (n_samples, n_features) array, typically memory-mapped
+        centroids: (n_clusters, n_features) array, n_clusters >= 2
+        chunk_size: rows scored per chunk
+        sketch_k: sketch size (rank error about 1.7 / sketch_k)
+        seed: seed for the sketch's compaction coin flips
+        start, stop: row range to sketch (default: all rows)
+    
+    Returns:
+        KLLSketch over the range's ambiguity scores
+    """
+    sketch = KLLSketch(sketch_k, seed)
+    stop = len(embeddings) if stop is None else stop
+    for chunk_start in range(start, stop, chunk_size):
+        chunk = np.asarray(embeddings[chunk_start:min(chunk_start + chunk_size, stop)])
+        _, top2 = nearest_two(chunk, centroids)
+        sketch.update(top2[:, 1] - top2[:, 0])
+    return sketch
+
+
+def _sketch_shard(
+    embeddings_path: str,
+    start: int,
+    stop: int,
+    centroids: np.ndarray,
+    chunk_size: int,
+    sketch_k: int,
+    seed: int,
+    blas_threads: int,
+    dtype: Optional[str] = None
+) -> Dict:
+    """Sketch one contiguous shard of a memory-mapped embeddings file in a worker process."""
+    if threadpool_limits is not None:
+        threadpool_limits(limits=blas_threads)
+    embeddings = np.load(embeddings_path, mmap_mode='r')
+    if dtype is not None:
+        embeddings = DtypePolicy(dtype).view(embeddings)
+    return sketch_ambiguity(embeddings, centroids, chunk_size, sketch_k, seed, start, stop).to_dict()
+
+
+def sketch_ambiguity_sharded(
+    embeddings: np.ndarray,
+    centroids: np.ndarray,
+    chunk_size: int = 65536,
+    sketch_k: int = DEFAULT_SKETCH_K,
+    seed: int = 0,
+    workers: int = 1
+) -> KLLSketch:
+    """
+    Ambiguity sketch built over contiguous shards in worker processes, then merged.
+    
+    Workers re-open the memory-mapped embeddings file (under the same dtype
+    policy when given a ComputeView), so only the centroids and the small
+    sketches cross process boundaries. Falls back to a single in-process
+    pass for in-memory arrays or workers <= 1.
+    """
+    n = len(embeddings)
+    dtype = embeddings.policy.name if isinstance(embeddings, ComputeView) else None
+    path = getattr(embeddings.array if dtype is not None else embeddings, 'filename', None)
+    workers = min(int(workers), max(1, n // max(1, chunk_size)))
+    if workers <= 1 or path is None:
+        return sketch_ambiguity(embeddings, centroids, chunk_size, sketch_k, seed)
+    
+    bounds = np.linspace(0, n, workers + 1).astype(np.int64)
+    blas_threads = max(1, (os.cpu_count() or 1) // workers)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(_sketch_shard, str(path), int(start), int(stop), np.asarray(centroids),
+                            chunk_size, sketch_k, seed + shard, blas_threads, dtype)
+            for shard, (start, stop) in enumerate(zip(bounds[:-1], bounds[1:]))
+        ]
+        # Merge in shard order so the result does not depend on completion order
+        sketches = [KLLSketch.from_dict(future.result()) for future in futures]
+    
+    merged = sketches[0]
+    for sketch in sketches[1:]:
+        merged.merge(sketch)
+    return merged
+
+
+def build_boundary_codebook(
+    centroids: np.ndarray,
+    grid: float,
+    boundary_step: float,
+    lattice: str = 'grid'
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Build one codebook holding coarse (bulk) and fine (boundary) snapped centroids.
+    
+    The coarse lattice is a sublattice of the fine one (step ratio 2; this
+    holds for every lattice, since 2·L ⊂ L), so both sets dedupe into one
+    codebook on fine-lattice keys.
+    
+    Returns:
+        codebook: (num_codes, n_features) unique snapped centroids
+        bulk_codes: (n_clusters,) codebook index of each centroid snapped to grid
+        boundary_codes: (n_clusters,) codebook index of each centroid snapped to boundary_step
+    """
+    num_centroids = len(centroids)
+    keys = np.vstack([
+        2 * lattice_keys(centroids, grid, lattice),
+        lattice_keys(centroids, boundary_step, lattice)
+    ])
+    first, centroid_codes = unique_rows(keys)
+    codebook = lattice_points(keys[first], boundary_step, lattice).astype(centroids.dtype, copy=False)
+    
+    return codebook, centroid_codes[:num_centroids], centroid_codes[num_centroids:]
+
+
+def compress_baseline(
+    vectors: np.ndarray,
+    grid: float,
+    k: int,
+    random_state: int = 42,
+    fit_cache: Optional[KMeansFitCache] = None,
+    reassign: bool = False,
+    kmeans_config: Optional[KMeansConfig] = None,
+    lattice: str = 'grid'
+) -> Tuple[np.ndarray, np.ndarray, Dict]:
     """
     Baseline compression: lattice-hybrid (kmeans + grid).
     
@@ -120,39 +367,63 @@ def compress_baseline(vectors: np.ndarray, grid: float, k: int, random_state: in
         grid: grid step size
         k: number of clusters
         random_state: random seed
+        fit_cache: optional k-means fit cache shared across modes and grids
+        reassign: re-run nearest-centroid search against the snapped centroids
+                  instead of mapping k-means labels through the dedupe inverse
+        kmeans_config: k-means fitting mode (default: full-batch KMeans)
+        lattice: lattice centroids are snapped to (see LATTICES)
     
     Returns:
-        compressed: compressed vectors
+        codebook: (num_codes, n_features) unique snapped centroids
+        codes: (n_samples,) codebook index per vector
         info: compression info dict
     """
     start_time = time.time()
     
     # 1. Run KMeans to get initial centroids
-    _, ideal_centroids = run_kmeans(vectors, k, random_state)
+    fit, cache_hit = get_kmeans_fit(vectors, k, random_state, fit_cache, kmeans_config)
+    ideal_centroids = fit.centroids
+    kmeans_time = time.time() - start_time
     
     # 2. Snap centroids to grid
-    snapped_centroids = snap_to_grid(ideal_centroids, grid)
-    unique_snapped_centroids = extract_unique_vectors(snapped_centroids)
+    unique_snapped_centroids, centroid_codes = snap_and_dedupe(ideal_centroids, grid, lattice)
     
-    # 3. Assign each vector to closest snapped centroid
-    distances = np.linalg.norm(vectors[:, None, :] - unique_snapped_centroids[None, :, :], axis=2)
-    assignments = np.argmin(distances, axis=1)
-    compressed = unique_snapped_centroids[assignments]
+    # 3. Code each vector by its snapped cluster centroid (or the closest snapped centroid)
+    if reassign:
+        codes, _ = assign_nearest(vectors, unique_snapped_centroids)
+    else:
+        codes = centroid_codes[fit.labels]
     
     compression_time = time.time() - start_time
     
     info = {
         'mode': 'baseline',
         'grid': float(grid),
+        'lattice': lattice,
         'k': int(k),
         'num_unique_centroids': int(len(unique_snapped_centroids)),
+        'reconstruction_mse': reconstruction_mse(vectors, unique_snapped_centroids, codes),
+        'assignment': 'nearest-snapped' if reassign else 'snapped-label',
+        'kmeans_mode': (kmeans_config or KMeansConfig()).mode,
+        'kmeans_cache_hit': bool(cache_hit),
+        'kmeans_time_seconds': float(kmeans_time),
+        'quantization_time_seconds': float(compression_time - kmeans_time),
         'compression_time_seconds': float(compression_time)
     }
     
-    return compressed, info
+    return unique_snapped_centroids, codes, info
 
 
-def compress_boundary_aware(vectors: np.ndarray, grid: float, k: int, random_state: int = 42) -> Tuple[np.ndarray, Dict]:
+def compress_boundary_aware(
+    vectors: np.ndarray,
+    grid: float,
+    k: int,
+    random_state: int = 42,
+    fit_cache: Optional[KMeansFitCache] = None,
+    reassign: bool = False,
+    kmeans_config: Optional[KMeansConfig] = None,
+    lattice: str = 'grid'
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, Dict]:
     """
     Boundary-aware compression: differential treatment for boundary vs bulk.
     
@@ -161,9 +432,16 @@ def compress_boundary_aware(vectors: np.ndarray, grid: float, k: int, random_sta
         grid: grid step size for bulk vectors
         k: number of clusters
         random_state: random seed
+        fit_cache: optional k-means fit cache shared across modes and grids
+        reassign: re-run nearest-centroid search against the snapped centroids
+                  instead of mapping k-means labels through the dedupe inverse
+        kmeans_config: k-means fitting mode (default: full-batch KMeans)
+        lattice: lattice centroids are snapped to (see LATTICES)
     
     Returns:
-        compressed: compressed vectors
+        codebook: (num_codes, n_features) unique bulk and boundary snapped centroids
+        codes: (n_samples,) codebook index per vector
+        boundary_mask: (n_samples,) boolean array of boundary vectors
         info: compression info dict
     """
     start_time = time.time()
@@ -171,74 +449,898 @@ def compress_boundary_aware(vectors: np.ndarray, grid: float, k: int, random_sta
     boundary_step = grid * 0.5  # Finer grid for boundary vectors
     
     # 1. Run KMeans to get initial centroids
-    _, ideal_centroids = run_kmeans(vectors, k, random_state)
+    fit, cache_hit = get_kmeans_fit(vectors, k, random_state, fit_cache, kmeans_config)
+    ideal_centroids = fit.centroids
+    kmeans_time = time.time() - start_time
     
-    # 2. Classify boundary vectors
-    boundary_mask = classify_boundary_vectors(vectors, ideal_centroids, percentile=10.0)
+    # 2. Classify boundary vectors from the fit's top-2 centroid distances
+    if len(ideal_centroids) < 2:
+        boundary_mask = np.zeros(len(vectors), dtype=bool)
+    else:
+        boundary_mask = classify_by_ambiguity(fit.ambiguity_scores, percentile=10.0)
+    threshold = float(np.percentile(fit.ambiguity_scores, 10.0)) if len(ideal_centroids) >= 2 else None
     num_boundary = np.sum(boundary_mask)
     
     # 3. Create two sets of centroids: coarse for bulk, fine for boundary
-    snapped_centroids_bulk = snap_to_grid(ideal_centroids, grid)
-    unique_bulk_centroids = extract_unique_vectors(snapped_centroids_bulk)
+    codebook, bulk_codes, boundary_codes = build_boundary_codebook(ideal_centroids, grid, boundary_step, lattice)
     
-    snapped_centroids_boundary = snap_to_grid(ideal_centroids, boundary_step)
-    unique_boundary_centroids = extract_unique_vectors(snapped_centroids_boundary)
-    
-    # 4. Compress vectors: use appropriate centroids based on classification
-    compressed = np.zeros_like(vectors)
-    
-    # Compress bulk vectors
+    # 4. Encode vectors: bulk by their coarse centroid, boundary by their fine centroid
     bulk_mask = ~boundary_mask
-    if np.sum(bulk_mask) > 0:
-        bulk_vectors = vectors[bulk_mask]
-        distances = np.linalg.norm(bulk_vectors[:, None, :] - unique_bulk_centroids[None, :, :], axis=2)
-        assignments = np.argmin(distances, axis=1)
-        compressed[bulk_mask] = unique_bulk_centroids[assignments]
-    
-    # Compress boundary vectors
-    if np.sum(boundary_mask) > 0:
-        boundary_vectors = vectors[boundary_mask]
-        distances = np.linalg.norm(boundary_vectors[:, None, :] - unique_boundary_centroids[None, :, :], axis=2)
-        assignments = np.argmin(distances, axis=1)
-        compressed[boundary_mask] = unique_boundary_centroids[assignments]
+    if reassign:
+        codes = np.zeros(len(vectors), dtype=np.int64)
+        for mask, candidate_codes in ((bulk_mask, np.unique(bulk_codes)), (boundary_mask, np.unique(boundary_codes))):
+            if np.any(mask):
+                assignments, _ = assign_nearest(vectors[mask], codebook[candidate_codes])
+                codes[mask] = candidate_codes[assignments]
+    else:
+        codes = np.where(boundary_mask, boundary_codes[fit.labels], bulk_codes[fit.labels])
     
     compression_time = time.time() - start_time
     
-    # Combine all unique centroids
-    all_centroids = np.vstack([unique_bulk_centroids, unique_boundary_centroids])
-    unique_all_centroids = extract_unique_vectors(all_centroids)
-    
     info = {
         'mode': 'boundary-aware',
+        'boundary_encoding': 'finer-grid',
         'grid': float(grid),
+        'lattice': lattice,
         'k': int(k),
         'boundary_step': float(boundary_step),
+        'boundary_threshold': threshold,
         'num_boundary_vectors': int(num_boundary),
         'num_bulk_vectors': int(np.sum(bulk_mask)),
-        'num_unique_centroids': int(len(unique_all_centroids)),
+        'num_unique_centroids': int(len(codebook)),
+        'assignment': 'nearest-snapped' if reassign else 'snapped-label',
+        'kmeans_mode': (kmeans_config or KMeansConfig()).mode,
+        'kmeans_cache_hit': bool(cache_hit),
+        'kmeans_time_seconds': float(kmeans_time),
+        'quantization_time_seconds': float(compression_time - kmeans_time),
+        'compression_time_seconds': float(compression_time)
+    }
+    
+    return codebook, codes, boundary_mask, info
+
+
+def encode_residuals(
+    vectors: np.ndarray,
+    codebook: np.ndarray,
+    codes: np.ndarray,
+    rows: np.ndarray,
+    bits: int
+) -> ResidualTable:
+    """
+    Scalar-quantize the residuals of selected passages against their codebook entry.
+    
+    The per-dimension ranges are taken over the selected residuals only, so
+    the levels are spent on the spread that boundary passages actually have.
+    
+    Args:
+        vectors: (n_samples, n_features) array
+        codebook: (num_codes, n_features) codebook
+        codes: (n_samples,) codebook index per vector
+        rows: sorted passage indices that get a residual
+        bits: 8 or 4 bits per residual coordinate
+    
+    Returns:
+        ResidualTable with one packed row per selected passage
+    """
+    residuals = np.asarray(vectors[rows], dtype=np.float32) - np.asarray(codebook, dtype=np.float32)[codes[rows]]
+    if len(rows) > 0:
+        scale, offset = sq_parameters(*dimension_ranges(residuals), bits)
+    else:
+        scale, offset = sq_parameters(np.zeros(vectors.shape[1]), np.zeros(vectors.shape[1]), bits)
+    return ResidualTable(
+        rows=np.asarray(rows, dtype=np.int64),
+        codes=encode_sq(residuals, scale, offset, bits),
+        scale=scale,
+        offset=offset,
+        bits=bits
+    )
+
+
+def compress_boundary_residual(
+    vectors: np.ndarray,
+    grid: float,
+    k: int,
+    random_state: int = 42,
+    fit_cache: Optional[KMeansFitCache] = None,
+    reassign: bool = False,
+    kmeans_config: Optional[KMeansConfig] = None,
+    lattice: str = 'grid',
+    residual_bits: int = 4
+) -> Tuple[np.ndarray, np.ndarray, ResidualTable, Dict]:
+    """
+    Boundary-aware compression with residual-coded boundary vectors.
+    
+    Every passage is coded by its snapped centroid on the baseline codebook;
+    boundary passages (bottom 10% by ambiguity) additionally store a
+    scalar-quantized residual in a sparse side table, so the extra bytes are
+    spent only on them and the codebook does not grow.
+    
+    Args:
+        vectors: (n_samples, n_features) array
+        grid: grid step size
+        k: number of clusters
+        random_state: random seed
+        fit_cache: optional k-means fit cache shared across modes and grids
+        reassign: re-run nearest-centroid search against the snapped centroids
+                  instead of mapping k-means labels through the dedupe inverse
+        kmeans_config: k-means fitting mode (default: full-batch KMeans)
+        lattice: lattice centroids are snapped to (see LATTICES)
+        residual_bits: 8 or 4 bits per residual coordinate
+    
+    Returns:
+        codebook: (num_codes, n_features) unique snapped centroids
+        codes: (n_samples,) codebook index per vector
+        residuals: residual side table for the boundary vectors
+        info: compression info dict
+    """
+    start_time = time.time()
+    
+    # 1. Run KMeans to get initial centroids
+    fit, cache_hit = get_kmeans_fit(vectors, k, random_state, fit_cache, kmeans_config)
+    kmeans_time = time.time() - start_time
+    
+    # 2. Classify boundary vectors from the fit's top-2 centroid distances
+    if len(fit.centroids) < 2:
+        boundary_mask = np.zeros(len(vectors), dtype=bool)
+    else:
+        boundary_mask = classify_by_ambiguity(fit.ambiguity_scores, percentile=10.0)
+    threshold = float(np.percentile(fit.ambiguity_scores, 10.0)) if len(fit.centroids) >= 2 else None
+    boundary_rows = np.flatnonzero(boundary_mask)
+    
+    # 3. One code per vector on the coarse codebook
+    codebook, centroid_codes = snap_and_dedupe(fit.centroids, grid, lattice)
+    if reassign:
+        codes, _ = assign_nearest(vectors, codebook)
+    else:
+        codes = centroid_codes[fit.labels]
+    
+    # 4. Residuals for boundary vectors only
+    residuals = encode_residuals(vectors, codebook, codes, boundary_rows, residual_bits)
+    
+    compression_time = time.time() - start_time
+    
+    info = {
+        'mode': 'boundary-aware',
+        'boundary_encoding': 'residual',
+        'grid': float(grid),
+        'lattice': lattice,
+        'k': int(k),
+        'residual_bits': int(residual_bits),
+        'boundary_threshold': threshold,
+        'num_boundary_vectors': int(len(boundary_rows)),
+        'num_bulk_vectors': int(len(vectors) - len(boundary_rows)),
+        'num_unique_centroids': int(len(codebook)),
+        'assignment': 'nearest-snapped' if reassign else 'snapped-label',
+        'kmeans_mode': (kmeans_config or KMeansConfig()).mode,
+        'kmeans_cache_hit': bool(cache_hit),
+        'kmeans_time_seconds': float(kmeans_time),
+        'quantization_time_seconds': float(compression_time - kmeans_time),
+        'compression_time_seconds': float(compression_time)
+    }
+    
+    return codebook, codes, residuals, info
+
+
+def compress_pq(
+    vectors: np.ndarray,
+    m: int,
+    ksub: int = PQ_MAX_KSUB,
+    random_state: int = 42,
+    train_size: int = 65536
+) -> Tuple[np.ndarray, np.ndarray, Dict]:
+    """
+    Product quantization: m subspace codebooks, one uint8 code per subspace.
+    
+    Args:
+        vectors: (n_samples, n_features) array, possibly memory-mapped
+        m: number of subspaces (bytes per vector)
+        ksub: codebook entries per subspace (at most 256)
+        random_state: random seed
+        train_size: rows sampled to train the codebooks
+    
+    Returns:
+        codebooks: (m, ksub, dsub) subspace codebooks
+        codes: (n_samples, m) uint8 codes
+        info: compression info dict
+    """
+    start_time = time.time()
+    codebooks = train_pq(vectors, m, ksub, random_state, train_size)
+    train_time = time.time() - start_time
+    
+    codes = encode_pq(vectors, codebooks)
+    compression_time = time.time() - start_time
+    
+    info = {
+        'mode': 'pq',
+        'pq_m': int(codebooks.shape[0]),
+        'pq_ksub': int(codebooks.shape[1]),
+        'pq_subspace_dim': int(codebooks.shape[2]),
+        'pq_train_size': int(min(train_size, len(vectors))),
+        'code_bytes_per_vector': int(codes.shape[1]),
+        'reconstruction_mse': pq_reconstruction_mse(vectors, codebooks, codes),
+        'train_time_seconds': float(train_time),
+        'quantization_time_seconds': float(compression_time - train_time),
         'compression_time_seconds': float(compression_time)
     }
     
-    return compressed, info
+    return codebooks, codes, info
 
 
-def save_compressed_embeddings(compressed: np.ndarray, info: Dict, output_dir: Path):
-    """Save compressed embeddings and metadata."""
+def compress_sq(vectors: np.ndarray, bits: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray, Dict]:
+    """
+    Scalar quantization: per-dimension min/max range, packed int8 or int4 levels.
+    
+    Args:
+        vectors: (n_samples, n_features) array, possibly memory-mapped
+        bits: 8 (one byte per dimension) or 4 (two dimensions per byte)
+    
+    Returns:
+        scale: (n_features,) float32 per-dimension scale
+        offset: (n_features,) float32 per-dimension offset
+        codes: (n_samples, packed_dim) uint8 packed levels
+        info: compression info dict
+    """
+    start_time = time.time()
+    mins, maxs = dimension_ranges(vectors)
+    scale, offset = sq_parameters(mins, maxs, bits)
+    range_time = time.time() - start_time
+    
+    codes = encode_sq(vectors, scale, offset, bits)
+    compression_time = time.time() - start_time
+    
+    info = {
+        'mode': f"sq{bits}",
+        'bits': int(bits),
+        'code_bytes_per_vector': int(codes.shape[1]),
+        'reconstruction_mse': sq_reconstruction_mse(vectors, scale, offset, codes, bits),
+        'range_pass_time_seconds': float(range_time),
+        'quantization_time_seconds': float(compression_time - range_time),
+        'compression_time_seconds': float(compression_time)
+    }
+    
+    return scale, offset, codes, info
+
+
+def current_rss_bytes() -> int:
+    """Resident set size of this process in bytes (0 if psutil is unavailable)."""
+    if psutil is None:
+        return 0
+    return int(psutil.Process().memory_info().rss)
+
+
+def compress_out_of_core(
+    embeddings: np.ndarray,
+    baseline_dir: Path,
+    boundary_dir: Path,
+    grid: float,
+    k: int,
+    random_state: int = 42,
+    kmeans_config: Optional[KMeansConfig] = None,
+    chunk_size: int = 65536,
+    reassign: bool = False,
+    percentile: float = 10.0,
+    threshold_sample_size: int = 100000,
+    dtype_policy: Optional[DtypePolicy] = None,
+    report_drift: bool = False,
+    lattice: str = 'grid',
+    centroids_path: Optional[Path] = None,
+    threshold_estimator: str = 'sketch',
+    sketch_workers: int = 1,
+    code_encoding: str = 'array',
+    code_block_size: int = DEFAULT_CODE_BLOCK
+) -> Tuple[Dict, Dict]:
+    """
+    Baseline and boundary-aware compression in one chunked pass over memory-mapped embeddings.
+    
+    Centroids are fitted on a sample or streamed batches. The boundary
+    threshold is the ambiguity percentile read from a quantile sketch of
+    every passage's score, built chunk by chunk (over sketch_workers
+    shards, merged) before encoding; threshold_estimator='sample' instead
+    takes the exact percentile over a random sample, saving that pass.
+    Codes for both modes are then written chunk by chunk into their stores,
+    and the sketch is saved with the boundary store. Peak memory is bounded
+    by chunk_size and the sample sizes, not by corpus size.
+    
+    Args:
+        embeddings: (n_samples, n_features) array, typically memory-mapped
+        baseline_dir: output directory for the baseline store
+        boundary_dir: output directory for the boundary-aware store
+        grid: grid step size for bulk vectors
+        k: number of clusters
+        random_state: random seed
+        kmeans_config: k-means fitting mode (minibatch or sampled)
+        chunk_size: rows encoded per chunk
+        reassign: re-run nearest-centroid search against the snapped centroids
+        percentile: ambiguity percentile for boundary classification
+        threshold_sample_size: passages sampled for threshold_estimator='sample'
+        dtype_policy: dtype the codebooks are stored in (default: float32)
+        report_drift: re-read the stores and record the codebook dtype drift versus float64
+        lattice: lattice centroids are snapped to (see LATTICES)
+        centroids_path: optional .npy path to save the unsnapped centroids to
+        threshold_estimator: 'sketch' (all passages) or 'sample' (see THRESHOLD_ESTIMATORS)
+        sketch_workers: worker processes for the sketch pass
+        code_encoding: how both stores keep their codes (see CODE_ENCODINGS)
+        code_block_size: codes per block for code_encoding='huffman'
+    
+    Returns:
+        info_baseline, info_boundary: compression info dicts
+    """
+    if threshold_estimator not in THRESHOLD_ESTIMATORS:
+        raise ValueError(f"Unknown threshold estimator: {threshold_estimator} (expected one of {THRESHOLD_ESTIMATORS})")
+    if kmeans_config is None or kmeans_config.mode == 'full':
+        raise ValueError("Out-of-core compression needs a minibatch or sampled k-means mode")
+    if dtype_policy is None:
+        dtype_policy = DtypePolicy()
+    
+    n = len(embeddings)
+    boundary_step = grid * 0.5
+    peak_rss = current_rss_bytes()
+    start_time = time.time()
+    
+    # 1. Fit centroids without labelling the corpus
+    k = max(k, 1)
+    if n <= k:
+        ideal_centroids = np.asarray(embeddings)
+    else:
+        ideal_centroids = kmeans_config.fit_centroids(embeddings, k, random_state)
+    kmeans_time = time.time() - start_time
+    if centroids_path is not None:
+        np.save(centroids_path, ideal_centroids)
+    
+    # 2. Boundary threshold from a quantile sketch of the ambiguity scores
+    threshold = None
+    sketch = None
+    threshold_start = time.time()
+    if len(ideal_centroids) >= 2:
+        if threshold_estimator == 'sample':
+            sample = sample_rows(embeddings, threshold_sample_size, random_state)
+            _, sample_top2 = nearest_two(sample, ideal_centroids)
+            sample_scores = sample_top2[:, 1] - sample_top2[:, 0]
+            threshold = float(np.percentile(sample_scores, percentile))
+            sketch = KLLSketch(seed=random_state).update(sample_scores)
+            del sample, sample_top2, sample_scores
+        else:
+            sketch = sketch_ambiguity_sharded(
+                embeddings, ideal_centroids, chunk_size, seed=random_state, workers=sketch_workers
+            )
+            threshold = sketch.quantile(percentile / 100.0)
+    threshold_time = time.time() - threshold_start
+    
+    # 3. Codebooks for both modes
+    baseline_codebook, baseline_centroid_codes = snap_and_dedupe(ideal_centroids, grid, lattice)
+    boundary_codebook, bulk_codes, boundary_codes = build_boundary_codebook(
+        ideal_centroids, grid, boundary_step, lattice
+    )
+    
+    baseline_writer = CompressedStoreWriter(
+        baseline_dir, dtype_policy.to_storage(baseline_codebook), n,
+        code_encoding=code_encoding, code_block_size=code_block_size
+    )
+    boundary_writer = CompressedStoreWriter(
+        boundary_dir, dtype_policy.to_storage(boundary_codebook), n, has_boundary_mask=True,
+        code_encoding=code_encoding, code_block_size=code_block_size
+    )
+    prep_time = time.time() - start_time - kmeans_time - threshold_time
+    
+    # 4. One pass: label each chunk once, then encode it for both modes
+    label_time = 0.0
+    baseline_time = 0.0
+    boundary_time = 0.0
+    num_boundary = 0
+    
+    for chunk_start in tqdm(range(0, n, chunk_size), desc="Encoding chunks"):
+        step_time = time.time()
+        chunk = np.asarray(embeddings[chunk_start:chunk_start + chunk_size])
+        if threshold is None:
+            labels, _ = assign_nearest(chunk, ideal_centroids)
+            chunk_boundary = np.zeros(len(chunk), dtype=bool)
+            boundary_chunk_codes = bulk_codes[labels]
+        else:
+            # Labels, boundary flags and boundary-aware codes in one fused pass
+            labels, _, chunk_boundary, boundary_chunk_codes = boundary_assign(
+                chunk, ideal_centroids, threshold, bulk_codes, boundary_codes,
+                boundary_codebook if reassign else None
+            )
+        label_time += time.time() - step_time
+        
+        step_time = time.time()
+        if reassign:
+            codes, _ = assign_nearest(chunk, baseline_codebook)
+        else:
+            codes = baseline_centroid_codes[labels]
+        baseline_writer.write(chunk_start, codes)
+        baseline_time += time.time() - step_time
+        
+        step_time = time.time()
+        boundary_writer.write(chunk_start, boundary_chunk_codes, chunk_boundary)
+        boundary_time += time.time() - step_time
+        
+        num_boundary += int(np.sum(chunk_boundary))
+        peak_rss = max(peak_rss, current_rss_bytes())
+    
+    baseline_header = baseline_writer.close()
+    boundary_header = boundary_writer.close(ambiguity_sketch=sketch)
+    
+    # The fused labelling pass and codebook preparation are shared; split them evenly
+    shared_time = label_time + prep_time
+    common = {
+        'grid': float(grid),
+        'lattice': lattice,
+        'k': int(k),
+        'assignment': 'nearest-snapped' if reassign else 'snapped-label',
+        'kmeans_mode': kmeans_config.mode,
+        'dtype': dtype_policy.name,
+        'out_of_core': True,
+        'chunk_size': int(chunk_size),
+        'peak_rss_bytes': int(peak_rss)
+    }
+    info_baseline = dict(common, **{
+        'mode': 'baseline',
+        'num_unique_centroids': int(len(baseline_codebook)),
+        'reconstruction_mse': reconstruction_mse(embeddings, baseline_codebook, open_compressed_store(baseline_dir).codes),
+        'kmeans_time_seconds': float(kmeans_time),
+        'quantization_time_seconds': float(shared_time / 2 + baseline_time),
+        'compression_time_seconds': float(kmeans_time + shared_time / 2 + baseline_time),
+        **code_stream_info(baseline_header),
+        'store_bytes': baseline_header['store_bytes'],
+        'bytes_per_vector': baseline_header['bytes_per_vector'],
+        'compression_ratio_vs_float32': baseline_header['compression_ratio_vs_float32']
+    })
+    info_boundary = dict(common, **{
+        'mode': 'boundary-aware',
+        'boundary_encoding': 'finer-grid',
+        'boundary_step': float(boundary_step),
+        'boundary_threshold': threshold,
+        'boundary_threshold_estimator': threshold_estimator,
+        'boundary_threshold_passages': int(min(n, threshold_sample_size) if threshold_estimator == 'sample' else n),
+        'boundary_threshold_time_seconds': float(threshold_time),
+        'ambiguity_sketch_items': sketch.num_retained if sketch is not None else 0,
+        'num_boundary_vectors': int(num_boundary),
+        'num_bulk_vectors': int(n - num_boundary),
+        'num_unique_centroids': int(len(boundary_codebook)),
+        'kmeans_time_seconds': 0.0,
+        'quantization_time_seconds': float(shared_time / 2 + boundary_time + threshold_time),
+        'compression_time_seconds': float(shared_time / 2 + boundary_time + threshold_time),
+        **code_stream_info(boundary_header),
+        'store_bytes': boundary_header['store_bytes'],
+        'bytes_per_vector': boundary_header['bytes_per_vector'],
+        'compression_ratio_vs_float32': boundary_header['compression_ratio_vs_float32']
+    })
+    
+    for info, mode_dir, codebook in (
+        (info_baseline, baseline_dir, baseline_codebook),
+        (info_boundary, boundary_dir, boundary_codebook)
+    ):
+        if report_drift:
+            codes = open_compressed_store(mode_dir).codes
+            info['dtype_drift'] = codebook_drift(embeddings, codebook, codes, dtype_policy)
+        with open(mode_dir / 'compression_info.json', 'w') as f:
+            json.dump(info, f, indent=2)
+    
+    return info_baseline, info_boundary
+
+
+def code_stream_info(header: Dict) -> Dict:
+    """Code stream fields of a codebook store header for compression_info.json."""
+    return {
+        'code_encoding': header['code_encoding'],
+        'code_bits_per_vector': header['code_bits_per_vector'],
+        'code_entropy_bits_per_vector': header['code_entropy_bits_per_vector']
+    }
+
+
+def save_compressed_embeddings(
+    codebook: np.ndarray,
+    codes: np.ndarray,
+    boundary_mask: Optional[np.ndarray],
+    info: Dict,
+    output_dir: Path,
+    verbose: bool = True,
+    dtype_policy: Optional[DtypePolicy] = None,
+    drift_vectors: Optional[np.ndarray] = None,
+    residuals: Optional[ResidualTable] = None,
+    ambiguity_sketch: Optional[KLLSketch] = None,
+    code_encoding: str = 'array',
+    code_block_size: int = DEFAULT_CODE_BLOCK
+):
+    """
+    Save compressed embeddings as a codebook + codes store, plus metadata.
+    
+    The codebook is stored in the dtype policy's storage dtype. When
+    drift_vectors (the original embeddings) are given, the reconstruction
+    MSE drift of that storage dtype versus float64 is added to info.
+    residuals, if given, are stored as the store's sparse side table, and
+    ambiguity_sketch alongside the codebook for later appends. Codes are
+    kept as a code array or code stream according to code_encoding.
+    """
     output_dir.mkdir(parents=True, exist_ok=True)
+    if dtype_policy is None:
+        dtype_policy = DtypePolicy()
+    
+    info['dtype'] = dtype_policy.name
+    if drift_vectors is not None:
+        info['dtype_drift'] = codebook_drift(drift_vectors, codebook, codes, dtype_policy)
     
-    # Save compressed embeddings
-    compressed_path = output_dir / 'compressed_passages.npy'
-    np.save(compressed_path, compressed)
+    # Save compressed store
+    header = save_compressed_store(
+        output_dir, dtype_policy.to_storage(codebook), codes, boundary_mask, residuals=residuals,
+        ambiguity_sketch=ambiguity_sketch, code_encoding=code_encoding, code_block_size=code_block_size
+    )
+    info['store_bytes'] = header['store_bytes']
+    info['bytes_per_vector'] = header['bytes_per_vector']
+    info['code_bytes_per_vector'] = header['code_bytes_per_vector']
+    info.update(code_stream_info(header))
+    if residuals is not None:
+        info['residual_bytes_per_row'] = header['residual_bytes_per_row']
+        info['residual_bytes_per_vector'] = header['residual_bytes_per_vector']
+    if ambiguity_sketch is not None:
+        info['ambiguity_sketch_items'] = header['ambiguity_sketch_items']
+    info['compression_ratio_vs_float32'] = header['compression_ratio_vs_float32']
     
     # Save info
     info_path = output_dir / 'compression_info.json'
     with open(info_path, 'w') as f:
         json.dump(info, f, indent=2)
     
-    print(f"✓ Saved compressed embeddings to {compressed_path}")
+    if verbose:
+        print(f"✓ Saved compressed store to {output_dir} ({header['num_codes']} codes, {header['code_dtype']}, {header['store_bytes']:,} bytes)")
+        print(f"  - {header['bytes_per_vector']:.2f} bytes/vector ({header['code_bits_per_vector']:.2f} code bits "
+              f"as {header['code_encoding']}, entropy {header['code_entropy_bits_per_vector']:.2f}"
+              + (f" + {header['residual_bytes_per_vector']:.2f} residual bytes, {header['num_residuals']} residual rows "
+                 f"of {header['residual_bytes_per_row']} bytes" if residuals is not None else "") + ")")
+        print(f"✓ Saved compression info to {info_path}")
+        if 'dtype_drift' in info:
+            drift = info['dtype_drift']
+            print(f"  - {drift['dtype']} codebook MSE drift vs float64: {drift['mse_abs_diff']:.3e} "
+                  f"({drift['mse_rel_diff']:.2e} relative)")
+
+
+def save_pq_embeddings(
+    codebooks: np.ndarray,
+    codes: np.ndarray,
+    info: Dict,
+    output_dir: Path,
+    dim: int,
+    dtype_policy: Optional[DtypePolicy] = None,
+    drift_vectors: Optional[np.ndarray] = None
+):
+    """
+    Save product-quantized embeddings as a PQ store, plus metadata.
+    
+    Codebooks are stored in the dtype policy's storage dtype, as in
+    save_compressed_embeddings.
+    """
+    output_dir.mkdir(parents=True, exist_ok=True)
+    if dtype_policy is None:
+        dtype_policy = DtypePolicy()
+    
+    info['dtype'] = dtype_policy.name
+    if drift_vectors is not None:
+        info['dtype_drift'] = codebook_drift(drift_vectors, codebooks, codes, dtype_policy, pq_reconstruction_mse)
+    
+    header = save_pq_store(output_dir, dtype_policy.to_storage(codebooks), codes, dim)
+    info['store_bytes'] = header['store_bytes']
+    info['bytes_per_vector'] = header['bytes_per_vector']
+    info['compression_ratio_vs_float32'] = header['compression_ratio_vs_float32']
+    
+    info_path = output_dir / 'compression_info.json'
+    with open(info_path, 'w') as f:
+        json.dump(info, f, indent=2)
+    
+    print(f"✓ Saved PQ store to {output_dir} ({header['num_subspaces']}x{header['ksub']} codebooks, "
+          f"{header['code_bytes_per_vector']} bytes/vector, {header['store_bytes']:,} bytes)")
+    print(f"✓ Saved compression info to {info_path}")
+    if 'dtype_drift' in info:
+        drift = info['dtype_drift']
+        print(f"  - {drift['dtype']} codebook MSE drift vs float64: {drift['mse_abs_diff']:.3e} "
+              f"({drift['mse_rel_diff']:.2e} relative)")
+
+
+def save_sq_embeddings(
+    scale: np.ndarray,
+    offset: np.ndarray,
+    codes: np.ndarray,
+    info: Dict,
+    output_dir: Path,
+    dim: int
+):
+    """Save scalar-quantized embeddings (packed levels + scale/offset), plus metadata."""
+    header = save_sq_store(output_dir, scale, offset, codes, info['bits'], dim)
+    info['store_bytes'] = header['store_bytes']
+    info['bytes_per_vector'] = header['bytes_per_vector']
+    info['compression_ratio_vs_float32'] = header['compression_ratio_vs_float32']
+    
+    info_path = output_dir / 'compression_info.json'
+    with open(info_path, 'w') as f:
+        json.dump(info, f, indent=2)
+    
+    print(f"✓ Saved SQ store to {output_dir} ({header['bits']}-bit, {header['code_bytes_per_vector']} bytes/vector, "
+          f"{header['store_bytes']:,} bytes)")
     print(f"✓ Saved compression info to {info_path}")
 
 
+def sweep_values(value_range: List[float], dtype=float) -> List:
+    """Evenly spaced sweep values from a [min, max, steps] range."""
+    low, high, steps = value_range
+    values = np.linspace(low, high, int(steps))
+    if dtype is int:
+        return sorted(set(int(round(v)) for v in values))
+    # Round off linspace noise (0.15000000000000002) so values match their directory names
+    return [float(round(v, 10)) for v in values]
+
+
+def config_dir_name(grid: float, k: int) -> str:
+    """Output directory name for one (grid, k) sweep config."""
+    return f"grid{grid:g}_k{k}"
+
+
+# Per-worker sweep state, set by _init_sweep_worker
+_SWEEP_STATE: Dict = {}
+
+
+def _init_sweep_worker(
+    shm_name: str,
+    shape: Tuple[int, ...],
+    dtype: str,
+    kmeans_config: KMeansConfig,
+    cache_dir: Optional[str],
+    max_disk_bytes: Optional[int],
+    blas_threads: int,
+    dtype_policy: DtypePolicy,
+    report_drift: bool,
+    lattice: str,
+    boundary_encoding: str = 'finer-grid',
+    residual_bits: int = 4,
+    code_encoding: str = 'array',
+    code_block_size: int = DEFAULT_CODE_BLOCK
+):
+    """Attach a sweep worker to the shared embeddings and set up its fit cache."""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    _SWEEP_STATE['shm'] = shm
+    _SWEEP_STATE['embeddings'] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+    _SWEEP_STATE['kmeans_config'] = kmeans_config
+    _SWEEP_STATE['dtype_policy'] = dtype_policy
+    _SWEEP_STATE['report_drift'] = report_drift
+    _SWEEP_STATE['lattice'] = lattice
+    _SWEEP_STATE['boundary_encoding'] = boundary_encoding
+    _SWEEP_STATE['residual_bits'] = residual_bits
+    _SWEEP_STATE['code_encoding'] = code_encoding
+    _SWEEP_STATE['code_block_size'] = code_block_size
+    _SWEEP_STATE['fit_cache'] = KMeansFitCache(
+        cache_dir=Path(cache_dir) if cache_dir else None,
+        max_disk_bytes=max_disk_bytes
+    )
+    # Keep workers x BLAS threads within the machine
+    if threadpool_limits is not None:
+        _SWEEP_STATE['threadpool_limits'] = threadpool_limits(limits=blas_threads)
+
+
+def _run_sweep_task(
+    k: int,
+    grids: List[float],
+    seed: int,
+    reassign: bool,
+    output_dir: str,
+    warm_fit: Optional[Tuple[np.ndarray, np.ndarray]] = None
+) -> List[Dict]:
+    """Compress every grid value for one k in a sweep worker (one k-means fit, reused across grids)."""
+    embeddings = _SWEEP_STATE['embeddings']
+    fit_cache = _SWEEP_STATE['fit_cache']
+    kmeans_config = _SWEEP_STATE['kmeans_config']
+    dtype_policy = _SWEEP_STATE['dtype_policy']
+    drift_vectors = embeddings if _SWEEP_STATE['report_drift'] else None
+    lattice = _SWEEP_STATE['lattice']
+    code_stream = {'code_encoding': _SWEEP_STATE['code_encoding'], 'code_block_size': _SWEEP_STATE['code_block_size']}
+    
+    if warm_fit is not None:
+        fit_cache.put(embeddings, k, seed, warm_fit[0], warm_fit[1], kmeans_config.cache_method)
+    
+    results = []
+    for grid in grids:
+        config_dir = Path(output_dir) / config_dir_name(grid, k)
+        
+        codebook, codes, info_baseline = compress_baseline(
+            embeddings, grid, k, seed, fit_cache, reassign, kmeans_config, lattice
+        )
+        save_compressed_embeddings(
+            codebook, codes, None, info_baseline, config_dir / 'baseline',
+            verbose=False, dtype_policy=dtype_policy, drift_vectors=drift_vectors, **code_stream
+        )
+        
+        residuals = None
+        # Unsnapped centroids per config, as in a single run, for msmarco_append.py and --scorer ivf
+        fit, _ = get_kmeans_fit(embeddings, k, seed, fit_cache, kmeans_config)
+        np.save(config_dir / CENTROIDS_FILENAME, fit.centroids)
+        sketch = KLLSketch(seed=seed).update(fit.ambiguity_scores) if len(fit.centroids) >= 2 else None
+        if _SWEEP_STATE['boundary_encoding'] == 'residual':
+            codebook, codes, residuals, info_boundary = compress_boundary_residual(
+                embeddings, grid, k, seed, fit_cache, reassign, kmeans_config, lattice,
+                _SWEEP_STATE['residual_bits']
+            )
+            boundary_mask = None
+        else:
+            codebook, codes, boundary_mask, info_boundary = compress_boundary_aware(
+                embeddings, grid, k, seed, fit_cache, reassign, kmeans_config, lattice
+            )
+        save_compressed_embeddings(
+            codebook, codes, boundary_mask, info_boundary, config_dir / 'boundary',
+            verbose=False, dtype_policy=dtype_policy, drift_vectors=drift_vectors, residuals=residuals,
+            ambiguity_sketch=sketch, **code_stream
+        )
+        
+        run_config = {
+            'mode': 'lattice',
+            'grid': float(grid),
+            'lattice': lattice,
+            'boundary_encoding': _SWEEP_STATE['boundary_encoding'],
+            'code_encoding': code_stream['code_encoding'],
+            'code_block_size': int(code_stream['code_block_size']),
+            'k': int(k),
+            'seed': int(seed),
+            'num_passages': int(embeddings.shape[0]),
+            'embedding_dim': int(embeddings.shape[1]),
+            'baseline': info_baseline,
+            'boundary': info_boundary,
+            'kmeans_mode': kmeans_config.mode,
+            'kmeans_batch_size': int(kmeans_config.batch_size),
+            'kmeans_epochs': int(kmeans_config.max_epochs),
+            'kmeans_sample_size': int(kmeans_config.sample_size),
+            'out_of_core': False,
+            'dtype': dtype_policy.name,
+            'append_reference': {
+                'num_passages': int(embeddings.shape[0]),
+                'centroids_file': CENTROIDS_FILENAME,
+                'reconstruction_mse': info_baseline['reconstruction_mse'],
+                'boundary_threshold': info_boundary['boundary_threshold'],
+                'boundary_fraction': float(info_boundary['num_boundary_vectors'] / max(1, embeddings.shape[0]))
+            }
+        }
+        if kmeans_config.mode == 'hierarchical':
+            run_config['kmeans_branching'] = int(kmeans_config.branching)
+            run_config['kmeans_exact_assignment'] = bool(kmeans_config.exact_assignment)
+        with open(config_dir / 'run_config.json', 'w') as f:
+            json.dump(run_config, f, indent=2)
+        
+        results.append({
+            'grid': float(grid),
+            'k': int(k),
+            'output_dir': config_dir.name,
+            'worker_pid': os.getpid(),
+            'baseline': info_baseline,
+            'boundary': info_boundary
+        })
+    
+    return results
+
+
+def run_sweep(
+    embeddings: np.ndarray,
+    grid_values: List[float],
+    k_values: List[int],
+    seed: int,
+    output_dir: Path,
+    kmeans_config: KMeansConfig,
+    workers: int,
+    reassign: bool = False,
+    cache_dir: Optional[Path] = None,
+    max_disk_bytes: Optional[int] = None,
+    compare_cold: bool = False,
+    dtype_policy: Optional[DtypePolicy] = None,
+    report_drift: bool = False,
+    lattice: str = 'grid',
+    boundary_encoding: str = 'finer-grid',
+    residual_bits: int = 4,
+    code_encoding: str = 'array',
+    code_block_size: int = DEFAULT_CODE_BLOCK
+) -> Dict:
+    """
+    Compress every (grid, k) pair over a process pool.
+    
+    Embeddings are copied once into shared memory and every worker maps the
+    same block. Work is split per k value, so each worker fits k-means once
+    per k and reuses the fit for all grid values. With
+    kmeans_config.warm_start, the whole k ladder is fitted up front
+    (each k warm-started from the one below) and handed to the workers.
+    
+    Args:
+        embeddings: (n_samples, n_features) array (may be memory-mapped)
+        grid_values: grid step sizes to sweep
+        k_values: cluster counts to sweep
+        seed: random seed
+        output_dir: sweep output directory (one subdirectory per config)
+        kmeans_config: k-means fitting mode
+        workers: number of worker processes
+        reassign: re-run nearest-centroid search against the snapped centroids
+        cache_dir: optional on-disk k-means fit cache shared by the workers
+        max_disk_bytes: size bound of the on-disk fit cache
+        compare_cold: with warm_start, also refit every k from scratch and
+                      report the inertia ratio
+        dtype_policy: dtype the shared embeddings are computed in and codebooks stored in
+        report_drift: record each config's codebook dtype drift versus float64
+        lattice: lattice centroids are snapped to (see LATTICES)
+        boundary_encoding: how boundary passages are coded (see BOUNDARY_ENCODINGS)
+        residual_bits: bits per residual coordinate for the residual encoding
+        code_encoding: how the stores keep their codes (see CODE_ENCODINGS)
+        code_block_size: codes per block for code_encoding='huffman'
+    
+    Returns:
+        sweep manifest dict (also written to output_dir/sweep_manifest.json)
+    """
+    output_dir.mkdir(parents=True, exist_ok=True)
+    workers = max(1, min(int(workers), len(k_values)))
+    blas_threads = max(1, (os.cpu_count() or 1) // workers)
+    start_time = time.time()
+    if dtype_policy is None:
+        dtype_policy = DtypePolicy()
+    
+    shared_dtype = dtype_policy.compute
+    shm = shared_memory.SharedMemory(create=True, size=max(1, embeddings.shape[0] * embeddings.shape[1] * shared_dtype.itemsize))
+    try:
+        shared = np.ndarray(embeddings.shape, dtype=shared_dtype, buffer=shm.buf)
+        # Copy in blocks so a dtype cast never materializes a second full matrix
+        for block_start in range(0, len(embeddings), 65536):
+            shared[block_start:block_start + 65536] = dtype_policy.to_compute(embeddings[block_start:block_start + 65536])
+        
+        warm_fits = {}
+        if kmeans_config.warm_start:
+            cold_config = KMeansConfig(mode=kmeans_config.mode)
+            
+            def cold_fit(vectors: np.ndarray, k: int, fit_seed: int) -> Tuple[np.ndarray, np.ndarray]:
+                return fit_kmeans(vectors, k, fit_seed, cold_config)
+            
+            warm_fits, ladder_report = kmeans_ladder(shared, k_values, seed, fit_fn=cold_fit)
+            ladder = {'rungs': ladder_report, 'ladder_time_seconds': float(sum(r['time_seconds'] for r in ladder_report))}
+            if compare_cold:
+                ladder = compare_ladder_to_cold(shared, ladder_report, seed, fit_fn=cold_fit)
+        
+        configs = []
+        initargs = (
+            shm.name, embeddings.shape, shared_dtype.str, kmeans_config,
+            str(cache_dir) if cache_dir else None, max_disk_bytes, blas_threads,
+            dtype_policy, report_drift, lattice, boundary_encoding, residual_bits, code_encoding, code_block_size
+        )
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_sweep_worker, initargs=initargs) as pool:
+            # Largest k first: those fits take longest
+            futures = [
+                pool.submit(_run_sweep_task, int(k), grid_values, seed, reassign, str(output_dir), warm_fits.get(int(k)))
+                for k in sorted(k_values, reverse=True)
+            ]
+            for future in tqdm(as_completed(futures), total=len(futures), desc="Sweeping k values"):
+                configs.extend(future.result())
+        
+        del shared
+    finally:
+        shm.close()
+        shm.unlink()
+    
+    configs.sort(key=lambda c: (c['grid'], c['k']))
+    
+    manifest = {
+        'grid_values': [float(g) for g in grid_values],
+        'lattice': lattice,
+        'boundary_encoding': boundary_encoding,
+        'k_values': [int(k) for k in k_values],
+        'seed': int(seed),
+        'workers': workers,
+        'blas_threads_per_worker': blas_threads if threadpool_limits is not None else None,
+        'num_passages': int(embeddings.shape[0]),
+        'embedding_dim': int(embeddings.shape[1]),
+        'kmeans_mode': kmeans_config.mode,
+        'assignment': 'nearest-snapped' if reassign else 'snapped-label',
+        'kmeans_warm_start': bool(kmeans_config.warm_start),
+        'dtype': dtype_policy.name,
+        'wall_time_seconds': float(time.time() - start_time),
+        'configs': configs
+    }
+    if kmeans_config.warm_start:
+        manifest['kmeans_ladder'] = ladder
+    
+    with open(output_dir / 'sweep_manifest.json', 'w') as f:
+        json.dump(manifest, f, indent=2)
+    
+    return manifest
+
+
 def main():
     parser = argparse.ArgumentParser(
         description='Run compression on MS MARCO embeddings'
@@ -253,12 +1355,57 @@ def main():
         default='results/msmarco',
         help='Output directory for compressed embeddings'
     )
+    parser.add_argument(
+        '--mode',
+        choices=['lattice', 'pq'] + list(SQ_BITS),
+        default='lattice',
+        help='Compression scheme: lattice-hybrid baseline + boundary-aware, product quantization, '
+             'or packed int8/int4 scalar quantization (default: lattice)'
+    )
+    parser.add_argument(
+        '--pq-m',
+        type=int,
+        default=8,
+        help='Subspaces for --mode pq, i.e. bytes per passage (default: 8)'
+    )
+    parser.add_argument(
+        '--pq-ksub',
+        type=int,
+        default=PQ_MAX_KSUB,
+        help=f'Codebook entries per subspace for --mode pq, at most {PQ_MAX_KSUB} (default: {PQ_MAX_KSUB})'
+    )
+    parser.add_argument(
+        '--pq-train-size',
+        type=int,
+        default=65536,
+        help='Passages sampled to train the PQ codebooks (default: 65536)'
+    )
     parser.add_argument(
         '--grid',
         type=float,
         default=0.1,
         help='Grid step size for compression (default: 0.1)'
     )
+    parser.add_argument(
+        '--lattice',
+        choices=LATTICES,
+        default='grid',
+        help='Lattice k-means centroids are snapped to, at the point density of --grid (default: grid)'
+    )
+    parser.add_argument(
+        '--boundary-encoding',
+        choices=BOUNDARY_ENCODINGS,
+        default='finer-grid',
+        help='Boundary passages: centroid snapped to grid / 2, or a quantized residual in a sparse '
+             'side table (default: finer-grid)'
+    )
+    parser.add_argument(
+        '--residual-bits',
+        type=int,
+        choices=RESIDUAL_BITS,
+        default=4,
+        help='Bits per residual coordinate for --boundary-encoding residual (default: 4)'
+    )
     parser.add_argument(
         '--k',
         type=int,
@@ -271,9 +1418,155 @@ def main():
         default=42,
         help='Random seed (default: 42)'
     )
+    parser.add_argument(
+        '--reassign-after-snap',
+        action='store_true',
+        help='Re-run nearest-centroid search after snapping instead of coding by k-means label'
+    )
+    parser.add_argument(
+        '--kmeans-mode',
+        choices=KMEANS_MODES,
+        default='full',
+        help='K-means fitting mode: full batch, streamed mini-batches, or a random sample (default: full)'
+    )
+    parser.add_argument(
+        '--kmeans-batch-size',
+        type=int,
+        default=4096,
+        help='Rows per streamed batch for --kmeans-mode minibatch (default: 4096)'
+    )
+    parser.add_argument(
+        '--kmeans-epochs',
+        type=int,
+        default=3,
+        help='Maximum passes over the data for --kmeans-mode minibatch (default: 3)'
+    )
+    parser.add_argument(
+        '--kmeans-sample-size',
+        type=int,
+        default=100000,
+        help='Rows sampled for --kmeans-mode sampled (default: 100000)'
+    )
+    parser.add_argument(
+        '--kmeans-branching',
+        type=int,
+        default=DEFAULT_BRANCHING,
+        help=f'Maximum children per tree node for --kmeans-mode hierarchical (default: {DEFAULT_BRANCHING})'
+    )
+    parser.add_argument(
+        '--kmeans-exact-assignment',
+        action='store_true',
+        help='With --kmeans-mode hierarchical, label passages by exact search over all leaves instead of tree descent'
+    )
+    parser.add_argument(
+        '--compare-full-inertia',
+        action='store_true',
+        help='Also fit full k-means and report the inertia of the chosen mode relative to it'
+    )
+    parser.add_argument(
+        '--out-of-core',
+        action='store_true',
+        help='Memory-map the embeddings and encode them chunk by chunk (uses --kmeans-mode sampled unless minibatch is given)'
+    )
+    parser.add_argument(
+        '--chunk-size',
+        type=int,
+        default=65536,
+        help='Passages encoded per chunk in --out-of-core mode (default: 65536)'
+    )
+    parser.add_argument(
+        '--threshold-estimator',
+        choices=THRESHOLD_ESTIMATORS,
+        default='sketch',
+        help='Boundary threshold in --out-of-core mode: quantile sketch over all passages (sharded over --workers), '
+             'or exact percentile over --kmeans-sample-size sampled passages (default: sketch)'
+    )
+    parser.add_argument(
+        '--code-encoding',
+        choices=CODE_ENCODINGS,
+        default='array',
+        help='How lattice stores keep their codes: one integer per passage, ceil(log2 K)-bit packed, '
+             'or Huffman coded over the code frequencies (default: array)'
+    )
+    parser.add_argument(
+        '--code-block-size',
+        type=int,
+        default=DEFAULT_CODE_BLOCK,
+        help=f'Codes per independently decodable block for --code-encoding huffman (default: {DEFAULT_CODE_BLOCK})'
+    )
+    parser.add_argument(
+        '--grid-range',
+        type=float,
+        nargs=3,
+        metavar=('MIN', 'MAX', 'STEPS'),
+        default=None,
+        help='Sweep grid step sizes over linspace(MIN, MAX, STEPS) instead of a single --grid'
+    )
+    parser.add_argument(
+        '--k-range',
+        type=float,
+        nargs=3,
+        metavar=('MIN', 'MAX', 'STEPS'),
+        default=None,
+        help='Sweep cluster counts over linspace(MIN, MAX, STEPS) instead of a single --k'
+    )
+    parser.add_argument(
+        '--kmeans-warm-start',
+        action='store_true',
+        help='In a --k-range sweep, warm-start each k from the next smaller one by splitting its highest-inertia clusters'
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=os.cpu_count() or 1,
+        help='Worker processes for a --grid-range/--k-range sweep or the --out-of-core sketch pass (default: CPU count)'
+    )
+    parser.add_argument(
+        '--dtype',
+        choices=DTYPE_CHOICES,
+        default=DEFAULT_DTYPE,
+        help='Floating point policy: float32, float16 codebook storage (float32 compute) or float64 (default: float32)'
+    )
+    parser.add_argument(
+        '--report-dtype-drift',
+        action='store_true',
+        help='Record the reconstruction MSE drift of the --dtype codebook versus float64'
+    )
+    parser.add_argument(
+        '--kmeans-cache-dir',
+        default=None,
+        help='Directory for persisting k-means fits across runs (default: in-memory only)'
+    )
+    parser.add_argument(
+        '--kmeans-cache-max-mb',
+        type=float,
+        default=2048.0,
+        help='Maximum on-disk size of the k-means fit cache in MB (default: 2048)'
+    )
     
     args = parser.parse_args()
     
+    sweep = args.grid_range is not None or args.k_range is not None
+    if sweep and args.out_of_core:
+        parser.error('--out-of-core cannot be combined with --grid-range/--k-range')
+    if args.out_of_core and args.kmeans_mode == 'hierarchical':
+        parser.error('--kmeans-mode hierarchical is not supported with --out-of-core')
+    if args.kmeans_branching < 2:
+        parser.error('--kmeans-branching must be at least 2')
+    if args.out_of_core and args.boundary_encoding == 'residual':
+        parser.error('--boundary-encoding residual is not supported with --out-of-core')
+    if sweep and args.mode != 'lattice':
+        parser.error(f'--mode {args.mode} cannot be combined with --grid-range/--k-range')
+    if not 1 <= args.pq_ksub <= PQ_MAX_KSUB:
+        parser.error(f'--pq-ksub must be between 1 and {PQ_MAX_KSUB}')
+    if args.kmeans_warm_start and (args.k_range is None or args.kmeans_mode != 'full'):
+        parser.error('--kmeans-warm-start needs --k-range and --kmeans-mode full')
+    if args.code_block_size < 1:
+        parser.error('--code-block-size must be at least 1')
+    
+    if args.out_of_core and args.kmeans_mode == 'full':
+        args.kmeans_mode = 'sampled'
+    
     input_dir = Path(args.input_dir)
     output_dir = Path(args.output_dir)
     
@@ -283,9 +1576,36 @@ def main():
     print(f"\nConfiguration:")
     print(f"  - Input: {input_dir}")
     print(f"  - Output: {output_dir}")
-    print(f"  - Grid step: {args.grid}")
-    print(f"  - K clusters: {args.k}")
+    print(f"  - Mode: {args.mode}")
+    if args.mode == 'pq':
+        print(f"  - PQ: m={args.pq_m}, ksub={args.pq_ksub}, train size {args.pq_train_size}")
+    elif args.mode in SQ_BITS:
+        print(f"  - SQ: {SQ_BITS[args.mode]} bits per dimension")
+    elif sweep:
+        grid_values = sweep_values(args.grid_range) if args.grid_range else [args.grid]
+        k_values = sweep_values(args.k_range, dtype=int) if args.k_range else [args.k]
+        print(f"  - Grid steps: {', '.join(f'{g:g}' for g in grid_values)}")
+        print(f"  - K clusters: {', '.join(str(k) for k in k_values)}")
+        print(f"  - Lattice: {args.lattice}")
+        print(f"  - Workers: {args.workers}")
+    else:
+        print(f"  - Grid step: {args.grid}")
+        print(f"  - Lattice: {args.lattice}")
+        print(f"  - K clusters: {args.k}")
+        print(f"  - Boundary encoding: {args.boundary_encoding}"
+              + (f" ({args.residual_bits}-bit residuals)" if args.boundary_encoding == 'residual' else ""))
     print(f"  - Seed: {args.seed}")
+    if args.mode == 'lattice':
+        print(f"  - K-means mode: {args.kmeans_mode}"
+              + (f" (branching {args.kmeans_branching}, "
+                 f"{'exact' if args.kmeans_exact_assignment else 'tree'} assignment)"
+                 if args.kmeans_mode == 'hierarchical' else ""))
+        print(f"  - Code encoding: {args.code_encoding}"
+              + (f" (blocks of {args.code_block_size})" if args.code_encoding == 'huffman' else ""))
+    print(f"  - Dtype: {args.dtype}")
+    if args.out_of_core:
+        print(f"  - Out-of-core: chunk size {args.chunk_size}")
+    print(f"  - K-means cache: {args.kmeans_cache_dir or 'in-memory'}")
     print("\nNO SIMULATION. REAL COMPRESSION.")
     print("="*80)
     
@@ -295,53 +1615,261 @@ def main():
         if not embeddings_path.exists():
             raise FileNotFoundError(f"Embeddings not found: {embeddings_path}")
         
-        print(f"\nLoading embeddings from {embeddings_path}...")
-        embeddings = np.load(embeddings_path)
-        print(f"✓ Loaded embeddings: shape {embeddings.shape}")
+        # Streaming and out-of-core modes read batches straight from the file;
+        # a sweep copies the file straight into shared memory
+        if args.mode != 'lattice':
+            mmap_mode = 'r' if args.out_of_core else None
+        else:
+            mmap_mode = None if args.kmeans_mode == 'full' and not sweep else 'r'
+        print(f"\nLoading embeddings from {embeddings_path}{' (memory-mapped)' if mmap_mode else ''}...")
+        embeddings = np.load(embeddings_path, mmap_mode=mmap_mode)
+        dtype_policy = DtypePolicy(args.dtype)
+        # Memory-mapped reads (k-means batches, encode chunks, sketch shards) are cast one read at a time
+        embeddings = dtype_policy.to_compute(embeddings) if mmap_mode is None else dtype_policy.view(embeddings)
+        print(f"✓ Loaded embeddings: shape {embeddings.shape}, {embeddings.dtype}")
+        drift_vectors = embeddings if args.report_dtype_drift else None
         
-        # Run baseline compression
-        print("\n" + "="*80)
-        print("BASELINE COMPRESSION (lattice-hybrid)")
-        print("="*80)
-        compressed_baseline, info_baseline = compress_baseline(
-            embeddings, args.grid, args.k, args.seed
+        kmeans_config = KMeansConfig(
+            mode=args.kmeans_mode,
+            batch_size=args.kmeans_batch_size,
+            sample_size=args.kmeans_sample_size,
+            max_epochs=args.kmeans_epochs,
+            branching=args.kmeans_branching,
+            exact_assignment=args.kmeans_exact_assignment,
+            warm_start=args.kmeans_warm_start
         )
-        print(f"✓ Baseline compression complete")
-        print(f"  - Time: {info_baseline['compression_time_seconds']:.3f} seconds")
-        print(f"  - Unique centroids: {info_baseline['num_unique_centroids']}")
         
-        # Save baseline
-        baseline_dir = output_dir / 'baseline'
-        save_compressed_embeddings(compressed_baseline, info_baseline, baseline_dir)
+        if args.mode != 'lattice':
+            mode_dir = output_dir / args.mode
+            print("\n" + "="*80)
+            if args.mode == 'pq':
+                print(f"PRODUCT QUANTIZATION (m={args.pq_m}, ksub={args.pq_ksub})")
+                print("="*80)
+                codebooks, codes, mode_info = compress_pq(
+                    embeddings, args.pq_m, args.pq_ksub, args.seed, args.pq_train_size
+                )
+                print(f"✓ PQ compression complete")
+                print(f"  - Train time: {mode_info['train_time_seconds']:.3f}s")
+            else:
+                print(f"SCALAR QUANTIZATION ({SQ_BITS[args.mode]}-bit)")
+                print("="*80)
+                scale, offset, codes, mode_info = compress_sq(embeddings, SQ_BITS[args.mode])
+                print(f"✓ SQ compression complete")
+                print(f"  - Range pass time: {mode_info['range_pass_time_seconds']:.3f}s")
+            print(f"  - Encode time: {mode_info['quantization_time_seconds']:.3f}s")
+            print(f"  - Reconstruction MSE: {mode_info['reconstruction_mse']:.6f}")
+            
+            if args.mode == 'pq':
+                save_pq_embeddings(
+                    codebooks, codes, mode_info, mode_dir, embeddings.shape[1],
+                    dtype_policy=dtype_policy, drift_vectors=drift_vectors
+                )
+            else:
+                # Scale/offset are per-dimension float32 regardless of --dtype
+                mode_info['dtype'] = dtype_policy.name
+                save_sq_embeddings(scale, offset, codes, mode_info, mode_dir, embeddings.shape[1])
+            
+            run_config = {
+                'mode': args.mode,
+                'seed': int(args.seed),
+                'num_passages': int(embeddings.shape[0]),
+                'embedding_dim': int(embeddings.shape[1]),
+                args.mode: mode_info,
+                'out_of_core': bool(args.out_of_core),
+                'dtype': dtype_policy.name
+            }
+            # Kept next to the store: output_dir/run_config.json belongs to the lattice run
+            # (append_reference, baseline/boundary info) and must survive a pq/sq run
+            config_path = mode_dir / 'run_config.json'
+            with open(config_path, 'w') as f:
+                json.dump(run_config, f, indent=2)
+            print(f"\n✓ Saved run configuration to {config_path}")
+            
+            print("\n" + "="*80)
+            print(f"SUCCESS: {args.mode} compression complete")
+            print("="*80)
+            return 0
         
-        # Run boundary-aware compression
-        print("\n" + "="*80)
-        print("BOUNDARY-AWARE COMPRESSION")
-        print("="*80)
-        compressed_boundary, info_boundary = compress_boundary_aware(
-            embeddings, args.grid, args.k, args.seed
+        if sweep:
+            print("\n" + "="*80)
+            print(f"PARAMETER SWEEP ({len(grid_values) * len(k_values)} configs)")
+            print("="*80)
+            manifest = run_sweep(
+                embeddings, grid_values, k_values, args.seed, output_dir, kmeans_config,
+                args.workers, args.reassign_after_snap,
+                cache_dir=Path(args.kmeans_cache_dir) if args.kmeans_cache_dir else None,
+                max_disk_bytes=int(args.kmeans_cache_max_mb * 1024 * 1024),
+                compare_cold=args.compare_full_inertia,
+                dtype_policy=dtype_policy,
+                report_drift=args.report_dtype_drift,
+                lattice=args.lattice,
+                boundary_encoding=args.boundary_encoding,
+                residual_bits=args.residual_bits,
+                code_encoding=args.code_encoding,
+                code_block_size=args.code_block_size
+            )
+            if 'kmeans_ladder' in manifest:
+                ladder = manifest['kmeans_ladder']
+                print(f"✓ Warm-started k ladder: {ladder['ladder_time_seconds']:.3f}s")
+                for rung in ladder['rungs']:
+                    line = f"  - k={rung['k']}: inertia {rung['inertia']:.4f}"
+                    if rung['iterations'] is not None:
+                        line += f", {rung['iterations']} iterations"
+                    if 'inertia_ratio_vs_cold' in rung:
+                        line += f", ratio vs cold {rung['inertia_ratio_vs_cold']:.4f}"
+                    print(line)
+                if 'cold_time_seconds' in ladder:
+                    print(f"  - Cold starts: {ladder['cold_time_seconds']:.3f}s")
+            print(f"✓ Compressed {len(manifest['configs'])} configs with {manifest['workers']} workers "
+                  f"in {manifest['wall_time_seconds']:.2f}s")
+            for config in manifest['configs']:
+                print(f"  - {config['output_dir']}: baseline {config['baseline']['num_unique_centroids']} codes, "
+                      f"boundary {config['boundary']['num_unique_centroids']} codes")
+            print(f"✓ Saved sweep manifest to {output_dir / 'sweep_manifest.json'}")
+            
+            print("\n" + "="*80)
+            print("SUCCESS: Sweep complete")
+            print("="*80)
+            return 0
+        
+        # One k-means fit shared by both compression modes
+        fit_cache = KMeansFitCache(
+            cache_dir=Path(args.kmeans_cache_dir) if args.kmeans_cache_dir else None,
+            max_disk_bytes=int(args.kmeans_cache_max_mb * 1024 * 1024)
         )
-        print(f"✓ Boundary-aware compression complete")
-        print(f"  - Time: {info_boundary['compression_time_seconds']:.3f} seconds")
-        print(f"  - Unique centroids: {info_boundary['num_unique_centroids']}")
-        print(f"  - Boundary vectors: {info_boundary['num_boundary_vectors']}")
-        print(f"  - Bulk vectors: {info_boundary['num_bulk_vectors']}")
         
-        # Save boundary-aware
+        baseline_dir = output_dir / 'baseline'
         boundary_dir = output_dir / 'boundary'
-        save_compressed_embeddings(compressed_boundary, info_boundary, boundary_dir)
+        output_dir.mkdir(parents=True, exist_ok=True)
+        
+        if args.out_of_core:
+            print("\n" + "="*80)
+            print("OUT-OF-CORE COMPRESSION (baseline + boundary-aware)")
+            print("="*80)
+            info_baseline, info_boundary = compress_out_of_core(
+                embeddings, baseline_dir, boundary_dir, args.grid, args.k, args.seed,
+                kmeans_config, args.chunk_size, args.reassign_after_snap,
+                threshold_sample_size=args.kmeans_sample_size,
+                dtype_policy=dtype_policy,
+                report_drift=args.report_dtype_drift,
+                lattice=args.lattice,
+                centroids_path=output_dir / CENTROIDS_FILENAME,
+                threshold_estimator=args.threshold_estimator,
+                sketch_workers=args.workers,
+                code_encoding=args.code_encoding,
+                code_block_size=args.code_block_size
+            )
+            print(f"✓ Out-of-core compression complete")
+            print(f"  - Baseline unique centroids: {info_baseline['num_unique_centroids']}")
+            print(f"  - Boundary-aware unique centroids: {info_boundary['num_unique_centroids']}")
+            print(f"  - Boundary vectors: {info_boundary['num_boundary_vectors']} (threshold from "
+                  f"{info_boundary['boundary_threshold_estimator']} in {info_boundary['boundary_threshold_time_seconds']:.3f}s)")
+            print(f"  - Peak RSS: {info_baseline['peak_rss_bytes'] / 1024**2:.1f} MB")
+            print(f"✓ Saved compressed stores to {baseline_dir} and {boundary_dir}")
+        else:
+            # Run baseline compression
+            print("\n" + "="*80)
+            print("BASELINE COMPRESSION (lattice-hybrid)")
+            print("="*80)
+            codebook_baseline, codes_baseline, info_baseline = compress_baseline(
+                embeddings, args.grid, args.k, args.seed, fit_cache, args.reassign_after_snap, kmeans_config,
+                args.lattice
+            )
+            print(f"✓ Baseline compression complete")
+            print(f"  - Time: {info_baseline['compression_time_seconds']:.3f} seconds")
+            print(f"  - Unique centroids: {info_baseline['num_unique_centroids']}")
+        
+            # Save baseline
+            save_compressed_embeddings(
+                codebook_baseline, codes_baseline, None, info_baseline, baseline_dir,
+                dtype_policy=dtype_policy, drift_vectors=drift_vectors,
+                code_encoding=args.code_encoding, code_block_size=args.code_block_size
+            )
+        
+            # Run boundary-aware compression
+            print("\n" + "="*80)
+            print("BOUNDARY-AWARE COMPRESSION")
+            print("="*80)
+            residuals = None
+            if args.boundary_encoding == 'residual':
+                codebook_boundary, codes_boundary, residuals, info_boundary = compress_boundary_residual(
+                    embeddings, args.grid, args.k, args.seed, fit_cache, args.reassign_after_snap, kmeans_config,
+                    args.lattice, args.residual_bits
+                )
+                boundary_mask = None
+            else:
+                codebook_boundary, codes_boundary, boundary_mask, info_boundary = compress_boundary_aware(
+                    embeddings, args.grid, args.k, args.seed, fit_cache, args.reassign_after_snap, kmeans_config,
+                    args.lattice
+                )
+            print(f"✓ Boundary-aware compression complete ({args.boundary_encoding})")
+            print(f"  - Time: {info_boundary['compression_time_seconds']:.3f} seconds")
+            print(f"  - Unique centroids: {info_boundary['num_unique_centroids']}")
+            print(f"  - Boundary vectors: {info_boundary['num_boundary_vectors']}")
+            print(f"  - Bulk vectors: {info_boundary['num_bulk_vectors']}")
+        
+            # Keep the unsnapped centroids (a cache hit) and an ambiguity sketch so new
+            # passages can be appended later
+            fit, _ = get_kmeans_fit(embeddings, args.k, args.seed, fit_cache, kmeans_config)
+            np.save(output_dir / CENTROIDS_FILENAME, fit.centroids)
+            sketch = KLLSketch(seed=args.seed).update(fit.ambiguity_scores) if len(fit.centroids) >= 2 else None
+            
+            # Save boundary-aware
+            save_compressed_embeddings(
+                codebook_boundary, codes_boundary, boundary_mask, info_boundary, boundary_dir,
+                dtype_policy=dtype_policy, drift_vectors=drift_vectors, residuals=residuals,
+                ambiguity_sketch=sketch, code_encoding=args.code_encoding, code_block_size=args.code_block_size
+            )
         
         # Save run configuration
         run_config = {
+            'mode': 'lattice',
             'grid': float(args.grid),
+            'lattice': args.lattice,
+            'boundary_encoding': args.boundary_encoding,
+            'code_encoding': args.code_encoding,
+            'code_block_size': int(args.code_block_size),
             'k': int(args.k),
             'seed': int(args.seed),
             'num_passages': int(embeddings.shape[0]),
             'embedding_dim': int(embeddings.shape[1]),
             'baseline': info_baseline,
-            'boundary': info_boundary
+            'boundary': info_boundary,
+            'kmeans_mode': args.kmeans_mode,
+            'kmeans_batch_size': int(args.kmeans_batch_size),
+            'kmeans_epochs': int(args.kmeans_epochs),
+            'kmeans_sample_size': int(args.kmeans_sample_size),
+            'out_of_core': bool(args.out_of_core),
+            'threshold_estimator': args.threshold_estimator,
+            'dtype': dtype_policy.name,
+            # Reference point for msmarco_append.py drift tracking
+            'append_reference': {
+                'num_passages': int(embeddings.shape[0]),
+                'centroids_file': CENTROIDS_FILENAME,
+                'reconstruction_mse': info_baseline['reconstruction_mse'],
+                'boundary_threshold': info_boundary['boundary_threshold'],
+                'boundary_fraction': float(info_boundary['num_boundary_vectors'] / max(1, embeddings.shape[0]))
+            }
         }
         
+        if args.compare_full_inertia and args.kmeans_mode != 'full' and not args.out_of_core:
+            print("\n" + "="*80)
+            print("K-MEANS INERTIA VS FULL K-MEANS")
+            print("="*80)
+            inertia_report = compare_kmeans_inertia(embeddings, args.k, args.seed, fit_cache, kmeans_config)
+            print(f"  - {args.kmeans_mode} inertia: {inertia_report['inertia']:.4f}")
+            print(f"  - Full inertia: {inertia_report['full_inertia']:.4f}")
+            print(f"  - Ratio: {inertia_report['inertia_ratio_vs_full']:.4f}")
+            print(f"  - Full fit time: {inertia_report['full_fit_time_seconds']:.3f}s "
+                  f"(vs {info_baseline['kmeans_time_seconds']:.3f}s for {args.kmeans_mode})")
+            run_config['kmeans_inertia'] = inertia_report
+        
+        if args.kmeans_mode == 'hierarchical':
+            run_config['kmeans_branching'] = int(args.kmeans_branching)
+            run_config['kmeans_exact_assignment'] = bool(args.kmeans_exact_assignment)
+        
+        run_config['kmeans_cache'] = dict(fit_cache.stats)
+        
         config_path = output_dir / 'run_config.json'
         with open(config_path, 'w') as f:
             json.dump(run_config, f, indent=2)
@@ -353,11 +1881,12 @@ def main():
         print(f"\nOutput directories:")
         print(f"  - Baseline: {baseline_dir}")
         print(f"  - Boundary-aware: {boundary_dir}")
-        print(f"\nCompression overhead:")
-        overhead = info_boundary['compression_time_seconds'] - info_baseline['compression_time_seconds']
-        overhead_pct = (overhead / info_baseline['compression_time_seconds']) * 100 if info_baseline['compression_time_seconds'] > 0 else 0
-        print(f"  - Baseline: {info_baseline['compression_time_seconds']:.3f}s")
-        print(f"  - Boundary-aware: {info_boundary['compression_time_seconds']:.3f}s")
+        print(f"\nCompression overhead (excluding the shared k-means fit):")
+        overhead = info_boundary['quantization_time_seconds'] - info_baseline['quantization_time_seconds']
+        overhead_pct = (overhead / info_baseline['quantization_time_seconds']) * 100 if info_baseline['quantization_time_seconds'] > 0 else 0
+        print(f"  - K-means fit: {info_baseline['kmeans_time_seconds'] + info_boundary['kmeans_time_seconds']:.3f}s")
+        print(f"  - Baseline: {info_baseline['quantization_time_seconds']:.3f}s")
+        print(f"  - Boundary-aware: {info_boundary['quantization_time_seconds']:.3f}s")
         print(f"  - Overhead: {overhead:.3f}s ({overhead_pct:.1f}%)")
         
         return 0
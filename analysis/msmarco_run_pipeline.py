@@ -195,9 +195,11 @@ def generate_success_report(
         delta = ((boundary_val - baseline_val) / baseline_val * 100) if baseline_val > 0 else 0
         deltas[metric] = delta
     
-    # Compute compression overhead
-    baseline_time = compression_info['baseline']['compression_time_seconds']
-    boundary_time = compression_info['boundary']['compression_time_seconds']
+    # Compute compression overhead; the k-means fit is shared between modes,
+    # so compare quantization time when it is reported
+    time_key = 'quantization_time_seconds' if 'quantization_time_seconds' in compression_info['baseline'] else 'compression_time_seconds'
+    baseline_time = compression_info['baseline'][time_key]
+    boundary_time = compression_info['boundary'][time_key]
     time_overhead = ((boundary_time - baseline_time) / baseline_time * 100) if baseline_time > 0 else 0
     
     # Determine verdict
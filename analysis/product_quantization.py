@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+"""
+Product Quantization
+
+Vectorized NumPy product quantization (PQ). Each vector is split into m
+contiguous subvectors and every subvector is replaced by the index of its
+nearest entry in a per-subspace codebook of ksub <= 256 centroids, so a
+vector costs m bytes (uint8 codes).
+
+All m subspaces are trained together: the training vectors are reshaped
+to (m, n, dsub) and one batched Lloyd iteration runs a single matmul over
+every subspace. When dim is not a multiple of m, vectors are zero-padded
+to m * dsub; padded coordinates are zero in both data and codebooks, so
+they never affect distances.
+
+Usage:
+    from product_quantization import train_pq, encode_pq, decode_pq
+    codebooks = train_pq(vectors, m=8)
+    codes = encode_pq(vectors, codebooks)          # (n, 8) uint8
+    reconstructed = decode_pq(codebooks, codes, vectors.shape[1])
+    scorer = ADCScorer(codebooks, codes, vectors.shape[1])   # search without decoding
+    indices, scores = scorer.search_batch(queries, k=100)
+"""
+
+import numpy as np
+from typing import Iterator, Tuple
+
+from batched_search import DEFAULT_QUERY_BLOCK, blocked_top_k, normalize_rows
+from centroid_assignment import DEFAULT_BLOCK_BYTES, compute_block_rows
+from streaming_kmeans import sample_rows
+
+
+PQ_MAX_KSUB = 256
+
+# Byte budget of one gathered (rows, queries) block in ADCScorer, sized to stay in cache
+ADC_GATHER_BYTES = 256 * 1024
+
+
+def subspace_dim(dim: int, m: int) -> int:
+    """Width of each subspace (dim is zero-padded up to m * subspace_dim)."""
+    if not 1 <= m <= dim:
+        raise ValueError(f"Number of subspaces m={m} must be between 1 and dim={dim}")
+    return -(-dim // m)
+
+
+def split_subspaces(vectors: np.ndarray, m: int) -> np.ndarray:
+    """
+    View (n, dim) vectors as (m, n, dsub) subvectors, zero-padding dim if needed.
+
+    Returns:
+        (m, n, dsub) array in the compute dtype of the input
+    """
+    vectors = np.asarray(vectors)
+    n, dim = vectors.shape
+    dsub = subspace_dim(dim, m)
+    if m * dsub != dim:
+        padded = np.zeros((n, m * dsub), dtype=vectors.dtype)
+        padded[:, :dim] = vectors
+        vectors = padded
+    return vectors.reshape(n, m, dsub).transpose(1, 0, 2)
+
+
+def pq_block_rows(m: int, ksub: int, dsub: int, block_bytes: int = DEFAULT_BLOCK_BYTES) -> int:
+    """Rows per block so the (m, rows, ksub) distance block stays within block_bytes."""
+    return max(1, int(block_bytes // (4 * m * (ksub + dsub))))
+
+
+def _nearest_subcodes(subvectors: np.ndarray, codebooks: np.ndarray, codebook_sq_norms: np.ndarray) -> np.ndarray:
+    """
+    Nearest codebook entry per subspace for one block of subvectors.
+
+    Args:
+        subvectors: (m, rows, dsub) block
+        codebooks: (m, ksub, dsub) codebooks
+        codebook_sq_norms: (m, 1, ksub) squared codebook norms
+
+    Returns:
+        (m, rows) nearest entry index per subspace
+    """
+    # ||x||^2 is constant per row and subspace, so it does not change the argmin
+    scores = np.matmul(subvectors, codebooks.transpose(0, 2, 1))
+    scores *= -2
+    scores += codebook_sq_norms
+    return np.argmin(scores, axis=2)
+
+
+def _iter_subspace_blocks(vectors: np.ndarray, m: int, block_rows: int) -> Iterator[Tuple[int, np.ndarray]]:
+    """Yield (start, (m, rows, dsub)) subvector blocks of contiguous rows."""
+    for start in range(0, len(vectors), block_rows):
+        yield start, split_subspaces(vectors[start:start + block_rows], m)
+
+
+def _update_codebooks(subvectors: np.ndarray, labels: np.ndarray, codebooks: np.ndarray, rng: np.random.Generator):
+    """
+    Lloyd update of every subspace codebook in place.
+
+    Per-centroid sums use one bincount per coordinate over flattened
+    (subspace, centroid) bins. Empty centroids are reseeded from a random
+    training subvector of the same subspace.
+    """
+    m, n, dsub = subvectors.shape
+    ksub = codebooks.shape[1]
+    bins = (labels + np.arange(m)[:, None] * ksub).ravel()
+    counts = np.bincount(bins, minlength=m * ksub).reshape(m, ksub)
+    for j in range(dsub):
+        sums = np.bincount(bins, weights=subvectors[:, :, j].ravel(), minlength=m * ksub).reshape(m, ksub)
+        np.divide(sums, counts, out=codebooks[:, :, j], where=counts > 0)
+
+    empty_subspace, empty_centroid = np.nonzero(counts == 0)
+    if len(empty_subspace) > 0:
+        codebooks[empty_subspace, empty_centroid] = subvectors[
+            empty_subspace, rng.integers(0, n, size=len(empty_subspace))
+        ]
+
+
+def train_pq(
+    vectors: np.ndarray,
+    m: int,
+    ksub: int = PQ_MAX_KSUB,
+    random_state: int = 42,
+    train_size: int = 65536,
+    max_iter: int = 25,
+    tol: float = 1e-4,
+    block_bytes: int = DEFAULT_BLOCK_BYTES
+) -> np.ndarray:
+    """
+    Train m subspace codebooks with batched Lloyd iterations.
+
+    Args:
+        vectors: (n, dim) array, possibly memory-mapped
+        m: number of subspaces (bytes per vector)
+        ksub: codebook entries per subspace (at most 256; lowered to the training size)
+        random_state: random seed for the training sample and initialization
+        train_size: rows sampled for training
+        max_iter: maximum Lloyd iterations
+        tol: stop when the relative codebook shift falls below tol
+        block_bytes: memory budget for one distance block
+
+    Returns:
+        codebooks: (m, ksub, dsub) float array
+    """
+    if not 1 <= ksub <= PQ_MAX_KSUB:
+        raise ValueError(f"ksub={ksub} must be between 1 and {PQ_MAX_KSUB} for uint8 codes")
+
+    train = sample_rows(vectors, train_size, random_state)
+    compute_dtype = np.result_type(train.dtype, np.float32)
+    subvectors = np.ascontiguousarray(split_subspaces(train.astype(compute_dtype, copy=False), m))
+    m, n, dsub = subvectors.shape
+    ksub = min(ksub, n)
+
+    rng = np.random.default_rng(random_state)
+    # Forgy initialization: distinct training rows, drawn independently per subspace
+    init_rows = np.stack([rng.choice(n, size=ksub, replace=False) for _ in range(m)])
+    codebooks = np.take_along_axis(subvectors, init_rows[:, :, None], axis=1).copy()
+
+    block_rows = pq_block_rows(m, ksub, dsub, block_bytes)
+    labels = np.empty((m, n), dtype=np.int64)
+    for _ in range(max_iter):
+        sq_norms = np.einsum('mkd,mkd->mk', codebooks, codebooks)[:, None, :]
+        for start in range(0, n, block_rows):
+            labels[:, start:start + block_rows] = _nearest_subcodes(
+                subvectors[:, start:start + block_rows], codebooks, sq_norms
+            )
+        previous = codebooks.copy()
+        _update_codebooks(subvectors, labels, codebooks, rng)
+        shift = np.linalg.norm(codebooks - previous) / (np.linalg.norm(previous) + 1e-12)
+        if shift < tol:
+            break
+
+    return codebooks
+
+
+def encode_pq(
+    vectors: np.ndarray,
+    codebooks: np.ndarray,
+    block_bytes: int = DEFAULT_BLOCK_BYTES
+) -> np.ndarray:
+    """
+    Encode vectors to uint8 PQ codes in row blocks.
+
+    Args:
+        vectors: (n, dim) array, possibly memory-mapped
+        codebooks: (m, ksub, dsub) codebooks from train_pq
+        block_bytes: memory budget for one distance block
+
+    Returns:
+        codes: (n, m) uint8 array
+    """
+    m, ksub, dsub = codebooks.shape
+    compute_dtype = np.result_type(vectors.dtype, codebooks.dtype, np.float32)
+    codebooks = codebooks.astype(compute_dtype, copy=False)
+    sq_norms = np.einsum('mkd,mkd->mk', codebooks, codebooks)[:, None, :]
+
+    codes = np.empty((len(vectors), m), dtype=np.uint8)
+    for start, block in _iter_subspace_blocks(vectors, m, pq_block_rows(m, ksub, dsub, block_bytes)):
+        block = block.astype(compute_dtype, copy=False)
+        codes[start:start + block.shape[1]] = _nearest_subcodes(block, codebooks, sq_norms).T
+    return codes
+
+
+def decode_pq(codebooks: np.ndarray, codes: np.ndarray, dim: int) -> np.ndarray:
+    """
+    Reconstruct vectors from PQ codes.
+
+    Args:
+        codebooks: (m, ksub, dsub) codebooks
+        codes: (n, m) uint8 codes
+        dim: original dimension (padding is dropped)
+
+    Returns:
+        (n, dim) array of reconstructed vectors
+    """
+    m = codebooks.shape[0]
+    codes = np.asarray(codes)
+    # (n, m, dsub) gather, then flatten subspaces back into one row
+    reconstructed = codebooks[np.arange(m), codes]
+    return reconstructed.reshape(len(codes), -1)[:, :dim]
+
+
+def pq_reconstruction_mse(
+    vectors: np.ndarray,
+    codebooks: np.ndarray,
+    codes: np.ndarray,
+    block_rows: int = 65536
+) -> float:
+    """MSE of vectors against their PQ reconstruction, accumulated blockwise in float64."""
+    codebooks = np.asarray(codebooks, dtype=np.float64)
+    dim = vectors.shape[1]
+    total = 0.0
+    for start in range(0, len(vectors), block_rows):
+        diff = np.asarray(vectors[start:start + block_rows], dtype=np.float64) - \
+            decode_pq(codebooks, codes[start:start + block_rows], dim)
+        total += float(np.einsum('ij,ij->', diff, diff))
+    return total / max(1, vectors.size)
+
+
+class ADCScorer:
+    """
+    Cosine-similarity search by asymmetric distance computation (ADC).
+
+    Passages stay as codes. For each query block, a lookup table of
+    sub-codeword x query-subvector inner products, (m, ksub, q), is built
+    with one batched matmul. A passage's score is then the sum of its m
+    table entries, gathered one subspace at a time over a block of codes
+    (each gather copies whole q-wide table rows).
+    Passage norms come from per-subspace squared-norm tables in the same
+    way (subspaces are disjoint), so nothing is ever decoded.
+
+    A single codebook with (n,) codes (a lattice codebook store) is the
+    m = 1 case. Tables and scores are computed in the dtype of the codebooks
+    (at least float32), so callers cast them with DtypePolicy.to_compute.
+    """
+
+    def __init__(
+        self,
+        codebooks: np.ndarray,
+        codes: np.ndarray,
+        dim: int,
+        block_bytes: int = DEFAULT_BLOCK_BYTES
+    ):
+        """
+        Args:
+            codebooks: (m, ksub, dsub) codebooks, or (ksub, dim) for a single codebook,
+                       in the compute dtype
+            codes: (n, m) codes, or (n,) for a single codebook
+            dim: vector dimension (padding is dropped)
+            block_bytes: byte budget for one (queries, passages) score block
+        """
+        codebooks = np.asarray(codebooks)
+        codebooks = codebooks.astype(np.result_type(codebooks.dtype, np.float32), copy=False)
+        self.codebooks = codebooks[None] if codebooks.ndim == 2 else codebooks
+        codes = np.asarray(codes)
+        # (m, n): each subspace's codes contiguous for the gathers
+        self.codes = np.ascontiguousarray(codes.reshape(len(codes), -1).T)
+        self.dim = dim
+        self.block_bytes = block_bytes
+
+        sq_norm_tables = np.einsum('mkd,mkd->mk', self.codebooks, self.codebooks)
+        sq_norms = np.zeros(self.num_passages, dtype=self.codebooks.dtype)
+        for j in range(self.m):
+            sq_norms += sq_norm_tables[j, self.codes[j]]
+        self.norms = np.sqrt(sq_norms)
+
+    @property
+    def m(self) -> int:
+        return int(self.codebooks.shape[0])
+
+    @property
+    def num_passages(self) -> int:
+        return int(self.codes.shape[1])
+
+    def __len__(self) -> int:
+        return self.num_passages
+
+    def lookup_tables(self, queries: np.ndarray) -> np.ndarray:
+        """(m, ksub, q) inner products of each sub-codeword with each query subvector."""
+        subqueries = split_subspaces(np.asarray(queries, dtype=self.codebooks.dtype), self.m)
+        return np.matmul(self.codebooks, subqueries.transpose(0, 2, 1))
+
+    def score_codes(self, tables: np.ndarray, start: int, stop: int) -> np.ndarray:
+        """(q, stop - start) cosine similarities of normalized queries with passages [start, stop)."""
+        num_queries = tables.shape[2]
+        scores = np.empty((num_queries, stop - start), dtype=tables.dtype)
+        # Small row groups keep the gathered (rows, q) block and its transpose in cache
+        group_rows = max(1, ADC_GATHER_BYTES // (tables.dtype.itemsize * num_queries))
+        for row in range(start, stop, group_rows):
+            row_stop = min(row + group_rows, stop)
+            gathered = np.take(tables[0], self.codes[0, row:row_stop], axis=0)
+            for j in range(1, self.m):
+                gathered += np.take(tables[j], self.codes[j, row:row_stop], axis=0)
+            gathered /= (self.norms[row:row_stop] + 1e-10)[:, None]
+            scores[:, row - start:row_stop - start] = gathered.T
+        return scores
+
+    def search_batch(
+        self,
+        queries: np.ndarray,
+        k: int,
+        query_block: int = DEFAULT_QUERY_BLOCK
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Top-k passage indices and cosine similarities for a (q, dim) query batch, highest first."""
+        dtype = self.codebooks.dtype
+        queries = normalize_rows(np.atleast_2d(queries)).astype(dtype, copy=False)
+        k = min(k, self.num_passages)
+        indices = np.empty((len(queries), k), dtype=np.int64)
+        scores = np.empty((len(queries), k), dtype=dtype)
+        block_rows = compute_block_rows(min(query_block, max(1, len(queries))), dtype.itemsize, self.block_bytes)
+        for start in range(0, len(queries), query_block):
+            block = queries[start:start + query_block]
+            tables = self.lookup_tables(block)
+            indices[start:start + len(block)], scores[start:start + len(block)] = blocked_top_k(
+                lambda _, row_start, row_stop: self.score_codes(tables, row_start, row_stop),
+                block, self.num_passages, k, block_rows
+            )
+        return indices, scores
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Mergeable Quantile Sketch
+
+A KLL sketch (Karnin, Lang, Liberty) for quantiles of a stream of floats,
+used for the boundary ambiguity threshold: it is built chunk by chunk,
+merged across worker processes, and persisted next to the codebook, so
+the 10th-percentile ambiguity of a corpus never needs every score in
+memory.
+
+The sketch keeps a stack of compactors. Level h holds items of weight
+2**h; when a level exceeds its capacity it is sorted and every other item
+(random offset) is promoted to the next level. Capacities shrink by 2/3
+per level below the top, so the sketch holds O(k) items, and the rank
+error is about 1.7 / k of the stream length (~1% at the default k=200).
+
+Usage:
+    from quantile_sketch import KLLSketch
+    sketch = KLLSketch()
+    for chunk_scores in chunks:
+        sketch.update(chunk_scores)
+    sketch.merge(other_worker_sketch)
+    threshold = sketch.quantile(0.10)
+    sketch.save(path); sketch = KLLSketch.load(path)
+"""
+
+import json
+import numpy as np
+from pathlib import Path
+from typing import Dict, Optional
+
+
+DEFAULT_SKETCH_K = 200
+
+# Capacity ratio between consecutive levels (top level has capacity k)
+CAPACITY_DECAY = 2.0 / 3.0
+
+
+class KLLSketch:
+    """KLL quantile sketch over float64 values."""
+
+    def __init__(self, k: int = DEFAULT_SKETCH_K, seed: Optional[int] = 0):
+        if k < 8:
+            raise ValueError(f"Sketch size k must be at least 8, got {k}")
+        self.k = int(k)
+        self.levels = [np.zeros(0, dtype=np.float64)]
+        self.count = 0
+        self.min = float('inf')
+        self.max = float('-inf')
+        self._rng = np.random.default_rng(seed)
+
+    def __len__(self) -> int:
+        """Number of values the sketch has summarized."""
+        return self.count
+
+    @property
+    def num_retained(self) -> int:
+        """Number of items the sketch holds."""
+        return int(sum(len(level) for level in self.levels))
+
+    def _capacity(self, level: int) -> int:
+        depth = len(self.levels) - 1 - level
+        return max(2, int(np.ceil(self.k * CAPACITY_DECAY ** depth)))
+
+    def _compress(self):
+        """Compact every level over capacity, bottom up."""
+        level = 0
+        while level < len(self.levels):
+            if len(self.levels[level]) > self._capacity(level):
+                if level + 1 == len(self.levels):
+                    self.levels.append(np.zeros(0, dtype=np.float64))
+                items = np.sort(self.levels[level])
+                # An odd item out stays behind at this level
+                keep = items[len(items) - len(items) % 2:]
+                promoted = items[int(self._rng.integers(2)):len(items) - len(items) % 2:2]
+                self.levels[level] = keep
+                self.levels[level + 1] = np.concatenate([self.levels[level + 1], promoted])
+            level += 1
+
+    def update(self, values: np.ndarray) -> 'KLLSketch':
+        """Add a batch of values (NaNs are ignored)."""
+        values = np.asarray(values, dtype=np.float64).ravel()
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return self
+        self.count += len(values)
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self._compress()
+        return self
+
+    def merge(self, other: 'KLLSketch') -> 'KLLSketch':
+        """Fold another sketch into this one, level by level."""
+        if other.count == 0:
+            return self
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.zeros(0, dtype=np.float64))
+        for level, items in enumerate(other.levels):
+            self.levels[level] = np.concatenate([self.levels[level], items])
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self._compress()
+        return self
+
+    def _weighted_items(self):
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(level), 2.0 ** h) for h, level in enumerate(self.levels)])
+        order = np.argsort(items, kind='stable')
+        return items[order], np.cumsum(weights[order])
+
+    def quantile(self, q: float) -> float:
+        """
+        Approximate q-quantile (0 <= q <= 1) of the summarized values.
+
+        Returns:
+            the smallest retained item whose weighted rank reaches q, with
+            q=0 and q=1 mapped to the exact minimum and maximum
+        """
+        if self.count == 0:
+            raise ValueError("Quantile of an empty sketch")
+        if not 0.0 <= q <= 1.0:
+            raise ValueError(f"Quantile must be in [0, 1], got {q}")
+        if q == 0.0:
+            return self.min
+        if q == 1.0:
+            return self.max
+        items, cumulative = self._weighted_items()
+        index = int(np.searchsorted(cumulative, q * cumulative[-1], side='left'))
+        return float(items[min(index, len(items) - 1)])
+
+    def rank(self, value: float) -> float:
+        """Approximate fraction of summarized values <= value."""
+        if self.count == 0:
+            return 0.0
+        items, cumulative = self._weighted_items()
+        index = int(np.searchsorted(items, value, side='right'))
+        return float(cumulative[index - 1] / cumulative[-1]) if index > 0 else 0.0
+
+    def to_dict(self) -> Dict:
+        return {
+            'type': 'kll',
+            'k': self.k,
+            'count': int(self.count),
+            'min': self.min if self.count else None,
+            'max': self.max if self.count else None,
+            'levels': [level.tolist() for level in self.levels]
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict, seed: Optional[int] = None) -> 'KLLSketch':
+        """Rebuild a sketch from to_dict output (seed defaults to the stored count)."""
+        if data.get('type') != 'kll':
+            raise ValueError(f"Unsupported sketch type: {data.get('type')}")
+        sketch = cls(data['k'], seed=data['count'] if seed is None else seed)
+        sketch.levels = [np.asarray(level, dtype=np.float64) for level in data['levels']] or sketch.levels
+        sketch.count = int(data['count'])
+        if sketch.count:
+            sketch.min = float(data['min'])
+            sketch.max = float(data['max'])
+        return sketch
+
+    def save(self, path: Path):
+        """Write the sketch as JSON."""
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f)
+
+    @classmethod
+    def load(cls, path: Path) -> 'KLLSketch':
+        """Read a sketch written by save."""
+        with open(path, 'r') as f:
+            return cls.from_dict(json.load(f))
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Two-Stage Retrieval: Compressed Candidates + Exact Rerank
+
+Production retrieval ranks a candidate set from compressed vectors, then
+reranks it with full-precision vectors. RerankSearcher wraps any first-stage
+searcher (exact search over decoded passages, packed SQ, codebook, ADC, ...):
+
+- the first stage returns the top max(k, depth) candidates
+- the top `depth` are rescored by exact cosine similarity against the
+  original embeddings, gathered row by row (sorted, for locality) from a
+  memory-mapped passages_embeddings.npy, optionally a float16 copy of it
+- the reranked candidates come first (descending similarity, ties by
+  ascending passage index), followed by the rest of the first-stage order
+
+The searcher counts the rows and the distinct 4 KiB pages it reads from the
+originals, so callers can report bytes touched per query.
+
+Usage:
+    from rerank import RerankSearcher, open_rerank_vectors
+    originals = open_rerank_vectors(data_dir / 'passages_embeddings.npy', 'float16')
+    searcher = RerankSearcher(first_stage, originals, depth=200)
+    indices, scores = searcher.search_batch(query_embeddings, k=100)
+"""
+
+import time
+import numpy as np
+from pathlib import Path
+from typing import Dict, Tuple
+
+from batched_search import DEFAULT_QUERY_BLOCK, normalize_rows, sort_top_k
+
+
+RERANK_DTYPES = ['float32', 'float16']
+
+# Page size used to count the bytes a gather touches in the memory-mapped originals
+PAGE_BYTES = 4096
+
+# Rows converted per step when writing the float16 copy of the originals
+CONVERT_BLOCK_ROWS = 65536
+
+
+def open_rerank_vectors(embeddings_path: Path, dtype: str = 'float32') -> np.ndarray:
+    """
+    Memory-map the original passage embeddings for reranking.
+
+    For float16, a copy is written once next to the originals
+    (<name>_float16.npy, rebuilt when older than the source) and mapped.
+
+    Returns:
+        (n, dim) read-only memory-mapped array
+    """
+    embeddings_path = Path(embeddings_path)
+    if dtype not in RERANK_DTYPES:
+        raise ValueError(f"Unknown rerank dtype: {dtype} (expected one of {RERANK_DTYPES})")
+    originals = np.load(embeddings_path, mmap_mode='r')
+    if dtype == 'float32' or originals.dtype == np.float16:
+        return originals
+
+    copy_path = embeddings_path.with_name(f"{embeddings_path.stem}_float16.npy")
+    if not copy_path.exists() or copy_path.stat().st_mtime < embeddings_path.stat().st_mtime:
+        print(f"Writing float16 rerank copy {copy_path}...")
+        copy = np.lib.format.open_memmap(copy_path, mode='w+', dtype=np.float16, shape=originals.shape)
+        for start in range(0, len(originals), CONVERT_BLOCK_ROWS):
+            copy[start:start + CONVERT_BLOCK_ROWS] = originals[start:start + CONVERT_BLOCK_ROWS]
+        copy.flush()
+        del copy
+    return np.load(copy_path, mmap_mode='r')
+
+
+def pages_touched(rows: np.ndarray, row_bytes: int, page_bytes: int = PAGE_BYTES) -> int:
+    """Distinct pages covered by a set of rows of a row-major array (header offset ignored)."""
+    rows = np.unique(rows)
+    if len(rows) == 0:
+        return 0
+    first = rows * row_bytes // page_bytes
+    last = (rows * row_bytes + row_bytes - 1) // page_bytes
+    # Pages of each row not already covered by an earlier row
+    covered = np.concatenate([[-1], np.maximum.accumulate(last)[:-1]])
+    return int(np.maximum(last - np.maximum(first, covered + 1) + 1, 0).sum())
+
+
+class RerankSearcher:
+    """First-stage top-depth candidates reranked exactly against memory-mapped original embeddings."""
+
+    def __init__(self, first_stage, originals: np.ndarray, depth: int):
+        """
+        Args:
+            first_stage: object with search_batch(queries, k, query_block) -> (indices, scores)
+            originals: (n, dim) original embeddings, typically memory-mapped
+            depth: candidates reranked per query
+        """
+        self.first_stage = first_stage
+        self.originals = originals
+        self.depth = depth
+        self.row_bytes = int(originals.shape[1] * originals.dtype.itemsize)
+        self.reset_stats()
+
+    def __len__(self) -> int:
+        return len(self.first_stage)
+
+    def reset_stats(self):
+        """Zero the gather and timing counters."""
+        self.queries_reranked = 0
+        self.rows_gathered = 0
+        self.pages_gathered = 0
+        self.rerank_seconds = 0.0
+
+    def stats(self) -> Dict:
+        """Per-query averages of the counters since the last reset_stats."""
+        queries = max(1, self.queries_reranked)
+        return {
+            'rerank_rows_per_query': self.rows_gathered / queries,
+            'rerank_bytes_per_query': self.rows_gathered * self.row_bytes / queries,
+            'rerank_page_bytes_per_query': self.pages_gathered * PAGE_BYTES / queries,
+            'rerank_time_ms_per_query': self.rerank_seconds * 1000 / queries
+        }
+
+    def rerank(self, query: np.ndarray, candidates: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Exact cosine rerank of one query's candidates.
+
+        Args:
+            query: (dim,) normalized float32 query
+            candidates: (r,) passage indices (-1 entries are dropped)
+
+        Returns:
+            indices, scores: (r',) arrays, highest similarity first
+        """
+        rows = np.sort(candidates[candidates >= 0])
+        vectors = normalize_rows(np.asarray(self.originals[rows], dtype=np.float32))
+        self.rows_gathered += len(rows)
+        self.pages_gathered += pages_touched(rows, self.row_bytes)
+        indices, scores = sort_top_k((vectors @ query)[None, :], rows[None, :])
+        return indices[0], scores[0]
+
+    def search_batch(
+        self,
+        queries: np.ndarray,
+        k: int,
+        query_block: int = DEFAULT_QUERY_BLOCK
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Top-k passages for every query: reranked candidates, then the rest of the first stage.
+
+        Returns:
+            indices: (q, k') passage indices, k' = min(max(k, depth), n) clipped to k
+            scores: (q, k') exact similarities for reranked entries, first-stage scores after
+        """
+        queries = np.atleast_2d(queries)
+        candidates, first_scores = self.first_stage.search_batch(queries, max(k, self.depth), query_block)
+        depth = min(self.depth, candidates.shape[1])
+        k = min(k, candidates.shape[1])
+        indices = candidates[:, :k].copy()
+        scores = np.asarray(first_scores[:, :k], dtype=np.float32).copy()
+
+        start = time.perf_counter()
+        normalized = normalize_rows(np.asarray(queries, dtype=np.float32))
+        for row, query in enumerate(normalized):
+            reranked, reranked_scores = self.rerank(query, candidates[row, :depth])
+            keep = min(k, len(reranked))
+            indices[row, :keep] = reranked[:keep]
+            scores[row, :keep] = reranked_scores[:keep]
+            # Candidates dropped as -1 leave first-stage padding after the reranked head
+            indices[row, keep:min(k, depth)] = -1
+        self.rerank_seconds += time.perf_counter() - start
+        self.queries_reranked += len(queries)
+        return indices, scores
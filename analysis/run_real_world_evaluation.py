@@ -11,6 +11,8 @@ This script orchestrates the complete validation pipeline:
 Usage:
     python analysis/run_real_world_evaluation.py --config analysis/real_world_validation_config.json
     python analysis/run_real_world_evaluation.py --datasets synthetic --quick
+    python analysis/run_real_world_evaluation.py --datasets synthetic --quick --dtype float16 --report-dtype-drift
+    python analysis/run_real_world_evaluation.py --datasets synthetic --quick --kmeans-algorithm elkan --kmeans-tol 1e-4
 """
 
 import json
@@ -39,6 +41,13 @@ from real_world_validation import (
     HardwareInfo,
     RunMetadata
 )
+from accelerated_kmeans import ACCELERATED_ALGORITHMS, KMeansRunStats, accelerated_kmeans, summarize_kmeans_stats
+from centroid_assignment import assign_nearest
+from code_streams import DEFAULT_CODE_BLOCK, code_stream_bits
+from dtype_policy import DEFAULT_DTYPE, DTYPE_CHOICES, DtypePolicy, mean_squared_error, metric_drift
+from kmeans_cache import FitFunction, KMeansFitCache, build_fit
+from kmeans_ladder import compare_ladder_to_cold, kmeans_ladder, seed_fit_cache
+from lattice_quantizers import LATTICES, snap_to_lattice, unique_float_rows
 
 
 def load_config(config_path: str) -> Dict:
@@ -108,15 +117,67 @@ def generate_synthetic_embeddings(
     return np.array(embeddings), labels
 
 
+def lloyd_kmeans(
+    embeddings: np.ndarray,
+    k: int,
+    seed: int = 0,
+    max_iter: int = 10,
+    tol: float = 0.0,
+    algorithm: str = 'auto',
+    stats_log: Optional[List[KMeansRunStats]] = None
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Lloyd k-means (at most max_iter iterations) initialized from the first k points.
+    
+    Runs through accelerated_kmeans: Hamerly/Elkan bounds skip distances
+    that cannot change an assignment, and the run stops early once no
+    label changes (or the relative centroid shift drops below tol), so
+    results match plain Lloyd iterations up to floating point ties.
+    
+    The seed is unused (initialization is deterministic) and only present
+    to match the fit-cache fit function signature.
+    
+    Args:
+        embeddings: (n, d) array of embeddings
+        k: number of clusters
+        seed: unused
+        max_iter: maximum Lloyd iterations
+        tol: relative centroid shift tolerance (0 stops only on unchanged labels)
+        algorithm: 'auto', 'hamerly', 'elkan' or 'lloyd' (see ACCELERATED_ALGORITHMS)
+        stats_log: optional list the run's KMeansRunStats is appended to
+    
+    Returns:
+        centroids: K-means centroids
+        assignments: cluster index per embedding
+    """
+    # Centroid means accumulate in float64 so float32/float16 policies do not drift
+    centroids, assignments, stats = accelerated_kmeans(embeddings, embeddings[:k], max_iter, tol, algorithm)
+    if stats_log is not None:
+        stats_log.append(stats)
+    return centroids, assignments
+
+
 def simple_kmeans_compression(
     embeddings: np.ndarray,
     k: int,
     grid_step: float,
-    boundary_aware: bool = False
+    boundary_aware: bool = False,
+    fit_cache: Optional[KMeansFitCache] = None,
+    kmeans_method: str = 'lloyd10',
+    lattice: str = 'grid',
+    fit_fn: Optional[FitFunction] = None
 ) -> Tuple[np.ndarray, np.ndarray]:
     """
     Simple k-means compression with optional boundary-aware treatment.
     
+    When fit_cache is given, the k-means fit is shared across grid steps
+    and methods; only snapping and assignment are redone. kmeans_method
+    selects the cached fits to use ('ladder' for fits seeded by a
+    warm-started k ladder); missing fits are computed with fit_fn
+    (default: lloyd_kmeans).
+    lattice selects the lattice centroids are snapped to (see LATTICES),
+    scaled to the point density of the grid_step cubic grid.
+    
     Returns:
         compressed_embeddings: Compressed version of input
         centroids: K-means centroids
@@ -127,57 +188,39 @@ def simple_kmeans_compression(
         return embeddings.copy(), embeddings.copy()
     
     # K-means clustering
-    centroids = embeddings[:k].copy()
-    
-    for _ in range(10):  # 10 iterations
-        # Assign to nearest centroid
-        distances = np.linalg.norm(
-            embeddings[:, np.newaxis, :] - centroids[np.newaxis, :, :],
-            axis=2
-        )
-        assignments = np.argmin(distances, axis=1)
-        
-        # Update centroids
-        for i in range(k):
-            cluster_points = embeddings[assignments == i]
-            if len(cluster_points) > 0:
-                centroids[i] = cluster_points.mean(axis=0)
+    if fit_fn is None:
+        fit_fn = lloyd_kmeans
+    if fit_cache is not None:
+        fit, _ = fit_cache.get_or_fit(embeddings, k, 0, fit_fn, method=kmeans_method)
+    else:
+        fit = build_fit(embeddings, *fit_fn(embeddings, k, 0))
+    centroids = fit.centroids
     
-    # Grid quantization of centroids
-    snapped_centroids = np.round(centroids / grid_step) * grid_step
+    # Lattice quantization of centroids
+    snapped_centroids = snap_to_lattice(centroids, grid_step, lattice).astype(centroids.dtype, copy=False)
     
     if boundary_aware:
         # Classify boundary vectors
-        distances = np.linalg.norm(
-            embeddings[:, np.newaxis, :] - centroids[np.newaxis, :, :],
-            axis=2
-        )
-        sorted_dists = np.sort(distances, axis=1)
-        ambiguity = sorted_dists[:, 1] - sorted_dists[:, 0] if k > 1 else sorted_dists[:, 0]
+        ambiguity = fit.ambiguity_scores if k > 1 else fit.top2_distances[:, 0]
         
         # Bottom 10% are boundary vectors
         threshold = np.percentile(ambiguity, 10)
         is_boundary = ambiguity <= threshold
         
         # Finer grid for boundary
-        boundary_centroids = np.round(centroids / (grid_step * 0.5)) * (grid_step * 0.5)
+        boundary_centroids = snap_to_lattice(centroids, grid_step * 0.5, lattice).astype(centroids.dtype, copy=False)
         
         # Compress with appropriate centroids
         compressed = np.zeros_like(embeddings)
-        for i in range(n):
-            if is_boundary[i]:
-                dists = np.linalg.norm(boundary_centroids - embeddings[i], axis=1)
-                compressed[i] = boundary_centroids[np.argmin(dists)]
-            else:
-                dists = np.linalg.norm(snapped_centroids - embeddings[i], axis=1)
-                compressed[i] = snapped_centroids[np.argmin(dists)]
+        if np.any(is_boundary):
+            assignments, _ = assign_nearest(embeddings[is_boundary], boundary_centroids)
+            compressed[is_boundary] = boundary_centroids[assignments]
+        if np.any(~is_boundary):
+            assignments, _ = assign_nearest(embeddings[~is_boundary], snapped_centroids)
+            compressed[~is_boundary] = snapped_centroids[assignments]
     else:
         # Vanilla: assign to nearest snapped centroid
-        distances = np.linalg.norm(
-            embeddings[:, np.newaxis, :] - snapped_centroids[np.newaxis, :, :],
-            axis=2
-        )
-        assignments = np.argmin(distances, axis=1)
+        assignments, _ = assign_nearest(embeddings, snapped_centroids)
         compressed = snapped_centroids[assignments]
     
     return compressed, snapped_centroids
@@ -188,11 +231,22 @@ def run_evaluation_experiment(
     embeddings: np.ndarray,
     config: Dict,
     seed: int,
-    output_dir: Path
+    output_dir: Path,
+    dtype_policy: Optional[DtypePolicy] = None,
+    save: bool = True
 ) -> Dict[str, Any]:
-    """Run evaluation experiment on a single dataset."""
+    """
+    Run evaluation experiment on a single dataset.
+    
+    Embeddings are cast to the dtype policy's compute dtype (float32 by
+    default) before compression; MSE always accumulates in float64.
+    """
+    if dtype_policy is None:
+        dtype_policy = DtypePolicy()
+    embeddings = dtype_policy.to_compute(embeddings)
+    
     print(f"\n{'='*80}")
-    print(f"Evaluating: {dataset_id} (seed={seed})")
+    print(f"Evaluating: {dataset_id} (seed={seed}, dtype={dtype_policy.name})")
     print(f"{'='*80}\n")
     
     results = {
@@ -200,6 +254,7 @@ def run_evaluation_experiment(
         'seed': seed,
         'embedding_dimension': embeddings.shape[1],
         'num_vectors': embeddings.shape[0],
+        'dtype': dtype_policy.name,
         'timestamp': datetime.utcnow().isoformat(),
         'hardware': asdict(get_hardware_info()),
         'experiments': []
@@ -212,6 +267,34 @@ def run_evaluation_experiment(
     grid_values = np.linspace(grid_sweep['min'], grid_sweep['max'], grid_sweep['steps'])
     k_values = np.linspace(k_sweep['min'], k_sweep['max'], k_sweep['steps'], dtype=int)
     
+    # K-means fits depend only on (data, k), so share them across methods and grid steps
+    fit_cache = KMeansFitCache()
+    kmeans_max_iter = int(config['compression_configs'].get('kmeans_max_iter', 10))
+    kmeans_tol = float(config['compression_configs'].get('kmeans_tol', 0.0))
+    kmeans_algorithm = config['compression_configs'].get('kmeans_algorithm', 'auto')
+    code_block_size = int(config['compression_configs'].get('code_block_size', DEFAULT_CODE_BLOCK))
+    kmeans_stats: List[KMeansRunStats] = []
+    
+    def fit_fn(fit_embeddings: np.ndarray, fit_k: int, fit_seed: int) -> Tuple[np.ndarray, np.ndarray]:
+        return lloyd_kmeans(fit_embeddings, fit_k, fit_seed, kmeans_max_iter, kmeans_tol, kmeans_algorithm, kmeans_stats)
+    
+    # Bound-based algorithms give Lloyd's result, so only the stopping rule names the fits
+    kmeans_method = f"lloyd{kmeans_max_iter}" + (f"-tol{kmeans_tol:g}" if kmeans_tol > 0 else "")
+    lattice = config['compression_configs'].get('lattice', 'grid')
+    results['lattice'] = lattice
+    
+    if config['compression_configs'].get('kmeans_warm_start', False):
+        # Fit the whole k ladder up front, each k warm-started from the one below
+        fits, ladder_report = kmeans_ladder(embeddings, k_values, 0, fit_fn=fit_fn)
+        ladder = compare_ladder_to_cold(embeddings, ladder_report, 0, fit_fn=fit_fn)
+        seed_fit_cache(fit_cache, embeddings, fits, 0, method='ladder')
+        kmeans_method = 'ladder'
+        results['kmeans_ladder'] = ladder
+        
+        print(f"Warm-started k ladder: {ladder['ladder_time_seconds']:.3f}s "
+              f"(cold starts: {ladder['cold_time_seconds']:.3f}s, "
+              f"max inertia ratio vs cold: {ladder['max_inertia_ratio_vs_cold']:.4f})")
+    
     for method in config['compression_configs']['methods']:
         boundary_aware = (method == 'boundary-aware')
         
@@ -224,13 +307,13 @@ def run_evaluation_experiment(
                 
                 # Compress
                 compressed, centroids = simple_kmeans_compression(
-                    embeddings, k, grid_step, boundary_aware
+                    embeddings, k, grid_step, boundary_aware, fit_cache, kmeans_method, lattice, fit_fn
                 )
                 
                 compression_time = time.time() - start_time
                 
                 # Compute metrics
-                mse = np.mean((embeddings - compressed) ** 2)
+                mse = mean_squared_error(embeddings, compressed)
                 
                 # Retrieval metrics
                 recall_10 = compute_recall_at_k(embeddings, compressed, k=10)
@@ -239,12 +322,18 @@ def run_evaluation_experiment(
                 ndcg_10 = compute_ndcg(embeddings, compressed, k=10)
                 
                 # Memory footprint estimate
-                unique_centroids = len(np.unique(compressed.reshape(compressed.shape[0], -1), axis=0))
+                unique_first, codes = unique_float_rows(compressed)
+                unique_centroids = len(unique_first)
                 memory_bits = unique_centroids * embeddings.shape[1] * 32  # float32
                 
+                # Real per-passage code cost, measured by encoding the codes
+                code_bits = code_stream_bits(codes, unique_centroids, code_block_size)
+                total_bits = (memory_bits + code_bits['huffman'] * len(codes)) / len(codes)
+                
                 experiment = {
                     'method': method,
                     'grid_step': float(grid_step),
+                    'lattice': lattice,
                     'k': int(k),
                     'mse_global': float(mse),
                     'recall_at_10': float(recall_10),
@@ -253,24 +342,69 @@ def run_evaluation_experiment(
                     'ndcg_at_10': float(ndcg_10),
                     'compression_time_seconds': float(compression_time),
                     'memory_bits': int(memory_bits),
-                    'unique_centroids': int(unique_centroids)
+                    'unique_centroids': int(unique_centroids),
+                    'code_bits_per_vector': {name: code_bits[name] for name in ('array', 'bitpacked', 'huffman')},
+                    'code_entropy_bits_per_vector': code_bits['entropy'],
+                    'total_bits_per_vector': float(total_bits)
                 }
                 
                 results['experiments'].append(experiment)
                 
                 print(f"  grid={grid_step:.3f}, k={k}: " +
                       f"MSE={mse:.4f}, Recall@10={recall_10:.3f}, " +
+                      f"Codes={code_bits['bitpacked']:.1f}/{code_bits['huffman']:.2f} bits packed/huffman, " +
                       f"Time={compression_time:.3f}s")
     
-    # Save results
-    output_file = output_dir / f"{dataset_id}_seed{seed}.json"
+    results['kmeans_acceleration'] = summarize_kmeans_stats(kmeans_stats)
+    print(f"\nK-means ({kmeans_algorithm}): {results['kmeans_acceleration']['num_fits']} fits, "
+          f"{results['kmeans_acceleration']['skipped_ratio']:.1%} of Lloyd distances skipped by bounds, "
+          f"{results['kmeans_acceleration']['skipped_ratio_vs_fixed']:.1%} vs {kmeans_max_iter} fixed iterations")
+    
+    if save:
+        save_results(results, output_dir)
+    
+    return results
+
+
+def save_results(results: Dict[str, Any], output_dir: Path):
+    """Save one dataset's results as <dataset_id>_seed<seed>.json."""
+    output_file = output_dir / f"{results['dataset_id']}_seed{results['seed']}.json"
     output_file.parent.mkdir(parents=True, exist_ok=True)
     with open(output_file, 'w') as f:
         json.dump(results, f, indent=2)
     
     print(f"\nResults saved to: {output_file}")
+
+
+DRIFT_METRICS = ['mse_global', 'recall_at_10', 'recall_at_100', 'mrr', 'ndcg_at_10']
+
+
+def summarize_dtype_drift(experiments: List[Dict], reference_experiments: List[Dict]) -> Dict[str, Any]:
+    """
+    Drift of per-experiment metrics against a float64 rerun of the same sweep.
     
-    return results
+    Returns:
+        dict with the largest absolute drift per metric and the
+        per-experiment drift keyed by method, grid step and k
+    """
+    reference = {(e['method'], e['grid_step'], e['k']): e for e in reference_experiments}
+    per_experiment = []
+    max_abs_diff = {key: 0.0 for key in DRIFT_METRICS}
+    
+    for experiment in experiments:
+        key = (experiment['method'], experiment['grid_step'], experiment['k'])
+        if key not in reference:
+            continue
+        drift = metric_drift(experiment, reference[key], DRIFT_METRICS)
+        for metric, values in drift.items():
+            max_abs_diff[metric] = max(max_abs_diff[metric], values['abs_diff'])
+        per_experiment.append({'method': key[0], 'grid_step': key[1], 'k': key[2], 'drift': drift})
+    
+    return {
+        'reference_dtype': 'float64',
+        'max_abs_diff': max_abs_diff,
+        'experiments': per_experiment
+    }
 
 
 def main():
@@ -297,8 +431,39 @@ def main():
         default='results/real_world_validation',
         help='Output directory'
     )
+    parser.add_argument(
+        '--dtype',
+        choices=DTYPE_CHOICES,
+        default=DEFAULT_DTYPE,
+        help='Floating point policy: float32, float16 storage (float32 compute) or float64 (default: float32)'
+    )
+    parser.add_argument(
+        '--report-dtype-drift',
+        action='store_true',
+        help='Rerun each sweep in float64 and record the metric drift under dtype_drift'
+    )
+    parser.add_argument(
+        '--lattice',
+        choices=LATTICES,
+        default=None,
+        help='Lattice centroids are snapped to, overriding compression_configs.lattice'
+    )
+    parser.add_argument(
+        '--kmeans-algorithm',
+        choices=ACCELERATED_ALGORITHMS,
+        default=None,
+        help='Lloyd k-means variant (auto: Hamerly for low k, Elkan for higher k), '
+             'overriding compression_configs.kmeans_algorithm'
+    )
+    parser.add_argument(
+        '--kmeans-tol',
+        type=float,
+        default=None,
+        help='Relative centroid shift at which k-means stops early, overriding compression_configs.kmeans_tol'
+    )
     
     args = parser.parse_args()
+    dtype_policy = DtypePolicy(args.dtype)
     
     # Load configuration
     config_path = Path(args.config)
@@ -315,6 +480,13 @@ def main():
         config['execution']['runs_per_config'] = 1
         print("Quick mode enabled: reduced sweep steps")
     
+    if args.lattice is not None:
+        config['compression_configs']['lattice'] = args.lattice
+    if args.kmeans_algorithm is not None:
+        config['compression_configs']['kmeans_algorithm'] = args.kmeans_algorithm
+    if args.kmeans_tol is not None:
+        config['compression_configs']['kmeans_tol'] = args.kmeans_tol
+    
     # Determine which datasets to run
     all_results = []
     output_dir = Path(args.output)
@@ -339,8 +511,22 @@ def main():
                     embeddings,
                     config,
                     seed,
-                    output_dir
+                    output_dir,
+                    dtype_policy,
+                    save=False
                 )
+                
+                if args.report_dtype_drift and dtype_policy.name != 'float64':
+                    reference = run_evaluation_experiment(
+                        dataset_id, embeddings, config, seed, output_dir,
+                        DtypePolicy('float64'), save=False
+                    )
+                    results['dtype_drift'] = summarize_dtype_drift(results['experiments'], reference['experiments'])
+                    print(f"\nDtype drift vs float64 (max abs): " + ", ".join(
+                        f"{metric}={value:.2e}" for metric, value in results['dtype_drift']['max_abs_diff'].items()
+                    ))
+                
+                save_results(results, output_dir)
                 all_results.append(results)
     
     # Real-world datasets would require pre-computed embeddings
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""
+Scalar Quantization
+
+Per-dimension uniform scalar quantization (SQ) with packed integer codes:
+
+- sq8: one uint8 level per dimension (4x smaller than float32)
+- sq4: two 4-bit levels per byte, even dimension in the low nibble
+       (8x smaller than float32)
+
+Each dimension j is mapped to levels 0 .. 2^bits - 1 over its observed
+[min_j, max_j] range, which is computed in one streaming pass:
+
+    level = round((x - offset) / scale),  x ~= offset + scale * level
+
+scale and offset are stored next to the codes, so inner products can be
+scored against the packed codes without decoding the corpus:
+
+    q·x ~= q·offset + (q * scale)·level
+
+Usage:
+    from scalar_quantization import dimension_ranges, sq_parameters, encode_sq
+    scale, offset = sq_parameters(*dimension_ranges(vectors), bits=4)
+    codes = encode_sq(vectors, scale, offset, bits=4)   # (n, ceil(d / 2)) uint8
+"""
+
+import numpy as np
+from typing import Tuple
+
+from batched_search import DEFAULT_QUERY_BLOCK, search_in_blocks
+from centroid_assignment import DEFAULT_BLOCK_BYTES
+
+
+SQ_BITS = {'sq8': 8, 'sq4': 4}
+
+# Rows per block for streaming passes over (possibly memory-mapped) vectors
+SQ_BLOCK_ROWS = 65536
+
+
+def packed_dim(dim: int, bits: int) -> int:
+    """Bytes per vector for dim levels of the given bit width."""
+    if bits == 8:
+        return dim
+    if bits == 4:
+        return (dim + 1) // 2
+    raise ValueError(f"Unsupported scalar quantization bit width: {bits} (expected 8 or 4)")
+
+
+def dimension_ranges(vectors: np.ndarray, block_rows: int = SQ_BLOCK_ROWS) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Per-dimension minimum and maximum in one streaming pass over row blocks.
+
+    Returns:
+        mins, maxs: (dim,) float64 arrays
+    """
+    dim = vectors.shape[1]
+    mins = np.full(dim, np.inf)
+    maxs = np.full(dim, -np.inf)
+    for start in range(0, len(vectors), block_rows):
+        block = np.asarray(vectors[start:start + block_rows])
+        np.minimum(mins, block.min(axis=0), out=mins)
+        np.maximum(maxs, block.max(axis=0), out=maxs)
+    return mins, maxs
+
+
+def sq_parameters(mins: np.ndarray, maxs: np.ndarray, bits: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Per-dimension scale and offset mapping [min, max] onto 2^bits levels.
+
+    Constant dimensions get scale 1 so they encode to level 0 exactly.
+
+    Returns:
+        scale, offset: (dim,) float32 arrays
+    """
+    packed_dim(len(mins), bits)
+    levels = (1 << bits) - 1
+    span = np.asarray(maxs, dtype=np.float64) - np.asarray(mins, dtype=np.float64)
+    scale = np.where(span > 0, span / levels, 1.0)
+    return scale.astype(np.float32), np.asarray(mins, dtype=np.float32)
+
+
+def quantize_levels(vectors: np.ndarray, scale: np.ndarray, offset: np.ndarray, bits: int) -> np.ndarray:
+    """(rows, dim) uint8 levels for one block of vectors."""
+    block = np.asarray(vectors, dtype=np.float32)
+    levels = np.rint((block - offset) / scale)
+    np.clip(levels, 0, (1 << bits) - 1, out=levels)
+    return levels.astype(np.uint8)
+
+
+def pack_levels(levels: np.ndarray, bits: int) -> np.ndarray:
+    """Pack (rows, dim) uint8 levels into (rows, packed_dim) bytes."""
+    if bits == 8:
+        return levels
+    if levels.shape[1] % 2:
+        levels = np.concatenate([levels, np.zeros((len(levels), 1), dtype=np.uint8)], axis=1)
+    return levels[:, 0::2] | (levels[:, 1::2] << 4)
+
+
+def unpack_levels(codes: np.ndarray, bits: int, dim: int) -> np.ndarray:
+    """Unpack (rows, packed_dim) bytes into (rows, dim) uint8 levels."""
+    codes = np.asarray(codes)
+    if bits == 8:
+        return codes
+    levels = np.empty((len(codes), 2 * codes.shape[1]), dtype=np.uint8)
+    levels[:, 0::2] = codes & 0x0F
+    levels[:, 1::2] = codes >> 4
+    return levels[:, :dim]
+
+
+def encode_sq(
+    vectors: np.ndarray,
+    scale: np.ndarray,
+    offset: np.ndarray,
+    bits: int,
+    block_rows: int = SQ_BLOCK_ROWS
+) -> np.ndarray:
+    """
+    Encode vectors to packed scalar codes in row blocks.
+
+    Args:
+        vectors: (n, dim) array, possibly memory-mapped
+        scale, offset: (dim,) quantization parameters from sq_parameters
+        bits: 8 or 4
+        block_rows: rows encoded per block
+
+    Returns:
+        codes: (n, packed_dim) uint8 array
+    """
+    n, dim = vectors.shape
+    codes = np.empty((n, packed_dim(dim, bits)), dtype=np.uint8)
+    for start in range(0, n, block_rows):
+        levels = quantize_levels(vectors[start:start + block_rows], scale, offset, bits)
+        codes[start:start + len(levels)] = pack_levels(levels, bits)
+    return codes
+
+
+def decode_sq(codes: np.ndarray, scale: np.ndarray, offset: np.ndarray, bits: int, dim: int) -> np.ndarray:
+    """Reconstruct (rows, dim) float32 vectors from packed scalar codes."""
+    return unpack_levels(codes, bits, dim).astype(np.float32) * scale + offset
+
+
+def sq_reconstruction_mse(
+    vectors: np.ndarray,
+    scale: np.ndarray,
+    offset: np.ndarray,
+    codes: np.ndarray,
+    bits: int,
+    block_rows: int = SQ_BLOCK_ROWS
+) -> float:
+    """MSE of vectors against their scalar-quantized reconstruction, accumulated in float64."""
+    dim = vectors.shape[1]
+    total = 0.0
+    for start in range(0, len(vectors), block_rows):
+        diff = np.asarray(vectors[start:start + block_rows], dtype=np.float64) - \
+            decode_sq(codes[start:start + block_rows], scale, offset, bits, dim)
+        total += float(np.einsum('ij,ij->', diff, diff))
+    return total / max(1, vectors.size)
+
+
+class PackedScalarScorer:
+    """
+    Cosine-similarity search directly against packed scalar codes.
+
+    Passage norms are computed once from the codes. Each query batch is
+    folded into the quantization parameters (q * scale, q·offset), and the
+    corpus is scored one block of packed rows at a time with one GEMM per
+    block; sq4 rows are scored nibble by nibble, so no (n, dim) float
+    matrix is materialized.
+    """
+
+    def __init__(
+        self,
+        codes: np.ndarray,
+        scale: np.ndarray,
+        offset: np.ndarray,
+        bits: int,
+        dim: int,
+        block_bytes: int = DEFAULT_BLOCK_BYTES
+    ):
+        self.codes = codes
+        self.scale = np.asarray(scale, dtype=np.float32)
+        self.offset = np.asarray(offset, dtype=np.float32)
+        self.bits = bits
+        self.dim = dim
+        self.block_bytes = block_bytes
+        self.block_rows = max(1, int(block_bytes // (4 * dim)))
+
+        self.norms = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), self.block_rows):
+            block = decode_sq(codes[start:start + self.block_rows], self.scale, self.offset, bits, dim)
+            self.norms[start:start + len(block)] = np.sqrt(np.einsum('ij,ij->i', block, block))
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def score_block(self, queries: np.ndarray, start: int, stop: int) -> np.ndarray:
+        """(len(queries), stop - start) cosine similarities of normalized queries with passages [start, stop)."""
+        queries = np.asarray(queries, dtype=np.float32)
+        weights = queries * self.scale
+        bias = queries @ self.offset
+        block = np.asarray(self.codes[start:stop])
+        if self.bits == 8:
+            scores = weights @ block.T.astype(np.float32)
+        else:
+            if self.dim % 2:
+                weights = np.concatenate([weights, np.zeros((len(weights), 1), dtype=np.float32)], axis=1)
+            scores = weights[:, 0::2] @ (block & 0x0F).T.astype(np.float32)
+            scores += weights[:, 1::2] @ (block >> 4).T.astype(np.float32)
+        scores += bias[:, None]
+        return scores / (self.norms[start:stop] + 1e-10)
+
+    def search_batch(
+        self,
+        queries: np.ndarray,
+        k: int,
+        query_block: int = DEFAULT_QUERY_BLOCK
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Top-k passage indices and cosine similarities for a (q, dim) query batch, highest first."""
+        return search_in_blocks(
+            self.score_block, queries, len(self), k, np.dtype(np.float32), self.block_bytes, query_block
+        )
+
+    def search(self, query: np.ndarray, k: int) -> np.ndarray:
+        """Top-k passage indices by cosine similarity, highest first."""
+        return self.search_batch(np.asarray(query)[None, :], k)[0][0]
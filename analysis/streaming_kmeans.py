@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+"""
+Streaming K-Means Modes
+
+K-means fitting strategies for corpora that do not fit comfortably in RAM:
+
+- full:      sklearn KMeans(n_init=10) on the whole matrix (reference)
+- minibatch: sklearn MiniBatchKMeans trained with partial_fit on contiguous
+             row batches streamed from a (memory-mapped) embeddings file
+- sampled:   sklearn KMeans on a uniform random row sample
+- hierarchical: k-means tree with configurable branching (see
+             hierarchical_kmeans); labels by tree descent or, with
+             exact_assignment, by exact search over all leaves
+
+Minibatch and sampled fits label the full corpus with the blocked
+assignment engine, so memory stays bounded by the batch size.
+
+Usage:
+    from streaming_kmeans import KMeansConfig
+    config = KMeansConfig(mode='minibatch', batch_size=8192)
+    centroids, labels = config.fit(vectors, k, seed)
+"""
+
+import numpy as np
+from dataclasses import dataclass
+from typing import Iterator, Tuple
+
+from sklearn.cluster import KMeans, MiniBatchKMeans
+
+from centroid_assignment import assign_nearest
+from hierarchical_kmeans import DEFAULT_BRANCHING, fit_kmeans_tree
+
+
+KMEANS_MODES = ['full', 'minibatch', 'sampled', 'hierarchical']
+
+
+def iter_row_batches(
+    vectors: np.ndarray,
+    batch_size: int,
+    rng: np.random.Generator = None
+) -> Iterator[np.ndarray]:
+    """
+    Yield contiguous row batches, optionally in shuffled batch order.
+
+    Contiguous slices keep reads sequential on memory-mapped files; only
+    the order of the batches is randomized.
+    """
+    starts = np.arange(0, len(vectors), batch_size)
+    if rng is not None:
+        rng.shuffle(starts)
+    for start in starts:
+        yield np.asarray(vectors[start:start + batch_size])
+
+
+def label_vectors(vectors: np.ndarray, centroids: np.ndarray) -> Tuple[np.ndarray, float]:
+    """
+    Label every vector with its nearest centroid.
+
+    Returns:
+        labels: (n,) nearest-centroid indices
+        inertia: sum of squared distances to the assigned centroids
+    """
+    labels, distances = assign_nearest(vectors, centroids)
+    return labels, float(np.sum(distances.astype(np.float64) ** 2))
+
+
+def hierarchical_kmeans(
+    vectors: np.ndarray,
+    k: int,
+    random_state: int = 42,
+    branching: int = DEFAULT_BRANCHING,
+    exact_assignment: bool = False
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    K-means tree with about k leaves; the leaves are the centroids.
+
+    Returns:
+        centroids: (k, d) leaf centroids
+        labels: (n,) leaf index per vector, from the tree fit or, with
+            exact_assignment, from exact search over all leaves
+    """
+    tree, labels = fit_kmeans_tree(vectors, k, branching, random_state)
+    if exact_assignment:
+        labels, _ = assign_nearest(vectors, tree.leaves)
+    return tree.leaves, labels
+
+
+def full_kmeans(vectors: np.ndarray, k: int, random_state: int = 42) -> Tuple[np.ndarray, np.ndarray]:
+    """Full-batch KMeans(n_init=10) on the whole matrix."""
+    kmeans = KMeans(n_clusters=k, random_state=random_state, n_init=10)
+    kmeans.fit(vectors)
+    return kmeans.cluster_centers_, kmeans.labels_
+
+
+def minibatch_centroids(
+    vectors: np.ndarray,
+    k: int,
+    random_state: int = 42,
+    batch_size: int = 4096,
+    max_epochs: int = 3,
+    tol: float = 1e-4
+) -> np.ndarray:
+    """
+    Mini-batch KMeans centroids trained on streamed row batches.
+
+    Args:
+        vectors: (n, d) array, typically memory-mapped
+        k: number of clusters
+        random_state: random seed
+        batch_size: rows per streamed batch (raised to at least 3k)
+        max_epochs: maximum passes over the data
+        tol: stop when the relative centroid shift over an epoch falls below tol
+
+    Returns:
+        centroids: (k, d) cluster centroids
+    """
+    batch_size = max(int(batch_size), 3 * k)
+    rng = np.random.default_rng(random_state)
+    kmeans = MiniBatchKMeans(
+        n_clusters=k,
+        random_state=random_state,
+        batch_size=batch_size,
+        n_init=3
+    )
+
+    previous = None
+    for _ in range(max_epochs):
+        for batch in iter_row_batches(vectors, batch_size, rng):
+            # partial_fit needs at least k rows; the short tail batch is skipped
+            if len(batch) >= k:
+                kmeans.partial_fit(batch)
+
+        centroids = kmeans.cluster_centers_
+        if previous is not None:
+            shift = np.linalg.norm(centroids - previous) / (np.linalg.norm(previous) + 1e-12)
+            if shift < tol:
+                break
+        previous = centroids.copy()
+
+    return kmeans.cluster_centers_
+
+
+def minibatch_kmeans(
+    vectors: np.ndarray,
+    k: int,
+    random_state: int = 42,
+    batch_size: int = 4096,
+    max_epochs: int = 3,
+    tol: float = 1e-4
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Mini-batch KMeans trained on streamed row batches, then label all vectors.
+
+    Returns:
+        centroids: (k, d) cluster centroids
+        labels: (n,) nearest-centroid index per vector
+    """
+    centroids = minibatch_centroids(vectors, k, random_state, batch_size, max_epochs, tol)
+    labels, _ = label_vectors(vectors, centroids)
+    return centroids, labels
+
+
+def sample_rows(vectors: np.ndarray, sample_size: int, random_state: int = 42) -> np.ndarray:
+    """Uniform random row sample (without replacement), read in file order."""
+    n = len(vectors)
+    sample_size = min(n, int(sample_size))
+    rng = np.random.default_rng(random_state)
+    # Sorted indices turn the gather into a forward scan of the file
+    sample_indices = np.sort(rng.choice(n, size=sample_size, replace=False))
+    return np.asarray(vectors[sample_indices])
+
+
+def sampled_centroids(
+    vectors: np.ndarray,
+    k: int,
+    random_state: int = 42,
+    sample_size: int = 100000
+) -> np.ndarray:
+    """
+    Full KMeans centroids fitted on a uniform random sample of rows.
+
+    Args:
+        vectors: (n, d) array, typically memory-mapped
+        k: number of clusters
+        random_state: random seed
+        sample_size: rows to sample (raised to at least k)
+
+    Returns:
+        centroids: (k, d) cluster centroids
+    """
+    sample = sample_rows(vectors, max(int(sample_size), k), random_state)
+    centroids, _ = full_kmeans(sample, k, random_state)
+    return centroids
+
+
+def sampled_kmeans(
+    vectors: np.ndarray,
+    k: int,
+    random_state: int = 42,
+    sample_size: int = 100000
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Full KMeans on a uniform random sample of rows, then label all vectors.
+
+    Returns:
+        centroids: (k, d) cluster centroids
+        labels: (n,) nearest-centroid index per vector
+    """
+    centroids = sampled_centroids(vectors, k, random_state, sample_size)
+    labels, _ = label_vectors(vectors, centroids)
+    return centroids, labels
+
+
+@dataclass
+class KMeansConfig:
+    """
+    K-means fitting mode and its parameters.
+
+    warm_start marks fits taken from a k ladder (see kmeans_ladder), which are
+    seeded into the fit cache under their own method name; a fit missing
+    from the cache falls back to a cold start.
+    """
+    mode: str = 'full'
+    batch_size: int = 4096
+    sample_size: int = 100000
+    max_epochs: int = 3
+    branching: int = DEFAULT_BRANCHING
+    exact_assignment: bool = False
+    warm_start: bool = False
+
+    def __post_init__(self):
+        if self.mode not in KMEANS_MODES:
+            raise ValueError(f"Unknown k-means mode: {self.mode} (expected one of {KMEANS_MODES})")
+
+    @property
+    def cache_method(self) -> str:
+        """Fit-cache method name encoding the mode and its parameters."""
+        if self.mode == 'minibatch':
+            method = f"minibatch-b{self.batch_size}-e{self.max_epochs}"
+        elif self.mode == 'sampled':
+            method = f"sampled-s{self.sample_size}"
+        elif self.mode == 'hierarchical':
+            method = f"tree-b{self.branching}-{'exact' if self.exact_assignment else 'tree'}"
+        else:
+            method = 'sklearn'
+        return f"{method}-ladder" if self.warm_start else method
+
+    def fit_centroids(self, vectors: np.ndarray, k: int, random_state: int = 42) -> np.ndarray:
+        """Fit centroids only, without labelling the corpus."""
+        if self.mode == 'minibatch':
+            return minibatch_centroids(vectors, k, random_state, self.batch_size, self.max_epochs)
+        if self.mode == 'sampled':
+            return sampled_centroids(vectors, k, random_state, self.sample_size)
+        if self.mode == 'hierarchical':
+            return fit_kmeans_tree(vectors, k, self.branching, random_state)[0].leaves
+        return full_kmeans(vectors, k, random_state)[0]
+
+    def fit(self, vectors: np.ndarray, k: int, random_state: int = 42) -> Tuple[np.ndarray, np.ndarray]:
+        """Fit k-means with this mode; returns (centroids, labels)."""
+        if self.mode == 'minibatch':
+            return minibatch_kmeans(vectors, k, random_state, self.batch_size, self.max_epochs)
+        if self.mode == 'sampled':
+            return sampled_kmeans(vectors, k, random_state, self.sample_size)
+        if self.mode == 'hierarchical':
+            return hierarchical_kmeans(vectors, k, random_state, self.branching, self.exact_assignment)
+        return full_kmeans(vectors, k, random_state)